@@ -1,5 +1,6 @@
 import io
 import os
+import re
 from urllib.parse import urlparse
 import discord
 from discord import app_commands
@@ -7,7 +8,11 @@ from discord.ui import View, Button
 from dotenv import load_dotenv
 import httpx
 
-from llava import run_llava
+from config import settings
+from derivatives import get_derivatives
+from image_store import image_store
+from inference_worker import stream_question
+from llava import model_revision, translate_to_korean
 from record import *
 from models import *
 from database import *
@@ -37,6 +42,152 @@ questions = {
     4: "캘린더에 보수 공사 일정을 추가할게요"
 }
 
+# ----- LLaVA 답변 스트리밍 / 캐시 / 중복 요청 병합 -----
+# 문장 끝: 마침표/물음표/느낌표 + 공백 + 대문자나 한글 (e.g., i.e. 같은 약어 뒤는 제외)
+SENTENCE_END = re.compile(r"(?<![A-Za-z]\.[A-Za-z]\.)(?<=[.!?])\s+(?=[A-Z가-힣])")
+MIN_SENTENCE_CHARS = 20 # 이보다 짧은 조각은 다음 문장과 묶어서 번역
+EMPTY_ANSWER = "❌ 답변을 생성하지 못했습니다. 다시 질문해 주세요."
+
+def split_sentences(text: str) -> tuple[list[str], str]:
+    """
+    완성된 문장 목록과 아직 이어질 수 있는 나머지 텍스트를 돌려줍니다.
+    """
+
+    sentences, start = [], 0
+    for match in SENTENCE_END.finditer(text):
+        if match.start() - start >= MIN_SENTENCE_CHARS:
+            sentences.append(text[start:match.start()])
+            start = match.end()
+    return sentences, text[start:]
+
+class AnswerStream:
+    """
+    생성 중인 답변(한국어 번역 누적본)을 여러 Discord 요청이 함께 지켜볼 수 있게 공유합니다.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self.error: Exception | None = None
+        self.version = 0
+        self._cond = asyncio.Condition()
+
+    async def _publish(self):
+        async with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+
+    async def update(self, text: str):
+        self.text = text
+        await self._publish()
+
+    async def finish(self, text: str | None = None, error: Exception | None = None):
+        if text is not None:
+            self.text = text
+        self.error = error
+        self.done = True
+        await self._publish()
+
+    async def wait_for_update(self, version: int) -> int:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.version != version)
+            return self.version
+
+
+_answer_streams: dict[tuple, AnswerStream] = {}
+
+async def _produce_answer(stream: AnswerStream, key: tuple, image_url: str, defect_type: str, urgency: str):
+    defect_id, question, model_revision = key
+
+    try:
+        cached = await get_cached_answer(defect_id, question, model_revision) if defect_id else None
+        if cached is not None:
+            print(f"✅ 캐시된 답변 사용 (ID: {defect_id})")
+            await stream.finish(cached)
+            return
+
+        # 영문 조각을 모으다가 문장이 완성될 때마다 번역해서 이어 붙임
+        korean_sentences, english_buffer = [], ""
+        async for chunk in stream_question(image_url, question, defect_id, defect_type, urgency):
+            english_buffer += chunk
+            sentences, english_buffer = split_sentences(english_buffer)
+            for sentence in sentences:
+                korean_sentences.append(await asyncio.to_thread(translate_to_korean, sentence))
+                await stream.update("\n".join(korean_sentences))
+
+        if english_buffer.strip():
+            korean_sentences.append(await asyncio.to_thread(translate_to_korean, english_buffer.strip()))
+
+        answer = "\n".join(korean_sentences)
+        if defect_id and answer:
+            await save_cached_answer(defect_id, question, model_revision, answer)
+        await stream.finish(answer)
+
+    except Exception as e:
+        print(f"❌ LLaVA 답변 생성 실패 (ID: {defect_id}): {e}")
+        await stream.finish(error=e)
+
+def get_answer_stream(image_url: str, question: str, defect_id: str, defect_type: str, urgency: str) -> AnswerStream:
+    """
+    같은 (defect_id, 질문, 모델 id@revision)의 답변은 DB에 저장해 두었다가 바로 돌려줍니다.
+    같은 질문을 이미 생성 중이면 새로 생성하지 않고 진행 중인 스트림을 함께 구독합니다.
+    """
+
+    key = (defect_id, question, model_revision())
+    stream = _answer_streams.get(key) if defect_id else None
+    if stream is None:
+        stream = AnswerStream()
+        task = asyncio.create_task(_produce_answer(stream, key, image_url, defect_type, urgency))
+        if defect_id:
+            _answer_streams[key] = stream
+            task.add_done_callback(lambda _: _answer_streams.pop(key, None))
+    return stream
+
+async def send_streamed_answer(interaction: discord.Interaction, stream: AnswerStream):
+    """
+    하나의 follow-up 메시지를 만들어 답변이 늘어날 때마다 수정합니다.
+    Discord 수정 rate limit을 넘지 않도록 DISCORD_EDIT_INTERVAL 초에 한 번만 반영합니다.
+    """
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    message = None
+    last_edit = 0.0
+    version = 0
+    shown = ""
+
+    while not stream.done:
+        wait = None
+        if stream.text != shown: # 아직 반영하지 못한 내용이 있으면 다음 수정 가능 시각까지만 대기
+            wait = max(0.0, settings.DISCORD_EDIT_INTERVAL - (loop.time() - last_edit))
+        try:
+            version = await asyncio.wait_for(stream.wait_for_update(version), wait)
+        except asyncio.TimeoutError:
+            pass
+
+        if stream.done or stream.text == shown or loop.time() - last_edit < settings.DISCORD_EDIT_INTERVAL:
+            continue
+
+        shown = stream.text
+        content = f"{shown} ✍️"[:2000]
+        if message is None:
+            message = await interaction.followup.send(content, wait=True)
+            print(f"ℹ️ 첫 답변 표시까지 {loop.time() - started:.2f}s")
+        else:
+            await message.edit(content=content)
+        last_edit = loop.time()
+
+    if stream.error is not None:
+        content = f"❌ 답변 생성 실패: {stream.error}"
+    else:
+        content = stream.text[:2000] or EMPTY_ANSWER # 빈 메시지는 Discord가 거절함
+
+    if message is None:
+        await interaction.followup.send(content)
+    else:
+        await message.edit(content=content)
+
+
 # ----- 버튼 UI 정의 -----
 class QuestionView(View):
     def __init__(self, image_url: str, defect_id: str, defect_type: str, urgency: str, address: str):
@@ -54,11 +205,11 @@ class QuestionView(View):
 
         await interaction.response.defer(thinking=True)
         print(f"img url: {self.image_url}")
-        result = await asyncio.to_thread(
-            run_llava, self.image_url, questions[1], self.defect_id, self.defect_type, self.urgency
+        stream = get_answer_stream(
+            self.image_url, questions[1], self.defect_id, self.defect_type, self.urgency
         )
         
-        await interaction.followup.send(result)
+        await send_streamed_answer(interaction, stream)
 
     # Q2 - "어떤 조치가 필요할지 조언해주세요"
     @discord.ui.button(label=questions[2], style=discord.ButtonStyle.primary)
@@ -66,11 +217,11 @@ class QuestionView(View):
         await interaction.channel.send(f"{interaction.user.mention}님이 **[{button.label}]** 버튼을 눌렀습니다.\n")
 
         await interaction.response.defer(thinking=True)
-        result = await asyncio.to_thread(
-            run_llava, self.image_url, questions[2], self.defect_id, self.defect_type, self.urgency
+        stream = get_answer_stream(
+            self.image_url, questions[2], self.defect_id, self.defect_type, self.urgency
         )
         
-        await interaction.followup.send(result)
+        await send_streamed_answer(interaction, stream)
 
     # Q3 - "모든 손상 기록을 조회할게요"
     @discord.ui.button(label=questions[3], style=discord.ButtonStyle.secondary)
@@ -111,28 +262,28 @@ async def send_defect_alert(defect: DefectOut, llava_summary: str):
 
         image_url = defect.image
 
+        # 미리보기 파생본이 있으면 원본 대신 첨부 (아직 생성 중이면 잠깐 기다림)
+        derivatives = await get_derivatives([image_url], wait=settings.DERIVATIVE_ALERT_WAIT)
+        attach_url = derivatives.get(image_url, {}).get("preview", image_url)
+
+        # 추론 때 받아 둔 이미지를 그대로 첨부 (캐시에 없으면 이때 받음)
+        try:
+            image_bytes = await image_store.get_bytes(attach_url)
+        except Exception as e:
+            print(f"❌ 이미지 다운로드 실패: {attach_url} / {e}")
+            return
+
         # 1) S3 URL인 경우
         if image_url.startswith("http://") or image_url.startswith("https://"):
-            try:
-                resp = requests.get(image_url, timeout=10)
-                resp.raise_for_status()
-            except requests.RequestException as e:
-                print(f"❌ S3 이미지 다운로드 실패: {image_url} / {e}")
-                return
-
-            buf = BytesIO(resp.content)
-            parsed = urlparse(image_url)
-            filename = os.path.basename(parsed.path) or f"defect_{defect.id}.jpg"
-            discord_file = discord.File(buf, filename=filename)
-
+            filename = os.path.basename(urlparse(attach_url).path) or f"defect_{defect.id}.jpg"
             view_image_url = image_url
 
         else:
             # 2) 로컬 경로인 경우
-            image_path = "." + image_url
-            discord_file = discord.File(image_path, filename=os.path.basename(image_path))
-            view_image_url = image_path
+            view_image_url = "." + image_url
+            filename = os.path.basename(attach_url)
 
+        discord_file = discord.File(BytesIO(image_bytes), filename=filename)
         view = QuestionView(image_url=view_image_url, defect_id=defect.id, defect_type=defect.defect_type, urgency=defect.urgency, address=defect.address)
         
         await channel.send(content=llava_summary, file=discord_file, view=view)
@@ -0,0 +1,181 @@
+import asyncio
+import math
+import time
+
+from config import settings
+from metrics import admission_limit, admission_rejected, analysis_throughput, stage_seconds
+from database import get_defect_by_id, get_unfinished_jobs, update_job_status
+
+
+class AdmissionController:
+    """
+    분석 작업 큐 앞에서 받을 수 있는 작업 수를 제한합니다.
+    - 한도 = 측정된 처리량(작업/초) x ADMISSION_TARGET_WAIT, ADMISSION_MIN_QUEUE ~ ADMISSION_MAX_QUEUE 사이
+    - 드론(source) 하나는 한도의 ADMISSION_SOURCE_SHARE까지만 차지
+    처리량은 작업이 하나라도 있는 동안의 시간만 세므로, 한가할 때 한도가 줄어들지 않습니다.
+    """
+
+    WINDOW_SECONDS = 5.0   # 처리량 표본 하나를 만드는 최소 작업 시간
+    SMOOTHING = 0.3        # 처리량 EWMA 가중치
+
+    def __init__(self):
+        self.outstanding = 0
+        self._by_source: dict[str, int] = {}
+        self.throughput = 0.0              # 작업/초 (0이면 아직 측정 전, ADMISSION_INITIAL_THROUGHPUT 사용)
+
+        self._busy_mark: float | None = None
+        self._window_busy = 0.0
+        self._window_done = 0
+
+    def limit(self) -> int:
+        throughput = self.throughput or settings.ADMISSION_INITIAL_THROUGHPUT
+        limit = int(throughput * settings.ADMISSION_TARGET_WAIT)
+        return max(settings.ADMISSION_MIN_QUEUE, min(settings.ADMISSION_MAX_QUEUE, limit))
+
+    def admit(self, source: str, count: int = 1) -> int:
+        """
+        source의 작업 count개 중 지금 받을 수 있는 개수를 돌려주고 그만큼 자리를 잡습니다.
+        """
+
+        limit = self.limit()
+        source_quota = max(1, int(limit * settings.ADMISSION_SOURCE_SHARE))
+        free, source_free = limit - self.outstanding, source_quota - self._by_source.get(source, 0)
+        admitted = max(0, min(count, free, source_free))
+
+        if admitted < count:
+            reason = "queue_full" if free <= source_free else "source_quota"
+            admission_rejected.inc(count - admitted, reason=reason)
+        if admitted:
+            self._reserve(source, admitted)
+        return admitted
+
+    def _reserve(self, source: str, count: int):
+        if self.outstanding == 0:
+            self._busy_mark = time.monotonic()
+        self.outstanding += count
+        self._by_source[source] = self._by_source.get(source, 0) + count
+        admission_limit.set(self.limit())
+
+    def reserve_recovered(self, count: int):
+        # 재시작 전에 이미 받은 작업은 한도와 상관없이 자리를 잡음
+        if count:
+            self._reserve("recovered", count)
+
+    def cancel(self, source: str, count: int):
+        # 자리를 잡았지만 저장에 실패해서 작업을 넣지 못한 경우 (처리량 측정에는 넣지 않음)
+        self.outstanding -= count
+        remaining = self._by_source.get(source, count) - count
+        if remaining > 0:
+            self._by_source[source] = remaining
+        else:
+            self._by_source.pop(source, None)
+
+    def release(self, source: str):
+        now = time.monotonic()
+        self._window_busy += now - self._busy_mark
+        self._busy_mark = now
+        self._window_done += 1
+
+        self.outstanding -= 1
+        remaining = self._by_source.get(source, 1) - 1
+        if remaining > 0:
+            self._by_source[source] = remaining
+        else:
+            self._by_source.pop(source, None)
+
+        if self._window_busy >= self.WINDOW_SECONDS:
+            sample = self._window_done / self._window_busy
+            self.throughput = sample if self.throughput <= 0 else (1 - self.SMOOTHING) * self.throughput + self.SMOOTHING * sample
+            self._window_busy, self._window_done = 0.0, 0
+            analysis_throughput.set(self.throughput)
+        admission_limit.set(self.limit())
+
+    def retry_after(self, count: int = 1) -> int:
+        """
+        count개를 더 받을 자리가 생길 때까지 걸릴 것으로 보이는 시간(초)입니다.
+        """
+
+        throughput = self.throughput or settings.ADMISSION_INITIAL_THROUGHPUT
+        excess = self.outstanding + count - self.limit()
+        return max(1, min(120, math.ceil(max(excess, 1) / throughput)))
+
+
+class AnalysisQueue:
+    """
+    /defect-info로 들어온 손상의 LLaVA 분석 + Discord 알림을 요청과 분리해서 처리하는 작업 큐입니다.
+    작업 상태는 SQLite analysis_jobs 테이블에 기록되므로(pending → analyzing → done/failed),
+    서버가 재시작되면 끝나지 않은 작업을 다시 불러와 이어서 처리합니다.
+    handler는 DefectOut을 받아 분석이 반영된 DefectOut을 돌려주는 코루틴 함수입니다.
+    작업을 넣기 전에 admission.admit()으로 자리를 잡아야 하며, 자리는 작업이 끝나면 돌려줍니다.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self.admission = AdmissionController()
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._workers: list[asyncio.Task] = []
+        self._handler = None
+
+    async def start(self, handler):
+        self._handler = handler
+
+        jobs = await get_unfinished_jobs()
+        self.admission.reserve_recovered(len(jobs))
+        for job_id, defect_id in jobs:
+            self.enqueue(job_id, defect_id, "recovered")
+        if jobs:
+            print(f"ℹ️ 미완료 분석 작업 {len(jobs)}건을 다시 등록했습니다.")
+
+        # 분류 배치(LlavaBatchScheduler)가 채워질 수 있도록 여러 작업을 동시에 진행
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def enqueue(self, job_id: str, defect_id: str, source: str):
+        self._queue.put_nowait((job_id, defect_id, source))
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def _worker(self):
+        while True:
+            job_id, defect_id, source = await self._queue.get()
+            try:
+                await self.run(job_id, defect_id, source)
+            except Exception:
+                pass # run()에서 상태와 로그를 남김
+            finally:
+                self._queue.task_done()
+
+    async def run(self, job_id: str, defect_id: str, source: str):
+        """
+        작업 하나를 바로 실행하고 결과 DefectOut을 돌려줍니다. 실패하면 failed로 기록한 뒤 예외를 다시 던집니다.
+        admission에서 잡아 둔 source의 자리는 성공/실패와 관계없이 돌려줍니다.
+        """
+
+        await update_job_status(job_id, "analyzing")
+        started = time.perf_counter()
+        try:
+            defect = await get_defect_by_id(defect_id)
+            if defect is None:
+                raise LookupError(f"Defect ID '{defect_id}'를 찾을 수 없습니다.")
+
+            result = await self._handler(defect)
+            await update_job_status(job_id, "done")
+            return result
+
+        except Exception as e:
+            print(f"❌ 분석 작업 실패 (job: {job_id}, ID: {defect_id}): {e}")
+            await update_job_status(job_id, "failed", f"{type(e).__name__}: {e}")
+            raise
+
+        finally:
+            stage_seconds.observe(time.perf_counter() - started, stage="analysis_job")
+            self.admission.release(source)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+analysis_queue = AnalysisQueue(concurrency=settings.ANALYSIS_CONCURRENCY)
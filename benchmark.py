@@ -0,0 +1,720 @@
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import statistics
+import time
+from pathlib import Path
+
+import psutil
+from PIL import Image
+from transformers import AutoProcessor
+
+from config import settings
+from llava import (
+    CLASSIFY_PROMPT, QUESTION_PROMPTS, _build_prompt_parts, _parse_classification, crop_to_roi, find_red_box, _image_features, _prefill,
+    load_image, load_llava_model, prefix_cache, run_llava, run_llava_batch, stream_llava,
+)
+
+
+# ----- 분류 처리량: 기존 경로 vs 단건 vs 배치 -----
+def _baseline_classify(image_path: str, max_new_tokens: int):
+    # 배치/캐시 도입 전의 분류 경로: 이미지 1장마다 전체 프롬프트를 processor에 넣고 model.generate 후 파싱
+    model, processor, _ = load_llava_model()
+    inputs = processor(
+        text=f"USER: <image>\n{CLASSIFY_PROMPT.strip()}\nASSISTANT:", images=load_image(image_path, None), return_tensors="pt"
+    )
+    inputs["pixel_values"] = inputs["pixel_values"].to(model.vision_tower.dtype)
+    generate_ids = model.generate(**inputs.to(model.device), max_new_tokens=max_new_tokens)
+    english_result = processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0]
+    return _parse_classification(english_result.split("ASSISTANT:")[-1].strip())
+
+def bench_batch(args):
+    """
+    기존 경로(1장씩 model.generate), 단건 경로(run_llava), 배치 경로(run_llava_batch)의 초당 처리 이미지 수를 비교합니다.
+    단건/배치 경로는 LLAVA_CLASSIFY_MODE와 프롬프트 KV 캐시 설정을 따릅니다.
+    """
+
+    load_llava_model()
+    image_paths = [args.image] * args.count
+    _baseline_classify(args.image, args.max_new_tokens) # 워밍업
+    run_llava_batch(image_paths[:args.batch_size])
+
+    def measure(classify_all) -> float:
+        started = time.perf_counter()
+        classify_all()
+        return time.perf_counter() - started
+
+    elapsed = {
+        "기존(model.generate 1장씩)": measure(lambda: [_baseline_classify(p, args.max_new_tokens) for p in image_paths]),
+        "단건(run_llava)": measure(lambda: [run_llava(p) for p in image_paths]),
+        f"배치(batch={args.batch_size})": measure(
+            lambda: [run_llava_batch(image_paths[i:i + args.batch_size]) for i in range(0, len(image_paths), args.batch_size)]
+        ),
+    }
+
+    print(f"--- 분류 처리량 ({settings.LLAVA_CLASSIFY_MODE}, 이미지 {args.count}장) ---")
+    for label, seconds in elapsed.items():
+        print(f"{label}: {args.count / seconds:.2f} img/s ({seconds:.2f}s)")
+
+
+# ----- 프롬프트 앞부분 KV 캐시: 첫 토큰까지 걸리는 시간 -----
+def bench_ttft(args):
+    """
+    고정 프롬프트 KV 캐시를 쓸 때와 쓰지 않을 때의 time-to-first-token을 비교합니다.
+    """
+
+    model, processor, _ = load_llava_model()
+    image = load_image(args.image, None)
+    question = None if args.question == "classify" else list(QUESTION_PROMPTS)[int(args.question) - 1]
+    prefix_text, suffix_text = _build_prompt_parts(question, "콘크리트 균열", "보통")
+
+    def measure() -> float:
+        started = time.perf_counter()
+        logits, _, _ = _prefill(model, processor, _image_features(model, processor, [image]), prefix_text, suffix_text)
+        logits.argmax(-1).tolist() # 첫 토큰 확정까지 동기화
+        return time.perf_counter() - started
+
+    tokenizer = processor.tokenizer
+    print(
+        f"--- TTFT ({args.question}, 고정 앞부분 {len(tokenizer(prefix_text).input_ids)}토큰 / "
+        f"이미지 뒤 {len(tokenizer(suffix_text, add_special_tokens=False).input_ids)}토큰) ---"
+    )
+    for enabled in (False, True):
+        settings.LLAVA_PREFIX_CACHE = enabled
+        prefix_cache.clear()
+        measure() # 워밍업 (캐시 사용 시 앞부분을 채움)
+
+        times = sorted(measure() for _ in range(args.runs))
+        label = "캐시 사용" if enabled else "캐시 미사용"
+        print(f"{label}: 평균 {statistics.mean(times) * 1000:.1f}ms / p50 {times[len(times) // 2] * 1000:.1f}ms")
+
+
+# ----- CPU 모드: 정밀도별 지연 시간 / 메모리 -----
+def _cpu_run(args, result_queue):
+    # 정밀도마다 새 프로세스에서 모델을 불러와야 RSS를 따로 잴 수 있음
+    started = time.perf_counter()
+    load_llava_model()
+    load_elapsed = time.perf_counter() - started
+    rss_loaded = psutil.Process().memory_info().rss
+
+    classification = run_llava_batch([args.image])[0] # 워밍업 겸 정밀도별 결과 비교용
+    classify_times = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        run_llava_batch([args.image])
+        classify_times.append(time.perf_counter() - started)
+
+    question = list(QUESTION_PROMPTS)[0]
+    started = time.perf_counter()
+    for _ in stream_llava(args.image.lstrip("/"), question, None, "콘크리트 균열", "보통", max_new_tokens=args.max_new_tokens):
+        pass
+    answer_elapsed = time.perf_counter() - started
+
+    result_queue.put({
+        "load": load_elapsed,
+        "classify": statistics.median(classify_times),
+        "answer": answer_elapsed,
+        "rss": rss_loaded,
+        "classification": repr(classification) if isinstance(classification, Exception) else (classification.defect_type, classification.urgency),
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, # Linux는 KB 단위
+    })
+
+def bench_cpu(args):
+    """
+    GPU 없이 fp32 / bf16 / int8 동적 양자화 모델의 지연 시간과 메모리 사용량을 비교합니다.
+    """
+
+    os.environ["CUDA_VISIBLE_DEVICES"] = "" # 자식 프로세스가 GPU를 보지 못하게 함
+    if args.threads:
+        os.environ["LLAVA_CPU_THREADS"] = str(args.threads)
+    os.environ["LLAVA_TORCH_COMPILE"] = "true" if args.compile else "false"
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    for cpu_dtype in args.dtypes.split(","):
+        os.environ["LLAVA_CPU_DTYPE"] = cpu_dtype
+        result_queue = ctx.Queue()
+        process = ctx.Process(target=_cpu_run, args=(args, result_queue))
+        process.start()
+        results[cpu_dtype] = result_queue.get()
+        process.join()
+
+    mb = 1024 * 1024
+    print(f"--- CPU 모드 (threads={args.threads or 'default'}, compile={args.compile}) ---")
+    for cpu_dtype, r in results.items():
+        print(
+            f"{cpu_dtype}: 로드 {r['load']:.1f}s / 분류 p50 {r['classify'] * 1000:.0f}ms / "
+            f"답변({args.max_new_tokens}토큰) {r['answer']:.1f}s / RSS {r['rss'] / mb:.0f}MB (최대 {r['peak_rss'] / mb:.0f}MB)"
+        )
+
+    # 낮은 정밀도가 같은 이미지를 fp32(없으면 첫 번째 정밀도)와 다르게 분류하면 실패로 끝냄
+    reference_dtype = "fp32" if "fp32" in results else next(iter(results))
+    reference = results[reference_dtype]["classification"]
+    mismatched = [cpu_dtype for cpu_dtype, r in results.items() if r["classification"] != reference]
+    print(f"--- 분류 결과 ({args.image}) ---")
+    for cpu_dtype, r in results.items():
+        mark = "✅" if cpu_dtype not in mismatched else "❌"
+        print(f"{mark} {cpu_dtype}: {r['classification']}")
+    if mismatched:
+        raise SystemExit(f"❌ {', '.join(mismatched)} 분류가 {reference_dtype}와 다릅니다.")
+
+
+# ----- 빨간 박스(ROI) crop 전처리 -----
+def bench_roi(args):
+    """
+    images/ 폴더의 이미지마다 빨간 박스 검출 시간과, 원본/ROI crop의 프로세서 전처리 시간을 비교합니다.
+    """
+
+    processor = AutoProcessor.from_pretrained(settings.LLAVA_MODEL_ID, revision=settings.LLAVA_MODEL_REVISION)
+    image_paths = sorted(p for p in Path(args.dir).iterdir() if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+
+    def measure(fn) -> float:
+        times = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - started)
+        return statistics.median(times) * 1000
+
+    print("--- ROI crop ---")
+    for image_path in image_paths:
+        image = Image.open(image_path).convert("RGB")
+        box = find_red_box(image)
+        cropped = crop_to_roi(image)
+
+        detect_ms = measure(lambda: find_red_box(image))
+        full_ms = measure(lambda: processor.image_processor(image, return_tensors="pt"))
+        crop_ms = measure(lambda: processor.image_processor(crop_to_roi(image), return_tensors="pt"))
+
+        print(
+            f"{image_path.name}: {image.size[0]}x{image.size[1]} → {cropped.size[0]}x{cropped.size[1]} (box={box}) / "
+            f"검출 {detect_ms:.1f}ms / 전처리 원본 {full_ms:.1f}ms, crop 포함 {crop_ms:.1f}ms"
+        )
+
+
+# ----- S3 스트리밍 업로드 -----
+def bench_s3(args):
+    """
+    임의의 이미지 크기 파일을 S3(또는 AWS_S3_ENDPOINT_URL의 moto/minio)에 동시에 올려
+    업로드별 처리량과 메모리에 들고 있던 최대 바이트 수를 측정합니다.
+    """
+
+    import asyncio
+    import tempfile
+
+    from fastapi import UploadFile
+    from starlette.datastructures import Headers
+
+    from s3_utils import s3_client, stream_upload
+
+    try:
+        s3_client.head_bucket(Bucket=settings.AWS_S3_BUCKET)
+    except Exception:
+        s3_client.create_bucket(Bucket=settings.AWS_S3_BUCKET) # 로컬 S3용
+
+    size = int(args.size_mb * 1024 * 1024)
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as source:
+        source.write(os.urandom(size))
+
+    async def upload_one(i: int):
+        # 업로드마다 파일을 따로 열어 읽기 위치가 섞이지 않게 함
+        with open(source.name, "rb") as f:
+            file = UploadFile(file=f, filename=f"bench_{i}.jpg", headers=Headers({"content-type": "image/jpeg"}))
+            return await stream_upload(file, f"benchmark/bench_{i}.jpg", file.content_type)
+
+    async def run():
+        started = time.perf_counter()
+        results = await asyncio.gather(*(upload_one(i) for i in range(args.count)))
+        return results, time.perf_counter() - started
+
+    rss_before = psutil.Process().memory_info().rss
+    results, elapsed = asyncio.run(run())
+    rss_after = psutil.Process().memory_info().rss
+    os.remove(source.name)
+
+    mb = 1024 * 1024
+    print(f"--- S3 업로드 ({args.count}개 × {args.size_mb}MB, 파트 {settings.S3_PART_SIZE_MB}MB) ---")
+    for i, r in enumerate(results):
+        print(f"#{i}: {r.elapsed:.2f}s ({r.size / mb / r.elapsed:.1f}MB/s), {r.parts}파트, 최대 버퍼 {r.peak_buffered / mb:.1f}MB")
+    print(f"전체: {args.count * size / mb / elapsed:.1f}MB/s / RSS 증가 {(rss_after - rss_before) / mb:.1f}MB")
+
+
+# ----- GET /defects 조회 지연 시간 -----
+def bench_defects(args):
+    """
+    합성 손상 기록을 단계별(예: 1만 → 10만 → 100만 건)로 늘려 가며 query_defects의 p50/p99 지연 시간을 측정합니다.
+    keyset pagination과 인덱스가 제대로 쓰이면 테이블이 커져도 지연 시간이 거의 일정해야 합니다.
+    """
+
+    import asyncio
+    import random
+    import sqlite3
+    import tempfile
+    import uuid
+    from datetime import datetime, timedelta
+
+    from database import URGENCY_RANK, init_db, query_defects
+
+    settings.DATA_DIR = Path(tempfile.mkdtemp())
+    asyncio.run(init_db())
+    print(f"--- GET /defects 조회 (DB: {settings.DB_PATH}) ---")
+
+    rng = random.Random(0)
+    start = datetime(2025, 1, 1)
+    urgencies, statuses, types = ["높음", "보통", "낮음"], ["미처리", "진행중", "완료"], ["콘크리트 균열", "도장 손상", "철근 노출"]
+
+    def fill(count: int):
+        rows = []
+        for i in range(count):
+            urgency = rng.choice(urgencies)
+            rows.append((
+                str(uuid.UUID(int=rng.getrandbits(128))),
+                37.44 + rng.random() * 0.02, 126.64 + rng.random() * 0.03,
+                f"https://example.com/{i}.jpg",
+                (start + timedelta(seconds=rng.randrange(365 * 24 * 3600))).strftime("%Y-%m-%d %H:%M:%S"),
+                rng.choice(types), urgency, URGENCY_RANK[urgency], "인천 미추홀구 인하로 100", rng.choice(statuses),
+            ))
+        with sqlite3.connect(settings.DB_PATH) as db:
+            db.executemany(
+                """
+                INSERT INTO defects (id, latitude, longitude, image, detect_time, defect_type, urgency, urgency_rank, address, repair_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            db.execute("ANALYZE")
+
+    def random_query() -> dict:
+        query = {"limit": 50, "fields": ["id", "detect_time", "urgency", "repair_status"]}
+        kind = rng.choice(["none", "urgency", "status", "type", "time", "bbox"])
+        if kind == "urgency":
+            query["urgency"] = [rng.choice(urgencies)]
+        elif kind == "status":
+            query["repair_status"] = [rng.choice(statuses)]
+        elif kind == "type":
+            query["defect_type"] = [rng.choice(types)]
+        elif kind == "time":
+            since = start + timedelta(days=rng.randrange(300))
+            query["since"], query["until"] = str(since), str(since + timedelta(days=30))
+        elif kind == "bbox":
+            lat, lon = 37.44 + rng.random() * 0.018, 126.64 + rng.random() * 0.028
+            query["bbox"] = (lat, lon, lat + 0.002, lon + 0.002)
+        return query
+
+    async def measure() -> list[float]:
+        times = []
+        for _ in range(args.queries):
+            query = random_query()
+            after = None
+            for _ in range(args.pages): # 첫 페이지 + 이어지는 페이지
+                started = time.perf_counter()
+                _, after = await query_defects(**query, after=after)
+                times.append(time.perf_counter() - started)
+                if after is None:
+                    break
+        return sorted(times)
+
+    total = 0
+    for size in (int(s) for s in args.sizes.split(",")):
+        fill(size - total)
+        total = size
+        times = asyncio.run(measure())
+        p50, p99 = times[len(times) // 2], times[int(len(times) * 0.99)]
+        print(f"{size:>9,}건: p50 {p50 * 1000:.2f}ms / p99 {p99 * 1000:.2f}ms ({len(times)}회)")
+
+
+# ----- 이미지 dHash 유사 프레임 조회 -----
+def bench_phash(args):
+    """
+    무작위 dHash를 단계별로 쌓아 가며 find_similar_analysis 지연 시간을 측정합니다.
+    조회 해시는 저장된 해시에서 1~3비트를 뒤집은 것(재사용 대상)과 무작위 해시(대상 없음)를 반씩 섞습니다.
+    """
+
+    import asyncio
+    import random
+    import sqlite3
+    import tempfile
+
+    from database import _hash_chunks, _now_iso, find_similar_analysis, init_db
+
+    settings.DATA_DIR = Path(tempfile.mkdtemp())
+    asyncio.run(init_db())
+    print(f"--- dHash 유사 프레임 조회 (DB: {settings.DB_PATH}) ---")
+
+    rng = random.Random(0)
+    stored: list[int] = []
+
+    def fill(count: int):
+        now = _now_iso()
+        rows = []
+        for i in range(count):
+            value = rng.getrandbits(64)
+            stored.append(value)
+            rows.append((f"d{len(stored)}", f"{value:016x}", *_hash_chunks(value), "도장 손상", "보통", now))
+        with sqlite3.connect(settings.DB_PATH) as db:
+            db.executemany("INSERT INTO image_hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    async def measure() -> tuple[list[float], int]:
+        times, hits = [], 0
+        for i in range(args.queries):
+            query = rng.getrandbits(64)
+            if i % 2 == 0:
+                query = rng.choice(stored)
+                for bit in rng.sample(range(64), rng.randint(1, 3)):
+                    query ^= 1 << bit
+            started = time.perf_counter()
+            hits += await find_similar_analysis(query) is not None
+            times.append(time.perf_counter() - started)
+        return sorted(times), hits
+
+    total = 0
+    for size in (int(s) for s in args.sizes.split(",")):
+        fill(size - total)
+        total = size
+        times, hits = asyncio.run(measure())
+        p50, p99 = times[len(times) // 2], times[int(len(times) * 0.99)]
+        print(f"{size:>9,}개: p50 {p50 * 1000:.2f}ms / p99 {p99 * 1000:.2f}ms (재사용 {hits}/{len(times)})")
+
+
+# ----- 주소 변환 캐시 -----
+def bench_geocode(args):
+    """
+    네이버 Reverse Geocoding API를 흉내 내는 로컬 stub 서버를 띄우고, 건물 외벽을 따라 촬영한 것처럼
+    건물마다 몇 m 안에 모인 좌표로 get_address_from_coords를 호출해 캐시 적중률과 줄어든 API 호출 수를 봅니다.
+    마지막 건물은 stub이 500을 돌려주어 실패 결과 캐시(negative caching)를 확인하고,
+    --flaky 비율만큼은 503을 돌려주어 재시도로 복구되는지 확인합니다.
+    한 비행분을 동시에 조회하므로 같은 칸의 동시 조회가 API 호출 한 번으로 합쳐지는지(single-flight)도 함께 봅니다.
+    이어서 메모리 캐시를 비우고 한 번 더 돌려 재시작 후 SQLite 캐시로 적중하는지 확인합니다.
+    """
+
+    import asyncio
+    import json
+    import random
+    import tempfile
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    from database import init_db
+    from map import bbox_around, close_geocoder, geocode_cache, get_address_from_coords
+    from metrics import cache_lookups, geocode_requests
+
+    calls = []
+    flaky = random.Random(1)
+
+    class NaverStub(BaseHTTPRequestHandler):
+        def do_GET(self):
+            calls.append(self.path)
+            time.sleep(args.latency_ms / 1000)
+            lon, lat = (float(v) for v in self.path.split("coords=")[1].split("&")[0].split("%2C"))
+            if lat > failing_lat or flaky.random() < args.flaky:
+                self.send_response(500 if lat > failing_lat else 503)
+                self.end_headers()
+                return
+            body = json.dumps({
+                "status": {"code": 0, "message": "done"},
+                "results": [{
+                    "region": {"area1": {"name": "인천광역시"}, "area2": {"name": "미추홀구"}},
+                    "land": {"name": "인하로", "number1": str(int(lat * 1e4) % 1000), "addition0": {"type": "building", "value": ""}},
+                }],
+            }).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *_):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), NaverStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    settings.NAVER_GEOCODE_URL = f"http://127.0.0.1:{server.server_port}/map-reversegeocode/v2/gc"
+    settings.DATA_DIR = Path(tempfile.mkdtemp())
+    asyncio.run(init_db())
+
+    # 건물마다 외벽 한 점을 중심으로 --spread-m 안에 흩어진 탐지 좌표
+    rng = random.Random(0)
+    points = []
+    for building in range(args.buildings):
+        lat, lon = 37.45 + building * 0.001, 126.65
+        min_lat, min_lon, max_lat, max_lon = bbox_around(lat, lon, args.spread_m)
+        points += [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)) for _ in range(args.points)]
+    failing_lat = 37.45 + (args.buildings - 1.5) * 0.001
+
+    async def run_sweep() -> tuple[list, float]:
+        started = time.perf_counter()
+        try:
+            addresses = await asyncio.gather(*(get_address_from_coords(lat, lon) for lat, lon in points))
+        finally:
+            await close_geocoder()
+        return addresses, time.perf_counter() - started
+
+    def sweep(label: str):
+        calls.clear()
+        hits_before = cache_lookups.value(cache="geocode", result="hit")
+        addresses, elapsed = asyncio.run(run_sweep())
+        hits = cache_lookups.value(cache="geocode", result="hit") - hits_before
+        print(
+            f"{label}: 조회 {len(points)}회 / API 호출 {len(calls)}회 (절약 {len(points) - len(calls)}회) / "
+            f"적중률 {hits / len(points):.1%} / 주소 없음 {addresses.count(None)}건 / 전체 {elapsed:.2f}s"
+        )
+
+    print(f"--- 주소 변환 캐시 (격자 {settings.GEOCODE_GRID_M:g}m, 건물 {args.buildings}개 × {args.points}점, 반경 {args.spread_m:g}m, API 지연 {args.latency_ms}ms) ---")
+    print(f"캐시 없이: API 호출 {len(points)}회 / 예상 {len(points) * args.latency_ms / 1000:.1f}s")
+    sweep("첫 비행")
+    geocode_cache.clear_memory()
+    sweep("재시작 후(SQLite)")
+    print(
+        f"API 결과: 성공 {geocode_requests.value(result='ok'):.0f}회 / 재시도 {geocode_requests.value(result='retry'):.0f}회 / "
+        f"실패 {geocode_requests.value(result='error'):.0f}회 (실패한 칸은 {settings.GEOCODE_NEGATIVE_TTL_SECONDS}초 동안 다시 호출하지 않음)"
+    )
+    server.shutdown()
+
+
+# ----- SQLite 연결 풀 -----
+def bench_db(args):
+    """
+    호출마다 연결을 새로 여는 방식(기본 journal 모드)과 연결 풀(쓰기 1 + 읽기 N, WAL)을 비교합니다.
+    --writers개 작업이 손상 --inserts건을 저장하는 동안 --readers개 작업이 단건/목록 조회를 반복해
+    초당 저장 건수와 쓰기 중 읽기 지연 시간을 잽니다.
+    """
+
+    import asyncio
+    import random
+    import sqlite3
+    import tempfile
+    import uuid
+
+    import db_pool
+    from database import create_defect_in_db, get_defect_by_id, init_db, query_defects
+    from models import DefectOut
+
+    def fill(count: int) -> list[str]:
+        ids = [str(uuid.uuid4()) for _ in range(count)]
+        with sqlite3.connect(settings.DB_PATH) as db:
+            db.executemany(
+                "INSERT INTO defects (id, latitude, longitude, image, detect_time, address) VALUES (?, ?, ?, ?, ?, ?)",
+                [(i, 37.45, 126.65, "/images/x.jpg", f"2025-11-{n % 28 + 1:02d} 12:00:00", "주소") for n, i in enumerate(ids)]
+            )
+        return ids
+
+    async def run(use_pool: bool) -> tuple[float, list[float], int]:
+        settings.DATA_DIR = Path(tempfile.mkdtemp())
+        if use_pool:
+            await db_pool.open_pool()
+        try:
+            await init_db()
+            ids = fill(args.rows)
+            rng = random.Random(0)
+            remaining = [args.inserts]
+            read_times, errors = [], [0]
+
+            async def writer():
+                while remaining[0] > 0:
+                    remaining[0] -= 1
+                    defect = DefectOut(id=str(uuid.uuid4()), latitude=37.45, longitude=126.65, image="/images/x.jpg",
+                                       detect_time="2025-11-30 12:00:00", address="주소")
+                    if await create_defect_in_db(defect) is None:
+                        errors[0] += 1
+
+            async def reader(done: asyncio.Event):
+                while not done.is_set():
+                    started = time.perf_counter()
+                    try:
+                        if rng.random() < 0.5:
+                            await get_defect_by_id(rng.choice(ids))
+                        else:
+                            await query_defects(limit=50)
+                    except Exception:
+                        errors[0] += 1
+                    read_times.append(time.perf_counter() - started)
+
+            done = asyncio.Event()
+            readers = [asyncio.create_task(reader(done)) for _ in range(args.readers)]
+            started = time.perf_counter()
+            await asyncio.gather(*(writer() for _ in range(args.writers)))
+            elapsed = time.perf_counter() - started
+            done.set()
+            await asyncio.gather(*readers)
+            return args.inserts / elapsed, sorted(read_times), errors[0]
+        finally:
+            if use_pool:
+                await db_pool.close_pool()
+
+    print(f"--- SQLite 연결 (기존 {args.rows:,}건, 저장 {args.inserts}건 / 쓰기 작업 {args.writers}개, 읽기 작업 {args.readers}개) ---")
+    for label, use_pool in (("호출마다 연결", False), (f"연결 풀(읽기 {settings.DB_READERS}, WAL)", True)):
+        inserts_per_sec, times, errors = asyncio.run(run(use_pool))
+        p50, p99 = times[len(times) // 2], times[int(len(times) * 0.99)]
+        print(
+            f"{label}: 저장 {inserts_per_sec:,.0f}건/s / 쓰기 중 읽기 {len(times)}회 "
+            f"p50 {p50 * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms / 오류 {errors}건"
+        )
+
+
+# ----- 과부하 시 /defect-info 수락 제어 -----
+def bench_load(args):
+    """
+    처리량이 고정된 가짜 분석(--capacity 작업/초)에 그보다 많은 요청(--rate 건/초)을 --duration초 동안 보냅니다.
+    수락 제어가 켜져 있으면 초과분은 429로 돌려보내고 받은 작업의 지연 시간이 일정하게 유지되어야 하며,
+    --no-admission이면 대기열이 계속 늘어나 지연 시간이 시간에 비례해 커집니다.
+    """
+
+    import asyncio
+    import random
+
+    import httpx
+
+    # main.py가 DATA_DIR을 정적 파일로 마운트하므로 폴더는 그대로 두고 DB 파일만 따로 씀
+    settings.DB_NAME = f"bench_load_{os.getpid()}.db"
+    settings.DEFECT_INFO_ASYNC = True
+    settings.PHASH_MAX_DISTANCE = -1
+    settings.ADMISSION_TARGET_WAIT = args.target_wait
+    settings.ADMISSION_MIN_QUEUE = 1
+    if args.no_admission:
+        settings.ADMISSION_MAX_QUEUE = 10 ** 9
+        settings.ADMISSION_TARGET_WAIT = 10 ** 9
+
+    import main
+    from analysis_queue import analysis_queue
+    from database import init_db
+
+    async def fake_geocode(latitude, longitude):
+        return "인천 미추홀구 인하로 100"
+
+    main.get_address_from_coords = fake_geocode
+
+    accepted_at: dict[str, float] = {}
+    job_latency: list[float] = []
+    slots = asyncio.Semaphore(max(1, int(args.capacity)))
+
+    async def fake_analysis(defect):
+        # 동시에 capacity개까지 1초씩 걸리는 분석 = 초당 capacity개
+        async with slots:
+            await asyncio.sleep(1.0)
+        job_latency.append(time.perf_counter() - accepted_at[defect.id])
+        return defect
+
+    async def run():
+        await init_db()
+        analysis_queue.concurrency = max(analysis_queue.concurrency, int(args.capacity))
+        await analysis_queue.start(fake_analysis)
+        rng = random.Random(0)
+        statuses: dict[int, int] = {}
+        post_latency: list[float] = []
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+            async def send(i: int):
+                body = {"latitude": 33 + rng.random() * 5, "longitude": 126 + rng.random() * 3, "image": f"/images/{i}.jpg"}
+                started = time.perf_counter()
+                resp = await client.post("/defect-info", json=body, headers={"X-Drone-Id": f"drone-{i % args.drones}"})
+                post_latency.append(time.perf_counter() - started)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+                if resp.status_code == 202:
+                    accepted_at[resp.json()["id"]] = started
+
+            tasks, started = [], time.perf_counter()
+            for i in range(int(args.rate * args.duration)):
+                await asyncio.sleep(max(0.0, started + i / args.rate - time.perf_counter()))
+                tasks.append(asyncio.create_task(send(i)))
+            await asyncio.gather(*tasks)
+
+            # 받은 작업이 모두 끝날 때까지 대기
+            while len(job_latency) < len(accepted_at):
+                await asyncio.sleep(0.1)
+        await analysis_queue.stop()
+        return statuses, post_latency
+
+    try:
+        statuses, post_latency = asyncio.run(run())
+    finally:
+        settings.DB_PATH.unlink(missing_ok=True)
+
+    def pct(values: list[float], q: float) -> float:
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+    mode = "수락 제어 끔" if args.no_admission else f"수락 제어 (목표 대기 {args.target_wait:.0f}s)"
+    print(f"--- 과부하 테스트: {mode}, 요청 {args.rate:.0f}건/s, 처리량 {args.capacity:.0f}건/s, {args.duration:.0f}s ---")
+    print(f"응답 코드: {dict(sorted(statuses.items()))}")
+    print(f"POST 지연: p50 {pct(post_latency, 0.5) * 1000:.1f}ms / p99 {pct(post_latency, 0.99) * 1000:.1f}ms")
+    print(f"분석 완료까지: p50 {pct(job_latency, 0.5):.2f}s / p99 {pct(job_latency, 0.99):.2f}s / 최대 {max(job_latency, default=0):.2f}s")
+    print(f"측정된 처리량: {analysis_queue.admission.throughput:.2f}건/s, 최종 한도 {analysis_queue.admission.limit()}건")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Airovision 성능 측정 스크립트")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("batch", help="LLaVA 분류 단건/배치 처리량 비교")
+    p.add_argument("--image", default="/images/sample.jpg", help="분류용 이미지 경로 (/images/... 형식)")
+    p.add_argument("--count", type=int, default=16)
+    p.add_argument("--batch-size", type=int, default=8)
+    p.add_argument("--max-new-tokens", type=int, default=2000, help="기존 경로의 model.generate 최대 토큰 수 (원래 코드는 2000)")
+    p.set_defaults(func=bench_batch)
+
+    p = sub.add_parser("ttft", help="프롬프트 KV 캐시 사용/미사용 TTFT 비교")
+    p.add_argument("--image", default="/images/sample.jpg")
+    p.add_argument("--question", choices=["classify", "1", "2"], default="classify", help="분류 프롬프트 또는 버튼 질문 번호")
+    p.add_argument("--runs", type=int, default=10)
+    p.set_defaults(func=bench_ttft)
+
+    p = sub.add_parser("cpu", help="CPU 모드 정밀도별(fp32/bf16/int8) 지연 시간 및 RSS 비교")
+    p.add_argument("--image", default="/images/sample.jpg")
+    p.add_argument("--dtypes", default="fp32,bf16,int8", help="비교할 LLAVA_CPU_DTYPE 목록 (쉼표 구분)")
+    p.add_argument("--threads", type=int, default=0, help="intra-op 스레드 수 (0이면 torch 기본값)")
+    p.add_argument("--compile", action="store_true", help="torch.compile 적용")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--max-new-tokens", type=int, default=64)
+    p.set_defaults(func=bench_cpu)
+
+    p = sub.add_parser("roi", help="빨간 박스 검출 및 ROI crop 전처리 시간 비교")
+    p.add_argument("--dir", default="images", help="측정할 이미지 폴더")
+    p.add_argument("--runs", type=int, default=10)
+    p.set_defaults(func=bench_roi)
+
+    p = sub.add_parser("s3", help="S3 스트리밍 멀티파트 업로드 처리량 및 메모리 측정")
+    p.add_argument("--size-mb", type=float, default=40, help="업로드할 파일 크기(MB)")
+    p.add_argument("--count", type=int, default=4, help="동시에 올릴 파일 수")
+    p.set_defaults(func=bench_s3)
+
+    p = sub.add_parser("defects", help="GET /defects 조회 지연 시간 (합성 데이터 최대 100만 건)")
+    p.add_argument("--sizes", default="10000,100000,1000000", help="측정할 테이블 크기 (쉼표 구분, 오름차순)")
+    p.add_argument("--queries", type=int, default=200, help="크기마다 실행할 무작위 조건 수")
+    p.add_argument("--pages", type=int, default=3, help="조건마다 읽을 페이지 수")
+    p.set_defaults(func=bench_defects)
+
+    p = sub.add_parser("phash", help="dHash 유사 프레임 조회 지연 시간 (해시 최대 100만 개)")
+    p.add_argument("--sizes", default="10000,100000,1000000", help="측정할 해시 개수 (쉼표 구분, 오름차순)")
+    p.add_argument("--queries", type=int, default=400, help="크기마다 실행할 조회 수")
+    p.set_defaults(func=bench_phash)
+
+    p = sub.add_parser("geocode", help="주소 변환 캐시 적중률과 줄어든 API 호출 수 (로컬 네이버 API stub)")
+    p.add_argument("--buildings", type=int, default=5, help="건물 수 (마지막 건물은 stub이 실패 응답)")
+    p.add_argument("--points", type=int, default=200, help="건물마다 탐지 좌표 수")
+    p.add_argument("--spread-m", type=float, default=4, help="건물 중심에서 탐지 좌표가 흩어진 반경(m)")
+    p.add_argument("--latency-ms", type=float, default=30, help="stub API 응답 지연(ms)")
+    p.add_argument("--flaky", type=float, default=0.2, help="stub이 503을 돌려주는 비율 (재시도 확인)")
+    p.set_defaults(func=bench_geocode)
+
+    p = sub.add_parser("db", help="SQLite 호출마다 연결 vs 연결 풀(WAL) 저장 처리량과 동시 읽기 지연 시간")
+    p.add_argument("--rows", type=int, default=100000, help="미리 넣어 둘 손상 수")
+    p.add_argument("--inserts", type=int, default=2000, help="측정할 저장 건수")
+    p.add_argument("--writers", type=int, default=4, help="동시에 저장하는 작업 수")
+    p.add_argument("--readers", type=int, default=8, help="동시에 조회하는 작업 수")
+    p.set_defaults(func=bench_db)
+
+    p = sub.add_parser("load", help="과부하 시 /defect-info 수락 제어 (429 + Retry-After)")
+    p.add_argument("--rate", type=float, default=60, help="초당 요청 수")
+    p.add_argument("--capacity", type=float, default=10, help="가짜 분석의 초당 처리량")
+    p.add_argument("--duration", type=float, default=30, help="요청을 보내는 시간(초)")
+    p.add_argument("--drones", type=int, default=4, help="요청을 나눠 보내는 드론 수 (X-Drone-Id)")
+    p.add_argument("--target-wait", type=float, default=5, help="ADMISSION_TARGET_WAIT (초)")
+    p.add_argument("--no-admission", action="store_true", help="수락 제어를 끄고 비교")
+    p.set_defaults(func=bench_load)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
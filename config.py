@@ -1,3 +1,4 @@
+from pydantic import field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pathlib import Path
 
@@ -8,19 +9,114 @@ class Settings(BaseSettings):
     # DB 설정
     DATA_DIR: Path = Path("data")
     DB_NAME: str = "defects.db"
+    DB_READERS: int = 4                # 서버가 유지하는 읽기 연결 수 (쓰기 연결은 1개)
+    DB_MMAP_SIZE_MB: int = 256         # SQLite mmap 크기(MB)
+    DB_CACHE_SIZE_MB: int = 64         # 연결별 페이지 캐시 크기(MB)
+    DB_CACHED_STATEMENTS: int = 256    # 연결별로 재사용하는 prepared statement 수
+    DB_BUSY_TIMEOUT: float = 5.0       # 다른 프로세스가 쓰는 중일 때 기다리는 시간(초)
+    DB_MIGRATION_BATCH: int = 2000     # 마이그레이션에서 기존 행을 한 번에 고치는 개수 (묶음마다 커밋)
 
     # 지도 계정 설정
     NAVER_CLIENT_ID: str
     NAVER_CLIENT_SECRET: str
+    NAVER_GEOCODE_URL: str = "https://maps.apigw.ntruss.com/map-reversegeocode/v2/gc" # 테스트 시 로컬 stub 주소로 바꿀 수 있음
+    GEOCODE_GRID_M: float = 5.0        # 이 크기(m)의 격자 칸 안의 좌표는 같은 주소로 캐시 (0이면 캐시 끔)
+    GEOCODE_CACHE_SIZE: int = 4096     # 메모리에 보관하는 격자 칸 수 (LRU)
+    GEOCODE_CACHE_TTL_DAYS: int = 30   # 주소 캐시 보관 기간 (SQLite)
+    GEOCODE_NEGATIVE_TTL_SECONDS: int = 300  # 주소 변환에 실패한 칸을 다시 호출하지 않는 시간
+    GEOCODE_TIMEOUT: float = 3.0       # 네이버 API 요청 하나의 제한 시간(초)
+    GEOCODE_RETRIES: int = 2           # 연결 오류 / 시간 초과 / 429·5xx일 때 다시 시도하는 횟수
+    GEOCODE_RETRY_BACKOFF: float = 0.3 # 재시도 대기 시간 상한의 시작값(초, 시도마다 2배, 0 ~ 상한에서 무작위)
+    GEOCODE_MAX_CONNECTIONS: int = 8   # 네이버 API로 동시에 여는 연결 수
+    GEOCODE_DEFERRED: bool = True      # True면 주소를 기다리지 않고 손상을 저장한 뒤 백그라운드에서 주소를 채움
 
     # AWS S3 설정
     AWS_REGION: str
     AWS_S3_BUCKET: str
+    AWS_S3_ENDPOINT_URL: str = ""      # 로컬 S3(moto, minio 등) 주소 (비우면 AWS S3)
+    S3_PART_SIZE_MB: int = 8           # 멀티파트 업로드 파트 크기(MB, 최소 5)
+    S3_MAX_CONCURRENT_UPLOADS: int = 4 # 동시에 진행하는 S3 업로드 수
+
+    # 손상 정보 수신 / 분석 작업 설정
+    DEFECT_INFO_ASYNC: bool = True     # True면 /defect-info가 분석을 기다리지 않고 202 + 작업 ID를 바로 반환
+    ANALYSIS_CONCURRENCY: int = 8      # 동시에 진행하는 분석 작업 수 (분류 배치가 채워질 수 있도록)
+    BATCH_GEOCODE_DECIMALS: int = 4    # 일괄 등록 시 좌표를 이 자릿수로 반올림해 같은 칸이면 주소 변환을 한 번만 (4자리 ≈ 11m)
+    CLUSTER_RADIUS_M: float = 3.0      # 이 거리(m) 안의 미완료 손상은 같은 손상의 재탐지로 보고 묶음 (0이면 끔)
+    CLUSTER_WINDOW_HOURS: float = 72   # 마지막 탐지 후 이 시간 안에 다시 탐지된 경우에만 묶음
+    PHASH_MAX_DISTANCE: int = 3        # 최근 분석한 이미지와 dHash 해밍 거리가 이 값 이하이면 분석 결과 재사용 (0~3, -1이면 끔, 4 이상은 시작 시 오류)
+    PHASH_WINDOW_HOURS: float = 24     # 이 시간 안에 분석한 이미지만 재사용 대상
+    IDEMPOTENCY_TTL_HOURS: float = 24  # Idempotency-Key / detection_id를 기억하는 시간 (이 안에 같은 키로 다시 오면 처음 응답을 돌려줌)
+
+    # 분석 작업 수락(admission) 설정
+    ADMISSION_MAX_QUEUE: int = 500       # 끝나지 않은 분석 작업 수 상한
+    ADMISSION_MIN_QUEUE: int = 16        # 측정된 처리량이 낮아도 보장하는 최소 한도
+    ADMISSION_TARGET_WAIT: float = 60.0  # 측정된 처리량으로 이 시간(초) 안에 끝낼 수 있는 만큼만 받음
+    ADMISSION_INITIAL_THROUGHPUT: float = 1.0  # 처리량을 재기 전에 가정하는 값(작업/초)
+    ADMISSION_SOURCE_SHARE: float = 0.5  # 드론(X-Drone-Id) 하나가 차지할 수 있는 한도 비율
+
+    # 손상 이벤트 스트림 설정 (GET /defects/stream, /defects/ws)
+    EVENT_HISTORY_SIZE: int = 1000       # cursor로 이어 받을 수 있도록 보관하는 최근 이벤트 수
+    EVENT_SUBSCRIBER_BUFFER: int = 256   # 구독자별로 쌓아 두는 최대 이벤트 수 (넘치면 연결을 끊고 cursor로 다시 받게 함)
+    EVENT_HEARTBEAT_SECONDS: float = 15.0  # 이벤트가 없을 때 연결 유지 메시지를 보내는 간격
+    EVENT_MAX_SUBSCRIBERS: int = 10000   # 동시에 연결할 수 있는 구독자 수
+
+    # LLaVA 모델 설정
+    LLAVA_MODEL_ID: str = "llava-hf/llava-1.5-7b-hf"
+    LLAVA_MODEL_REVISION: str = "a272c74"
+    LLAVA_PREFIX_CACHE: bool = True    # 고정 프롬프트 앞부분의 KV 캐시 재사용 여부
+    LLAVA_FEATURE_CACHE_MB: int = 512  # defect_id별 시각 토큰 캐시 메모리 한도(MB). 워커 프로세스를 쓰면 워커마다 따로 가지며, 같은 손상의 작업은 가능하면 같은 워커로 보냄
+    LLAVA_FEATURE_SPILL_DIR: str = ""  # 메모리에서 밀려난 시각 토큰을 저장할 폴더 (비우면 저장 안 함)
+    LLAVA_FEATURE_SPILL_MB: int = 4096 # 시각 토큰 디스크 저장 한도(MB, 프로세스별). 넘으면 오래된 파일부터 지움
+
+    # 이미지 다운로드 / 캐시 설정
+    IMAGE_CACHE_MB: int = 256          # 원본 bytes + 디코딩된 이미지 캐시 메모리 한도(MB)
+    IMAGE_FETCH_CONCURRENCY: int = 8   # 동시에 받을 수 있는 최대 이미지 수
+    IMAGE_FETCH_TIMEOUT: float = 10.0  # 이미지 다운로드 제한 시간(초)
+
+    # 이미지 파생본(썸네일/미리보기/ROI crop) 설정
+    DERIVATIVE_WEBP_QUALITY: int = 80  # WebP 품질 (0~100)
+    DERIVATIVE_ALERT_WAIT: float = 3.0 # 알림 전송 시 생성 중인 미리보기를 기다리는 최대 시간(초)
+
+    # 빨간 박스(ROI) crop 설정
+    ROI_ENABLED: bool = True           # 추론 전에 빨간 박스 주변만 잘라서 사용
+    ROI_MARGIN: float = 0.25           # 박스 크기 대비 주변 여유 비율
+    ROI_MIN_LINE_RATIO: float = 0.05   # 박스 테두리로 인정할 최소 선 길이 (이미지 변 길이 대비)
+
+    # LLaVA CPU 추론 설정 (GPU가 없을 때만 사용)
+    LLAVA_CPU_DTYPE: str = "int8"      # "fp32", "bf16", "int8"(언어 모델 Linear 동적 양자화)
+    LLAVA_CPU_THREADS: int = 0         # intra-op 스레드 수 (0이면 torch 기본값)
+    LLAVA_CPU_INTEROP_THREADS: int = 0 # inter-op 스레드 수 (0이면 torch 기본값)
+    LLAVA_TORCH_COMPILE: bool = False  # 언어 모델에 torch.compile 적용 여부
+
+    # LLaVA 분류 배치 설정
+    LLAVA_BATCH_SIZE: int = 8          # 한 번에 묶어서 추론할 최대 이미지 수
+    LLAVA_BATCH_WAIT_MS: int = 50      # 배치를 채우기 위해 기다리는 최대 시간(ms)
+    LLAVA_CLASSIFY_MODE: str = "score" # "score"(후보 답변 점수 비교) 또는 "generate"(자유 생성 후 파싱)
+
+    # LLaVA 추론 워커 설정
+    LLAVA_WORKERS: int = 0             # 추론 워커 프로세스 수 (0이면 서버 프로세스 안에서 추론)
+    LLAVA_WORKER_BACKEND: str = "llava"  # "llava" 또는 "stub"(모델 없이 CPU 테스트)
+    LLAVA_WORKER_DEVICES: str = ""     # 워커별로 나눠 줄 GPU 번호 (예: "0,1")
+
+    # Discord 질문 답변 캐시 설정
+    ANSWER_CACHE_TTL_DAYS: int = 30    # 마지막 조회 후 보관 기간
+    ANSWER_CACHE_MAX_ROWS: int = 10000 # 최대 보관 개수 (넘으면 가장 오래 조회되지 않은 답변부터 삭제)
+
+    # Discord 설정
+    DISCORD_EDIT_INTERVAL: float = 1.2 # 스트리밍 답변 메시지 수정 최소 간격(초)
 
     # 로컬 스토리지 설정 (개발용)
     UPLOADS_DIR_NAME: str = "images"
     STATIC_MOUNT_PATH: str = "/data"
     
+    @field_validator("PHASH_MAX_DISTANCE")
+    @classmethod
+    def _check_phash_distance(cls, value: int) -> int:
+        # dHash 인덱스는 16비트 x 4칸이라, 거리 3까지만 "적어도 한 칸은 같다"가 보장됨 (database.find_similar_analysis)
+        if not -1 <= value <= 3:
+            raise ValueError(f"PHASH_MAX_DISTANCE는 -1(끔) 또는 0~3이어야 합니다. (받은 값: {value})")
+        return value
+
     @property
     def DB_PATH(self) -> Path:
         return self.DATA_DIR / self.DB_NAME
@@ -0,0 +1,19 @@
+import os
+
+# config.Settings의 필수 값 (테스트는 외부 API를 부르지 않음)
+for key in ("NAVER_CLIENT_ID", "NAVER_CLIENT_SECRET", "AWS_REGION", "AWS_S3_BUCKET"):
+    os.environ.setdefault(key, "test")
+
+import pytest
+
+from config import settings
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """
+    테스트마다 빈 DATA_DIR(SQLite DB 위치)를 씁니다.
+    """
+
+    monkeypatch.setattr(settings, "DATA_DIR", tmp_path)
+    return tmp_path
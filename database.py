@@ -1,10 +1,16 @@
 import aiosqlite
+import asyncio
+import time
 from pathlib import Path
 from typing import Optional, List
 from datetime import datetime, timedelta, timezone
 
 from models import *
 from config import settings
+from map import bbox_around, distance_m
+from metrics import cache_lookups
+from events import event_hub
+import db_pool
 
 
 # ----- 설정 -----
@@ -13,13 +19,20 @@ DATA_DIR.mkdir(exist_ok=True)
 DB_PATH = DATA_DIR / "defects.db"
 
 
+HASH_CHUNKS = 4 # dHash 64비트 = 16비트 x 4칸
+
+
+# ----- 연결 -----
+_connect = db_pool.connect
+
+
 # ----- 데이터베이스 초기화 -----
 async def init_db():
     """
     앱 시작 시 데이터베이스와 테이블을 생성합니다.
     """
 
-    async with aiosqlite.connect(settings.DB_PATH) as db:
+    async with _connect() as db:
         await db.execute("""
         CREATE TABLE IF NOT EXISTS defects (
             id TEXT PRIMARY KEY,
@@ -33,8 +46,205 @@ async def init_db():
             repair_status TEXT DEFAULT '미처리'
         )
         """)
+        # GET /defects 조회용 인덱스 (필터 컬럼 = 조건, detect_time/id = 정렬 및 keyset 페이지 위치)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_defects_time ON defects (detect_time, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_defects_urgency_time ON defects (urgency, detect_time, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_defects_repair_time ON defects (repair_status, detect_time, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_defects_type_time ON defects (defect_type, detect_time, id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_defects_lat_lon ON defects (latitude, longitude)")
+        # 좌표 R*Tree (defects.geo_id 기준). 트리거와 기존 행 채우기는 마이그레이션 4~6
+        await db.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS defects_rtree USING rtree (
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        """)
+        # 기존 손상에 묶인 재탐지 기록 (처음 탐지는 defects에 있음)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS defect_detections (
+            id TEXT PRIMARY KEY,
+            defect_id TEXT NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            image TEXT NOT NULL,
+            detect_time TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_defect_detections_defect ON defect_detections (defect_id, detect_time)")
+        # 분석이 끝난 이미지의 dHash. 64비트를 16비트씩 4칸(h0~h3)으로 나눠 칸마다 인덱스를 둠
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            defect_id TEXT PRIMARY KEY,
+            dhash TEXT NOT NULL,
+            h0 INTEGER NOT NULL,
+            h1 INTEGER NOT NULL,
+            h2 INTEGER NOT NULL,
+            h3 INTEGER NOT NULL,
+            defect_type TEXT,
+            urgency TEXT,
+            created_at TEXT NOT NULL
+        )
+        """)
+        for chunk in range(HASH_CHUNKS):
+            await db.execute(f"CREATE INDEX IF NOT EXISTS idx_image_hashes_h{chunk} ON image_hashes (h{chunk}, created_at)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS llava_answers (
+            defect_id TEXT NOT NULL,
+            question TEXT NOT NULL,
+            model_revision TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            last_access TEXT NOT NULL,
+            PRIMARY KEY (defect_id, question, model_revision)
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_llava_answers_last_access ON llava_answers (last_access)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_jobs (
+            id TEXT PRIMARY KEY,
+            defect_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_defect_id ON analysis_jobs (defect_id)")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, created_at)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS image_derivatives (
+            image TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            url TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (image, variant)
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_image_derivatives_hash ON image_derivatives (content_hash, variant)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key TEXT PRIMARY KEY,
+            defect_id TEXT NOT NULL,
+            attached INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)")
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS geocode_cache (
+            cell TEXT PRIMARY KEY,
+            address TEXT,
+            ok INTEGER NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+        """)
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_geocode_cache_expires ON geocode_cache (expires_at)")
         await db.commit()
 
+    await migrate_db()
+
+
+# ----- 스키마 마이그레이션 -----
+URGENCY_RANK = {"높음": 3, "보통": 2, "낮음": 1} # 위험도 정렬 순서 (위험도가 없으면 0)
+_URGENCY_RANK_SQL = "CASE urgency " + " ".join(f"WHEN '{u}' THEN {r}" for u, r in URGENCY_RANK.items()) + " ELSE 0 END"
+
+
+async def _update_in_batches(assignment: str, condition: str = "1"):
+    """
+    defects를 rowid 순서로 DB_MIGRATION_BATCH개씩 나눠 UPDATE defects SET {assignment} WHERE {condition} 합니다.
+    묶음마다 커밋하고 쓰기 연결을 돌려주므로 큰 DB에서도 쓰기 잠금을 오래 잡지 않습니다. (중간에 꺼지면 처음부터 다시 해도 결과가 같아야 함)
+    """
+
+    last_rowid = 0
+    while True:
+        async with _connect() as db:
+            async with db.execute(
+                "SELECT MAX(rowid) FROM (SELECT rowid FROM defects WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                (last_rowid, settings.DB_MIGRATION_BATCH)
+            ) as cursor:
+                (upper,) = await cursor.fetchone()
+            if upper is None:
+                return
+            await db.execute(
+                f"UPDATE defects SET {assignment} WHERE rowid > ? AND rowid <= ? AND ({condition})",
+                (last_rowid, upper)
+            )
+            await db.commit()
+        last_rowid = upper
+        await asyncio.sleep(0)
+
+async def _backfill_urgency_rank():
+    # 기존 손상의 urgency_rank 채우기
+    await _update_in_batches(f"urgency_rank = {_URGENCY_RANK_SQL}", "urgency IS NOT NULL")
+
+async def _backfill_geo_id():
+    # 기존 손상의 geo_id를 지금의 rowid로 채우기 (이후에는 바뀌지 않음)
+    await _update_in_batches("geo_id = rowid", "geo_id IS NULL")
+
+
+# PRAGMA user_version = 적용된 마지막 마이그레이션 번호 (목록 순서 = 번호, 한 번 배포한 항목은 고치지 않고 뒤에 추가)
+# SQL 목록은 버전 갱신과 한 트랜잭션으로 적용하고, 함수는 데이터를 나눠 옮긴 뒤 버전을 갱신합니다.
+MIGRATIONS = [
+    # 1: 위험도 정렬용 정수 컬럼 (CASE 식 정렬은 인덱스를 쓸 수 없음)
+    ["ALTER TABLE defects ADD COLUMN urgency_rank INTEGER NOT NULL DEFAULT 0"],
+    # 2: 기존 손상의 urgency_rank 채우기
+    _backfill_urgency_rank,
+    # 3: 위험도순 목록(get_records) 인덱스. 보수 상태 / 시간 인덱스는 init_db에 있음
+    ["CREATE INDEX IF NOT EXISTS idx_defects_rank_time ON defects (urgency_rank DESC, detect_time, id)"],
+    # 4: R*Tree 키 컬럼. rowid는 VACUUM 때 다시 매겨질 수 있어(id가 TEXT PRIMARY KEY) 바뀌지 않는 정수를 따로 둠
+    ["ALTER TABLE defects ADD COLUMN geo_id INTEGER"],
+    # 5: 기존 손상의 geo_id 채우기
+    _backfill_geo_id,
+    # 6: geo_id로 R*Tree를 다시 만들고, 삽입 시 geo_id를 매기는 트리거로 교체
+    [
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_defects_geo_id ON defects (geo_id)",
+        "DROP TRIGGER IF EXISTS defects_rtree_insert",
+        "DROP TRIGGER IF EXISTS defects_rtree_delete",
+        """
+        CREATE TRIGGER defects_rtree_insert AFTER INSERT ON defects BEGIN
+            UPDATE defects SET geo_id = (SELECT IFNULL(MAX(geo_id), 0) + 1 FROM defects)
+             WHERE rowid = new.rowid AND new.geo_id IS NULL;
+            INSERT INTO defects_rtree
+            SELECT geo_id, latitude, latitude, longitude, longitude FROM defects WHERE rowid = new.rowid;
+        END
+        """,
+        """
+        CREATE TRIGGER defects_rtree_delete AFTER DELETE ON defects BEGIN
+            DELETE FROM defects_rtree WHERE id = old.geo_id;
+        END
+        """,
+        "DELETE FROM defects_rtree",
+        "INSERT INTO defects_rtree SELECT geo_id, latitude, latitude, longitude, longitude FROM defects",
+    ],
+]
+
+
+async def migrate_db():
+    """
+    DB의 user_version 이후의 마이그레이션을 차례로 적용합니다. init_db()에서 호출합니다.
+    """
+
+    async with _connect() as db:
+        async with db.execute("PRAGMA user_version") as cursor:
+            (version,) = await cursor.fetchone()
+
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        started = time.perf_counter()
+        if callable(migration):
+            await migration()
+        async with _connect() as db:
+            await db.execute("BEGIN")
+            for statement in ([] if callable(migration) else migration):
+                await db.execute(statement)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.commit()
+        print(f"✅ DB 마이그레이션 {number} 적용 완료 ({time.perf_counter() - started:.2f}초)")
+
 
 # ----- DB 응답을 DefectOut 모델로 변환 -----
 def db_row_to_model(row: aiosqlite.Row) -> DefectOut:
@@ -54,23 +264,89 @@ async def create_defect_in_db(defect: DefectOut) -> Optional[DefectOut]:
           VALUES (?, ?, ?, ?, ?, ?)
           """
     try:
-        async with aiosqlite.connect(settings.DB_PATH) as db:
+        async with _connect() as db:
             await db.execute(sql, (
                 defect.id, defect.latitude, defect.longitude,
                 defect.image, defect.detect_time, defect.address
             ))
             await db.commit()
+        event_hub.publish("created", defect)
         return defect
     except aiosqlite.Error as e:
         return None
     
 
+# ----- defect 생성과 분석 작업 등록을 한 트랜잭션으로 -----
+async def create_defect_with_job(defect: DefectOut, job_id: str, idempotency_key: Optional[str] = None) -> Optional[DefectOut]:
+    """
+    손상 정보와 분석 작업(pending)을 함께 저장합니다. 서버가 중간에 꺼져도 작업이 DB에 남아 재시작 시 이어서 처리됩니다.
+    idempotency_key가 있으면 같은 트랜잭션에 기록하므로, 응답 전에 끊겨도 재전송은 이 손상으로 연결됩니다.
+    """
+
+    now = _now_iso()
+    try:
+        async with _connect() as db:
+            await db.execute(
+                """
+                INSERT INTO defects (id, latitude, longitude, image, detect_time, address)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (defect.id, defect.latitude, defect.longitude, defect.image, defect.detect_time, defect.address)
+            )
+            await db.execute(
+                "INSERT INTO analysis_jobs (id, defect_id, status, created_at, updated_at) VALUES (?, ?, 'pending', ?, ?)",
+                (job_id, defect.id, now, now)
+            )
+            if idempotency_key:
+                await _save_idempotency_keys(db, [(idempotency_key, defect.id, False)])
+            await db.commit()
+        event_hub.publish("created", defect)
+        return defect
+    except aiosqlite.Error as e:
+        print(f"❌ 손상 정보/분석 작업 생성 실패: {e}")
+        return None
+
+
+async def create_defects_with_jobs(
+    defects: List[DefectOut], job_ids: List[str], idempotency_keys: Optional[List[Optional[str]]] = None
+) -> bool:
+    """
+    여러 손상 정보와 분석 작업을 executemany로 한 트랜잭션에 저장합니다. (POST /defect-info/batch)
+    idempotency_keys는 defects와 같은 순서의 탐지 ID 목록입니다. (없는 항목은 None)
+    """
+
+    now = _now_iso()
+    try:
+        async with _connect() as db:
+            await db.executemany(
+                """
+                INSERT INTO defects (id, latitude, longitude, image, detect_time, address)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(d.id, d.latitude, d.longitude, d.image, d.detect_time, d.address) for d in defects]
+            )
+            await db.executemany(
+                "INSERT INTO analysis_jobs (id, defect_id, status, created_at, updated_at) VALUES (?, ?, 'pending', ?, ?)",
+                [(job_id, d.id, now, now) for job_id, d in zip(job_ids, defects)]
+            )
+            await _save_idempotency_keys(db, [
+                (key, d.id, False) for key, d in zip(idempotency_keys or [], defects) if key
+            ])
+            await db.commit()
+        for defect in defects:
+            event_hub.publish("created", defect)
+        return True
+    except aiosqlite.Error as e:
+        print(f"❌ 손상 정보 일괄 생성 실패: {e}")
+        return False
+
+
 # ----- 해당 객체에 대한 llava 답변 update -----
 async def patch_defect_in_db(defect_id: str, patch_data) -> Optional[DefectOut]:
     updated_defect = None
 
     try:
-        async with aiosqlite.connect(settings.DB_PATH) as db:
+        async with _connect() as db:
             db.row_factory = aiosqlite.Row
             
             async with db.execute("SELECT * FROM defects WHERE id = ?", (defect_id,)) as cursor:
@@ -82,25 +358,29 @@ async def patch_defect_in_db(defect_id: str, patch_data) -> Optional[DefectOut]:
             
             current_defect = db_row_to_model(current_row)
             patch_dict = patch_data.model_dump(exclude_unset=True)
+            if patch_dict.get("repair_status", "") is None:
+                del patch_dict["repair_status"] # 보수 상태는 비우지 않음
             updated_defect = current_defect.model_copy(update=patch_dict)
 
-            sql = """
-                  UPDATE defects
-                  SET defect_type = ?, urgency = ?, address = ?, repair_status = ?
-                  WHERE id = ?
-                  """
-            await db.execute(sql, (
-                updated_defect.defect_type,
-                updated_defect.urgency,
-                updated_defect.address,
-                updated_defect.repair_status or current_defect.repair_status,
-                updated_defect.id
-            ))
-            await db.commit()
+            # 바꾸는 컬럼만 UPDATE (분석 결과와 주소 채우기가 동시에 들어와도 서로 덮어쓰지 않도록)
+            columns = [c for c in ("defect_type", "urgency", "address", "repair_status") if c in patch_dict]
+            values = [patch_dict[c] for c in columns]
+            if "urgency" in patch_dict:
+                columns.append("urgency_rank")
+                values.append(URGENCY_RANK.get(patch_dict["urgency"], 0))
+            if columns:
+                sql = f"UPDATE defects SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?"
+                await db.execute(sql, (*values, defect_id))
+                await db.commit()
 
     except aiosqlite.Error as e:
         return None
-    
+
+    # 보수 상태가 바뀌었으면 status_changed, 아니면 분석 결과 반영(analyzed)으로 알림
+    if updated_defect.repair_status != current_defect.repair_status:
+        event_hub.publish("status_changed", updated_defect)
+    elif "defect_type" in patch_dict or "urgency" in patch_dict:
+        event_hub.publish("analyzed", updated_defect)
     return updated_defect
 
 
@@ -114,21 +394,12 @@ async def get_all_defects_from_db(sort_by_urgency: bool = False) -> List[DefectO
     sql = "SELECT * FROM defects"
 
     if sort_by_urgency:
-        sql += """
-               ORDER BY
-                   CASE 
-                       WHEN urgency = '높음' THEN 3
-                       WHEN urgency = '보통' THEN 2
-                       WHEN urgency = '낮음' THEN 1
-                       ELSE 0 
-                   END DESC,
-                   detect_time ASC 
-               """
+        sql += " ORDER BY urgency_rank DESC, detect_time ASC" # idx_defects_rank_time 순서 그대로 읽음
     else:
         sql += " ORDER BY detect_time DESC"
 
     try:
-        async with aiosqlite.connect(settings.DB_PATH) as db:
+        async with _connect(read_only=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute(sql) as cursor:
                 rows = await cursor.fetchall()
@@ -138,6 +409,305 @@ async def get_all_defects_from_db(sort_by_urgency: bool = False) -> List[DefectO
         return []
 
 
+# ----- defect 조건 조회 (GET /defects) -----
+DEFECT_COLUMNS = ("id", "latitude", "longitude", "image", "detect_time", "defect_type", "urgency", "address", "repair_status")
+
+async def query_defects(
+    urgency: Optional[List[str]] = None,
+    repair_status: Optional[List[str]] = None,
+    defect_type: Optional[List[str]] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    bbox: Optional[tuple[float, float, float, float]] = None,
+    fields: Optional[List[str]] = None,
+    limit: int = 50,
+    after: Optional[tuple[str, str]] = None,
+) -> tuple[List[dict], Optional[tuple[str, str]]]:
+    """
+    조건에 맞는 손상 기록을 detect_time 최신순(같으면 id 역순)으로 limit개 조회합니다.
+    OFFSET 대신 마지막 항목의 (detect_time, id)를 after로 넘겨 다음 페이지를 읽습니다. (keyset pagination)
+    bbox는 (min_lat, min_lon, max_lat, max_lon)입니다.
+
+    Returns: (요청한 컬럼만 담은 dict 목록, 다음 페이지 위치 또는 None)
+    """
+
+    columns = list(dict.fromkeys((fields or DEFECT_COLUMNS)))
+    select = list(dict.fromkeys(columns + ["detect_time", "id"])) # 다음 페이지 위치 계산용
+
+    where, params = [], []
+    for column, values in (("urgency", urgency), ("repair_status", repair_status), ("defect_type", defect_type)):
+        if values:
+            where.append(f"{column} IN ({','.join('?' * len(values))})")
+            params += values
+    if since:
+        where.append("detect_time >= ?")
+        params.append(since)
+    if until:
+        where.append("detect_time < ?")
+        params.append(until)
+    if bbox:
+        # R*Tree로 후보를 고르고 (float32로 바깥쪽 반올림되어 저장됨) 원래 좌표로 다시 거름
+        where.append(
+            "geo_id IN (SELECT id FROM defects_rtree WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?)"
+            " AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?"
+        )
+        params += [bbox[0], bbox[2], bbox[1], bbox[3]] * 2
+    if after:
+        where.append("(detect_time, id) < (?, ?)")
+        params += list(after)
+
+    sql = f"SELECT {', '.join(select)} FROM defects"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY detect_time DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    try:
+        async with _connect(read_only=True) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+    except aiosqlite.Error as e:
+        print(f"❌ DB 조회 실패: {e}")
+        raise
+
+    next_after = (rows[limit - 1]["detect_time"], rows[limit - 1]["id"]) if len(rows) > limit else None
+    return [{column: row[column] for column in columns} for row in rows[:limit]], next_after
+
+
+# ----- 좌표 기반 조회 / 재탐지 묶기 -----
+_LAST_SEEN_SQL = "COALESCE((SELECT MAX(detect_time) FROM defect_detections WHERE defect_id = d.id), d.detect_time)"
+
+def _cluster_window(detect_time: str) -> tuple[str, str]:
+    try:
+        seen = datetime.fromisoformat(detect_time.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        seen = datetime.now(timezone(timedelta(hours=9))).replace(tzinfo=None)
+    window = timedelta(hours=settings.CLUSTER_WINDOW_HOURS)
+    return (seen - window).strftime("%Y-%m-%d %H:%M:%S"), (seen + window).strftime("%Y-%m-%d %H:%M:%S")
+
+async def find_cluster_defects(points: List[tuple[float, float, str]]) -> List[Optional[str]]:
+    """
+    탐지 [(latitude, longitude, detect_time), ...]마다 CLUSTER_RADIUS_M 안에 있고
+    CLUSTER_WINDOW_HOURS 안에 탐지된 적 있는 미완료 손상 중 가장 가까운 손상의 ID를 찾습니다. (없으면 None)
+    """
+
+    if settings.CLUSTER_RADIUS_M <= 0 or not points:
+        return [None] * len(points)
+
+    sql = f"""
+          SELECT d.id, d.latitude, d.longitude, d.detect_time, {_LAST_SEEN_SQL} AS last_seen
+            FROM defects_rtree r JOIN defects d ON d.geo_id = r.id
+           WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+             AND COALESCE(d.repair_status, '미처리') != '완료'
+          """
+
+    result = []
+    try:
+        async with _connect(read_only=True) as db:
+            for latitude, longitude, detect_time in points:
+                min_lat, min_lon, max_lat, max_lon = bbox_around(latitude, longitude, settings.CLUSTER_RADIUS_M)
+                async with db.execute(sql, (min_lat, max_lat, min_lon, max_lon)) as cursor:
+                    rows = await cursor.fetchall()
+
+                # 손상의 탐지 기간(처음 ~ 마지막 탐지)이 이번 탐지 시각 앞뒤 CLUSTER_WINDOW_HOURS와 겹쳐야 묶음
+                window_start, window_end = _cluster_window(detect_time)
+                candidates = [
+                    (distance_m(latitude, longitude, lat, lon), defect_id)
+                    for defect_id, lat, lon, first_seen, last_seen in rows
+                    if last_seen >= window_start and first_seen <= window_end
+                ]
+                candidates = [c for c in candidates if c[0] <= settings.CLUSTER_RADIUS_M]
+                result.append(min(candidates)[1] if candidates else None)
+    except aiosqlite.Error as e:
+        print(f"❌ 재탐지 손상 조회 실패: {e}")
+        return [None] * len(points)
+    return result
+
+async def attach_detections(
+    detections: List[tuple[str, str, DefectCreate, str]], idempotency_keys: Optional[List[Optional[str]]] = None
+) -> bool:
+    """
+    기존 손상에 묶인 재탐지 [(detection_id, defect_id, DefectCreate, detect_time), ...]를 저장합니다.
+    idempotency_keys는 detections와 같은 순서의 탐지 ID 목록입니다. (없는 항목은 None)
+    """
+
+    now = _now_iso()
+    try:
+        async with _connect() as db:
+            await db.executemany(
+                """
+                INSERT INTO defect_detections (id, defect_id, latitude, longitude, image, detect_time, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(detection_id, defect_id, d.latitude, d.longitude, d.image, detect_time, now)
+                 for detection_id, defect_id, d, detect_time in detections]
+            )
+            await _save_idempotency_keys(db, [
+                (key, defect_id, True) for key, (_, defect_id, _, _) in zip(idempotency_keys or [], detections) if key
+            ])
+            await db.commit()
+        return True
+    except aiosqlite.Error as e:
+        print(f"❌ 재탐지 기록 저장 실패: {e}")
+        return False
+
+async def get_nearby_defects(
+    latitude: float,
+    longitude: float,
+    radius_m: float,
+    limit: int = 20,
+    repair_status: Optional[List[str]] = None,
+) -> List[NearbyDefectOut]:
+    """
+    좌표에서 radius_m 안에 있는 손상을 가까운 순으로 조회합니다. (R*Tree로 후보를 고른 뒤 실제 거리로 거름)
+    """
+
+    min_lat, min_lon, max_lat, max_lon = bbox_around(latitude, longitude, radius_m)
+    sql = f"""
+          SELECT d.*, {_LAST_SEEN_SQL} AS last_detect_time,
+                 1 + (SELECT COUNT(*) FROM defect_detections WHERE defect_id = d.id) AS detections
+            FROM defects_rtree r JOIN defects d ON d.geo_id = r.id
+           WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+          """
+    params = [min_lat, max_lat, min_lon, max_lon]
+    if repair_status:
+        sql += f" AND d.repair_status IN ({','.join('?' * len(repair_status))})"
+        params += repair_status
+
+    try:
+        async with _connect(read_only=True) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+    except aiosqlite.Error as e:
+        print(f"❌ 주변 손상 조회 실패: {e}")
+        raise
+
+    nearby = []
+    for row in rows:
+        distance = distance_m(latitude, longitude, row["latitude"], row["longitude"])
+        if distance <= radius_m:
+            nearby.append(NearbyDefectOut(**dict(row), distance_m=round(distance, 2)))
+    nearby.sort(key=lambda defect: defect.distance_m)
+    return nearby[:limit]
+
+
+# ----- 이미지 dHash로 분석 결과 재사용 -----
+def _hash_chunks(hash_value: int) -> list[int]:
+    return [(hash_value >> (16 * (HASH_CHUNKS - 1 - i))) & 0xFFFF for i in range(HASH_CHUNKS)]
+
+async def find_similar_analysis(hash_value: int) -> Optional[tuple[str, Optional[str], Optional[str], int]]:
+    """
+    PHASH_WINDOW_HOURS 안에 분석한 이미지 중 해밍 거리가 PHASH_MAX_DISTANCE 이하인 가장 가까운 것을 찾습니다.
+    거리가 3 이하면 4칸 중 적어도 한 칸은 정확히 같으므로(비둘기집 원리), 칸별 인덱스로 후보만 읽고 실제 거리를 계산합니다.
+
+    Returns: (defect_id, defect_type, urgency, 해밍 거리) 또는 None
+    """
+
+    max_distance = settings.PHASH_MAX_DISTANCE # config에서 -1 ~ 3으로 검사함
+    if max_distance < 0:
+        return None
+
+    since = (datetime.now(timezone.utc) - timedelta(hours=settings.PHASH_WINDOW_HOURS)).isoformat().replace("+00:00", "Z")
+    chunks = _hash_chunks(hash_value)
+    sql = " UNION ".join(
+        f"SELECT defect_id, dhash, defect_type, urgency FROM image_hashes WHERE h{i} = ? AND created_at >= ?"
+        for i in range(HASH_CHUNKS)
+    )
+    params = [value for chunk in chunks for value in (chunk, since)]
+
+    try:
+        async with _connect(read_only=True) as db:
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+    except aiosqlite.Error as e:
+        print(f"❌ 이미지 해시 조회 실패: {e}")
+        return None
+
+    matches = [
+        ((int(dhash, 16) ^ hash_value).bit_count(), defect_id, defect_type, urgency)
+        for defect_id, dhash, defect_type, urgency in rows
+    ]
+    matches = [m for m in matches if m[0] <= max_distance]
+    if not matches:
+        return None
+    distance, defect_id, defect_type, urgency = min(matches)
+    return defect_id, defect_type, urgency, distance
+
+async def save_image_hash(defect_id: str, hash_value: int, defect_type: Optional[str], urgency: Optional[str]):
+    try:
+        async with _connect() as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO image_hashes (defect_id, dhash, h0, h1, h2, h3, defect_type, urgency, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (defect_id, f"{hash_value:016x}", *_hash_chunks(hash_value), defect_type, urgency, _now_iso())
+            )
+            await db.commit()
+    except aiosqlite.Error as e:
+        print(f"❌ 이미지 해시 저장 실패: {e}")
+
+
+# ----- 주소를 아직 채우지 못한 손상 (GEOCODE_DEFERRED) -----
+async def get_defects_missing_address(limit: int = 500) -> List[tuple[str, float, float]]:
+    """
+    주소가 비어 있는 최근 손상 [(id, latitude, longitude), ...]를 돌려줍니다. (재시작 시 주소 채우기 재개용)
+    """
+
+    try:
+        async with _connect(read_only=True) as db:
+            async with db.execute(
+                "SELECT id, latitude, longitude FROM defects WHERE address IS NULL ORDER BY detect_time DESC LIMIT ?",
+                (limit,)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+    except aiosqlite.Error as e:
+        print(f"❌ 주소 없는 손상 조회 실패: {e}")
+        return []
+
+
+# ----- 드론 재전송 중복 방지 (Idempotency-Key / detection_id) -----
+def _idempotency_cutoff() -> str:
+    return (datetime.now(timezone.utc) - timedelta(hours=settings.IDEMPOTENCY_TTL_HOURS)).isoformat().replace("+00:00", "Z")
+
+async def _save_idempotency_keys(db: aiosqlite.Connection, rows: List[tuple[str, str, bool]]):
+    """
+    [(key, defect_id, attached), ...]를 손상 저장과 같은 트랜잭션에서 기록하고, 보관 기간이 지난 키를 정리합니다.
+    같은 키가 이미 있으면 IntegrityError가 나서 트랜잭션 전체가 취소됩니다. (동시에 들어온 재전송)
+    """
+
+    if not rows:
+        return
+    now = _now_iso()
+    await db.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (_idempotency_cutoff(),))
+    await db.executemany(
+        "INSERT INTO idempotency_keys (key, defect_id, attached, created_at) VALUES (?, ?, ?, ?)",
+        [(key, defect_id, int(attached), now) for key, defect_id, attached in rows]
+    )
+
+async def get_idempotency_keys(keys: List[str]) -> dict[str, tuple[str, bool]]:
+    """
+    IDEMPOTENCY_TTL_HOURS 안에 처리한 키별 (defect_id, 기존 손상에 묶였는지)를 돌려줍니다.
+    """
+
+    if not keys:
+        return {}
+    sql = f"""
+          SELECT key, defect_id, attached FROM idempotency_keys
+           WHERE key IN ({','.join('?' * len(keys))}) AND created_at >= ?
+          """
+    try:
+        async with _connect(read_only=True) as db:
+            async with db.execute(sql, [*keys, _idempotency_cutoff()]) as cursor:
+                rows = await cursor.fetchall()
+    except aiosqlite.Error as e:
+        print(f"❌ 중복 전송 키 조회 실패: {e}")
+        raise
+    return {key: (defect_id, bool(attached)) for key, defect_id, attached in rows}
+
+
 # ----- 오래된 defect 삭제 -----
 async def delete_old_defects(days: int = 30):
     """
@@ -152,8 +722,35 @@ async def delete_old_defects(days: int = 30):
            WHERE detect_time < ?
           """
 
+    # 삭제되는 손상의 캐시된 LLaVA 답변, 분석 작업, 재탐지 기록, 이미지 해시, 중복 전송 키도 함께 삭제
+    answers_sql = """
+                  DELETE FROM llava_answers
+                   WHERE defect_id IN (SELECT id FROM defects WHERE detect_time < ?)
+                  """
+    jobs_sql = """
+               DELETE FROM analysis_jobs
+                WHERE defect_id IN (SELECT id FROM defects WHERE detect_time < ?)
+               """
+    hashes_sql = """
+                 DELETE FROM image_hashes
+                  WHERE defect_id IN (SELECT id FROM defects WHERE detect_time < ?)
+                 """
+    detections_sql = """
+                     DELETE FROM defect_detections
+                      WHERE defect_id IN (SELECT id FROM defects WHERE detect_time < ?)
+                     """
+    keys_sql = """
+               DELETE FROM idempotency_keys
+                WHERE defect_id IN (SELECT id FROM defects WHERE detect_time < ?)
+               """
+
     try:
-        async with aiosqlite.connect(settings.DB_PATH) as db:
+        async with _connect() as db:
+            await db.execute(answers_sql, (threshold_iso,))
+            await db.execute(jobs_sql, (threshold_iso,))
+            await db.execute(detections_sql, (threshold_iso,))
+            await db.execute(hashes_sql, (threshold_iso,))
+            await db.execute(keys_sql, (threshold_iso,))
             await db.execute(sql, (threshold_iso,))
             await db.commit()
         print(f"✅ {days}일 이상 지난 손상 기록 삭제 완료")
@@ -164,7 +761,7 @@ async def delete_old_defects(days: int = 30):
 # ----- 보수 공사 상태 변경 -----
 async def get_defect_by_id(defect_id: str) -> Optional[DefectOut]:
     try:
-        async with aiosqlite.connect(settings.DB_PATH) as db:
+        async with _connect(read_only=True) as db:
             db.row_factory = aiosqlite.Row
             async with db.execute("SELECT * FROM defects WHERE id = ?", (defect_id,)) as cursor:
                 row = await cursor.fetchone()
@@ -175,4 +772,185 @@ async def get_defect_by_id(defect_id: str) -> Optional[DefectOut]:
 
 async def update_repair_status(defect_id: str, new_status: str) -> Optional[DefectOut]:
     patch_data = DefectPatch(repair_status=new_status)
-    return await patch_defect_in_db(defect_id, patch_data)
\ No newline at end of file
+    return await patch_defect_in_db(defect_id, patch_data)
+
+
+# ----- LLaVA 답변 캐시 -----
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+async def get_cached_answer(defect_id: str, question: str, model_revision: str) -> Optional[str]:
+    """
+    (defect_id, 질문, 모델 id@revision)으로 저장된 답변을 조회하고 마지막 접근 시각을 갱신합니다.
+    """
+
+    try:
+        async with _connect() as db:
+            async with db.execute(
+                "SELECT answer FROM llava_answers WHERE defect_id = ? AND question = ? AND model_revision = ?",
+                (defect_id, question, model_revision)
+            ) as cursor:
+                row = await cursor.fetchone()
+
+            cache_lookups.inc(cache="answer", result="hit" if row else "miss")
+            if not row:
+                return None
+
+            await db.execute(
+                "UPDATE llava_answers SET last_access = ? WHERE defect_id = ? AND question = ? AND model_revision = ?",
+                (_now_iso(), defect_id, question, model_revision)
+            )
+            await db.commit()
+            return row[0]
+    except aiosqlite.Error as e:
+        print(f"❌ 답변 캐시 조회 실패: {e}")
+        return None
+
+async def save_cached_answer(defect_id: str, question: str, model_revision: str, answer: str):
+    """
+    답변을 저장하고, 보관 기간이 지났거나 최대 개수를 넘는 오래된(가장 늦게 접근한) 답변을 정리합니다.
+    """
+
+    now = _now_iso()
+    expire_iso = (datetime.now(timezone.utc) - timedelta(days=settings.ANSWER_CACHE_TTL_DAYS)).isoformat().replace("+00:00", "Z")
+
+    try:
+        async with _connect() as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO llava_answers (defect_id, question, model_revision, answer, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (defect_id, question, model_revision, answer, now, now)
+            )
+            await db.execute("DELETE FROM llava_answers WHERE last_access < ?", (expire_iso,))
+            await db.execute(
+                """
+                DELETE FROM llava_answers
+                 WHERE rowid IN (
+                     SELECT rowid FROM llava_answers
+                      ORDER BY last_access DESC
+                      LIMIT -1 OFFSET ?
+                 )
+                """,
+                (settings.ANSWER_CACHE_MAX_ROWS,)
+            )
+            await db.commit()
+    except aiosqlite.Error as e:
+        print(f"❌ 답변 캐시 저장 실패: {e}")
+
+
+# ----- 분석 작업 상태 -----
+async def update_job_status(job_id: str, status: str, error: Optional[str] = None):
+    """
+    작업 상태를 바꿉니다. analyzing으로 바뀔 때마다 시도 횟수(attempts)를 올립니다.
+    """
+
+    try:
+        async with _connect() as db:
+            await db.execute(
+                """
+                UPDATE analysis_jobs
+                   SET status = ?, error = ?, updated_at = ?,
+                       attempts = attempts + (CASE WHEN ? = 'analyzing' THEN 1 ELSE 0 END)
+                 WHERE id = ?
+                """,
+                (status, error, _now_iso(), status, job_id)
+            )
+            await db.commit()
+    except aiosqlite.Error as e:
+        print(f"❌ 분석 작업 상태 변경 실패 (job: {job_id}): {e}")
+
+async def get_job_by_defect_id(defect_id: str) -> Optional[AnalysisJobOut]:
+    try:
+        async with _connect(read_only=True) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM analysis_jobs WHERE defect_id = ? ORDER BY created_at DESC LIMIT 1", (defect_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        if not row:
+            return None
+        return AnalysisJobOut(
+            id=row["defect_id"], job_id=row["id"], status=row["status"], error=row["error"],
+            attempts=row["attempts"], created_at=row["created_at"], updated_at=row["updated_at"]
+        )
+    except aiosqlite.Error as e:
+        print(f"❌ 분석 작업 조회 실패: {e}")
+        return None
+
+async def get_unfinished_jobs() -> List[tuple[str, str]]:
+    """
+    서버 재시작 시 다시 처리할 (job_id, defect_id) 목록입니다.
+    분석 도중 꺼진 작업(analyzing)도 pending으로 되돌려 다시 처리합니다.
+    """
+
+    try:
+        async with _connect() as db:
+            await db.execute("UPDATE analysis_jobs SET status = 'pending' WHERE status = 'analyzing'")
+            await db.commit()
+            async with db.execute(
+                "SELECT id, defect_id FROM analysis_jobs WHERE status = 'pending' ORDER BY created_at"
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+    except aiosqlite.Error as e:
+        print(f"❌ 미완료 분석 작업 조회 실패: {e}")
+        return []
+
+
+# ----- 이미지 파생본(썸네일, 미리보기, ROI crop) -----
+async def save_image_derivatives(image: str, content_hash: str, rows: List[tuple[str, str, int, int, int]]):
+    """
+    원본 이미지의 파생본 목록 [(variant, url, width, height, bytes), ...]을 저장합니다.
+    """
+
+    now = _now_iso()
+    try:
+        async with _connect() as db:
+            await db.executemany(
+                """
+                INSERT OR REPLACE INTO image_derivatives (image, variant, url, content_hash, width, height, bytes, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [(image, variant, url, content_hash, width, height, size, now) for variant, url, width, height, size in rows]
+            )
+            await db.commit()
+    except aiosqlite.Error as e:
+        print(f"❌ 이미지 파생본 저장 실패: {e}")
+
+async def get_derivatives_by_hash(content_hash: str) -> List[tuple[str, str, int, int, int]]:
+    """
+    같은 내용(content hash)의 이미지에 대해 이미 만들어 둔 파생본이 있으면 돌려줍니다.
+    """
+
+    try:
+        async with _connect(read_only=True) as db:
+            async with db.execute(
+                "SELECT variant, url, width, height, bytes FROM image_derivatives WHERE content_hash = ?",
+                (content_hash,)
+            ) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+    except aiosqlite.Error as e:
+        print(f"❌ 이미지 파생본 조회 실패: {e}")
+        return []
+
+async def get_image_derivatives(images: List[str]) -> dict[str, dict[str, str]]:
+    """
+    원본 이미지별 {variant: url}을 한 번에 조회합니다.
+    """
+
+    if not images:
+        return {}
+
+    result: dict[str, dict[str, str]] = {}
+    try:
+        async with _connect(read_only=True) as db:
+            placeholders = ",".join("?" * len(images))
+            async with db.execute(
+                f"SELECT image, variant, url FROM image_derivatives WHERE image IN ({placeholders})", images
+            ) as cursor:
+                for image, variant, url in await cursor.fetchall():
+                    result.setdefault(image, {})[variant] = url
+    except aiosqlite.Error as e:
+        print(f"❌ 이미지 파생본 조회 실패: {e}")
+    return result
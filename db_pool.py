@@ -0,0 +1,124 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiosqlite
+
+from config import settings
+from metrics import db_connect_seconds
+
+
+def _pragmas(read_only: bool) -> list[str]:
+    pragmas = [
+        "PRAGMA journal_mode = WAL",      # 읽기와 쓰기가 서로를 막지 않음
+        "PRAGMA synchronous = NORMAL",    # WAL에서는 체크포인트 때만 fsync (전원이 꺼지면 마지막 커밋 일부만 잃을 수 있음)
+        f"PRAGMA mmap_size = {settings.DB_MMAP_SIZE_MB * 1024 * 1024}",
+        f"PRAGMA cache_size = -{settings.DB_CACHE_SIZE_MB * 1024}", # 음수는 KiB 단위
+        "PRAGMA temp_store = MEMORY",
+        f"PRAGMA busy_timeout = {int(settings.DB_BUSY_TIMEOUT * 1000)}",
+    ]
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    return pragmas
+
+
+class ConnectionPool:
+    """
+    서버가 켜져 있는 동안 유지하는 SQLite 연결 묶음입니다.
+    - 쓰기 연결 1개: 한 번에 한 작업만 쓰도록 잠금으로 순서를 정함 (SQLite는 쓰기가 어차피 하나씩)
+    - 읽기 연결 DB_READERS개: 쓰기와 동시에 읽음 (WAL)
+    연결을 계속 쓰므로 sqlite3의 연결별 prepared statement 캐시(cached_statements)가 재사용됩니다.
+    """
+
+    def __init__(self, path: Path, readers: int):
+        self.path = path
+        self.reader_count = max(1, readers)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+
+    async def _open_connection(self, read_only: bool) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(self.path, cached_statements=settings.DB_CACHED_STATEMENTS)
+        for pragma in _pragmas(read_only):
+            await db.execute(pragma)
+        return db
+
+    async def open(self):
+        # 쓰기 연결을 먼저 열어 WAL로 바꾼 뒤 읽기 연결을 엶
+        self._writer = await self._open_connection(read_only=False)
+        for _ in range(self.reader_count):
+            reader = await self._open_connection(read_only=True)
+            self._all_readers.append(reader)
+            self._readers.put_nowait(reader)
+
+    async def close(self):
+        for db in [self._writer, *self._all_readers]:
+            if db is not None:
+                await db.close()
+        self._writer = None
+        self._all_readers = []
+        self._readers = asyncio.Queue()
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            finally:
+                # 커밋하지 않고 끝난(예외 등) 트랜잭션이 다음 사용자에게 남지 않도록
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                self._writer.row_factory = None
+
+    @asynccontextmanager
+    async def reader(self):
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            if db.in_transaction:
+                await db.rollback()
+            db.row_factory = None
+            self._readers.put_nowait(db)
+
+
+pool: ConnectionPool | None = None
+
+
+async def open_pool():
+    """
+    lifespan 시작 시 호출합니다. 이후 database.py의 함수들은 이 풀의 연결을 빌려 씁니다.
+    """
+
+    global pool
+    settings.DATA_DIR.mkdir(exist_ok=True)
+    pool = ConnectionPool(settings.DB_PATH, settings.DB_READERS)
+    await pool.open()
+    print(f"✅ DB 연결 풀 준비 완료 (쓰기 1개, 읽기 {pool.reader_count}개, WAL)")
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@asynccontextmanager
+async def connect(read_only: bool = False):
+    """
+    풀이 열려 있으면 쓰기 연결 또는 읽기 연결을 빌리고, 없으면(스크립트, 벤치마크) 연결을 새로 엽니다.
+    연결을 얻기까지 기다린 시간을 지표로 남깁니다. (database.py와 주소 캐시가 함께 사용)
+    """
+
+    started = time.perf_counter()
+    if pool is None:
+        async with aiosqlite.connect(settings.DB_PATH) as db:
+            db_connect_seconds.observe(time.perf_counter() - started)
+            yield db
+        return
+
+    async with (pool.reader() if read_only else pool.writer()) as db:
+        db_connect_seconds.observe(time.perf_counter() - started)
+        yield db
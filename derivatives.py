@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import posixpath
+from io import BytesIO
+from pathlib import Path
+
+from PIL import Image
+
+from config import settings
+from database import get_derivatives_by_hash, get_image_derivatives, save_image_derivatives
+from image_store import image_store
+from llava import find_red_box
+from s3_utils import s3_key_from_url, upload_bytes_to_s3
+
+
+# ----- 파생본 종류: 이름 -> 긴 변 최대 길이(px) -----
+VARIANTS = {
+    "thumb": 320,      # 손상 기록 목록 embed
+    "preview": 1280,   # Discord 알림 첨부, 상세 보기 embed
+}
+ROI_MAX_SIZE = 640     # 빨간 박스 주변 crop (박스가 없으면 만들지 않음)
+
+_tasks: dict[str, asyncio.Task] = {}   # 원본 이미지 -> 진행 중인 파생본 생성 작업
+_semaphore = asyncio.Semaphore(2)
+
+
+def _encode_webp(image: Image.Image, max_size: int) -> tuple[bytes, int, int]:
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    buf = BytesIO()
+    image.save(buf, format="WEBP", quality=settings.DERIVATIVE_WEBP_QUALITY, method=4)
+    return buf.getvalue(), image.width, image.height
+
+def _render(data: bytes) -> dict[str, tuple[bytes, int, int]]:
+    """
+    원본 bytes에서 파생본들을 만듭니다. (CPU 작업이므로 스레드에서 실행)
+    """
+
+    image = Image.open(BytesIO(data)).convert("RGB")
+    rendered = {variant: _encode_webp(image, max_size) for variant, max_size in VARIANTS.items()}
+
+    # ROI는 원본 해상도에서 잘라야 박스 안 디테일이 남음
+    box = find_red_box(image)
+    if box is not None:
+        left, top, right, bottom = box
+        margin_x = int((right - left) * settings.ROI_MARGIN)
+        margin_y = int((bottom - top) * settings.ROI_MARGIN)
+        crop = image.crop((
+            max(left - margin_x, 0), max(top - margin_y, 0),
+            min(right + margin_x, image.width), min(bottom + margin_y, image.height)
+        ))
+        rendered["roi"] = _encode_webp(crop, ROI_MAX_SIZE)
+
+    return rendered
+
+async def _store(image_url: str, name: str, data: bytes) -> str:
+    """
+    파생본을 원본과 같은 위치(S3 폴더 또는 로컬 업로드 폴더)에 저장하고 URL을 반환합니다.
+    """
+
+    if image_url.startswith("http://") or image_url.startswith("https://"):
+        s3_key = posixpath.join(posixpath.dirname(s3_key_from_url(image_url)), name)
+        return await upload_bytes_to_s3(s3_key, data, "image/webp")
+
+    local_dir = Path("." + posixpath.dirname(image_url))
+    await asyncio.to_thread((local_dir / name).write_bytes, data)
+    return f"{posixpath.dirname(image_url)}/{name}"
+
+async def _generate(image_url: str):
+    async with _semaphore:
+        data = await image_store.get_bytes(image_url)
+        content_hash = hashlib.sha256(data).hexdigest()[:32]
+
+        # 같은 내용의 이미지가 같은 저장 위치에서 이미 처리됐으면 파생본을 다시 만들지 않고 재사용
+        rows = list({
+            row[0]: row for row in await get_derivatives_by_hash(content_hash)
+            if posixpath.dirname(row[1]) == posixpath.dirname(image_url)
+        }.values())
+        if not rows:
+            rendered = await asyncio.to_thread(_render, data)
+            for variant, (encoded, width, height) in rendered.items():
+                url = await _store(image_url, f"{content_hash}_{variant}.webp", encoded)
+                rows.append((variant, url, width, height, len(encoded)))
+
+        await save_image_derivatives(image_url, content_hash, rows)
+
+    sizes = ", ".join(f"{variant} {size / 1024:.0f}KB" for variant, _, _, _, size in rows)
+    print(f"✅ 이미지 파생본 생성 완료: {image_url} ({len(data) / 1024:.0f}KB → {sizes})")
+
+def schedule_derivatives(image_url: str):
+    """
+    업로드 직후 호출해서 썸네일/미리보기/ROI crop 생성을 백그라운드로 넘깁니다.
+    """
+
+    if image_url in _tasks:
+        return
+
+    async def run():
+        try:
+            await _generate(image_url)
+        except Exception as e:
+            print(f"❌ 이미지 파생본 생성 실패: {image_url} / {e}")
+        finally:
+            _tasks.pop(image_url, None)
+
+    _tasks[image_url] = asyncio.create_task(run())
+
+async def get_derivatives(image_urls: list[str], wait: float = 0) -> dict[str, dict[str, str]]:
+    """
+    원본 이미지별 {variant: url}을 돌려줍니다. 파생본이 없는 이미지는 결과에 없습니다.
+    wait초 동안은 아직 생성 중인 파생본을 기다립니다.
+    """
+
+    pending = [_tasks[url] for url in image_urls if url in _tasks]
+    if pending and wait > 0:
+        await asyncio.wait(pending, timeout=wait)
+    return await get_image_derivatives(image_urls)
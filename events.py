@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, NamedTuple, Optional
+
+from config import settings
+from metrics import event_overflows, event_subscribers, events_published
+from models import DefectOut
+
+
+class Event(NamedTuple):
+    seq: int
+    id: str      # 클라이언트가 이어 받을 때 넘기는 cursor ("{epoch}-{seq}")
+    type: str    # created / analyzed / status_changed / reset
+    data: str    # WebSocket으로 보내는 JSON
+    sse: str     # SSE 프레임 (구독자마다 다시 만들지 않도록 미리 만들어 둠)
+
+
+def _make_event(seq: int, event_id: str, event_type: str, defect: Optional[DefectOut]) -> Event:
+    payload = {"id": event_id, "type": event_type}
+    if defect is not None:
+        payload["defect"] = defect.model_dump(mode="json")
+    data = json.dumps(payload, ensure_ascii=False)
+    return Event(seq, event_id, event_type, data, f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n")
+
+
+class Subscription:
+    """
+    구독자 하나의 이벤트 버퍼입니다. 버퍼(EVENT_SUBSCRIBER_BUFFER)가 가득 차면 더 넣지 않고 overflowed로 표시합니다.
+    스트림은 남은 이벤트를 보낸 뒤 연결을 끊고, 클라이언트는 마지막 cursor로 다시 이어 받습니다.
+    """
+
+    __slots__ = ("queue", "types", "overflowed")
+
+    def __init__(self, types: Optional[set[str]]):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.EVENT_SUBSCRIBER_BUFFER))
+        self.types = types
+        self.overflowed = False
+
+
+class EventHub:
+    """
+    손상 생성 / 분석 완료 / 보수 상태 변경을 대시보드와 봇에 바로 알려주는 프로세스 내 pub/sub입니다.
+    - 최근 EVENT_HISTORY_SIZE개 이벤트를 보관해 끊겼던 구독자가 cursor 다음부터 이어 받음
+    - 구독자는 타이머 없이 버퍼 하나만 가지고, 연결 유지 신호는 작업 하나가 한꺼번에 넣으므로 대기 중인 구독자가 많아도 부담이 적음
+    publish()는 이벤트 루프 안에서만 호출합니다.
+    """
+
+    def __init__(self, history_size: int):
+        self.epoch = f"{int(time.time()):x}" # 서버 시작 시각 (재시작 전에 받은 cursor 구분)
+        self._seq = 0
+        self._history: deque[Event] = deque(maxlen=max(1, history_size))
+        self._subscribers: set[Subscription] = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event_type: str, defect: DefectOut):
+        self._seq += 1
+        event = _make_event(self._seq, f"{self.epoch}-{self._seq}", event_type, defect)
+        self._history.append(event)
+        events_published.inc(type=event_type)
+
+        for subscription in self._subscribers:
+            if subscription.overflowed or (subscription.types and event_type not in subscription.types):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.overflowed = True
+                event_overflows.inc()
+
+    def subscribe(self, cursor: Optional[str] = None, types: Optional[list[str]] = None) -> tuple[Subscription, list[Event]]:
+        """
+        구독을 등록하고 cursor 다음부터 지금까지 놓친 이벤트를 돌려줍니다.
+        놓친 이벤트가 보관 범위를 벗어났거나 재시작 전 cursor면 reset 이벤트 하나를 돌려주므로,
+        클라이언트는 GET /defects로 목록을 다시 읽은 뒤 reset의 id부터 이어 받습니다.
+        """
+
+        if len(self._subscribers) >= settings.EVENT_MAX_SUBSCRIBERS:
+            raise RuntimeError("이벤트 구독자 수가 한도에 도달했습니다.")
+
+        subscription = Subscription(set(types) if types else None)
+        backlog = self._backlog(cursor, subscription.types)
+        self._subscribers.add(subscription)
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        return subscription, backlog
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def _backlog(self, cursor: Optional[str], types: Optional[set[str]]) -> list[Event]:
+        if not cursor:
+            return []
+
+        epoch, _, seq = cursor.rpartition("-")
+        oldest = self._history[0].seq if self._history else self._seq + 1
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq or int(seq) < oldest - 1:
+            return [_make_event(self._seq, f"{self.epoch}-{self._seq}", "reset", None)]
+
+        missed = itertools.islice(self._history, int(seq) - oldest + 1, None)
+        return [event for event in missed if not types or event.type in types]
+
+    async def _heartbeat(self):
+        # EVENT_HEARTBEAT_SECONDS마다 버퍼가 비어 있는 구독자에게 연결 유지 신호(None)를 넣음 (구독자가 없으면 끝남)
+        while self._subscribers:
+            await asyncio.sleep(settings.EVENT_HEARTBEAT_SECONDS)
+            for subscription in self._subscribers:
+                if subscription.queue.empty():
+                    subscription.queue.put_nowait(None)
+
+    async def listen(self, subscription: Subscription) -> AsyncIterator[Optional[Event]]:
+        """
+        구독자의 이벤트를 차례로 돌려줍니다. 이벤트 대신 None이 오면 연결 유지 신호이며,
+        버퍼가 넘쳤으면 남은 이벤트를 다 보낸 뒤 끝납니다.
+        """
+
+        while not (subscription.overflowed and subscription.queue.empty()):
+            yield await subscription.queue.get()
+
+
+event_hub = EventHub(history_size=settings.EVENT_HISTORY_SIZE)
+event_subscribers.set_function(event_hub.subscriber_count)
@@ -0,0 +1,150 @@
+import asyncio
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+
+import httpx
+from PIL import Image
+
+from config import settings
+from metrics import cache_lookups, stage_seconds
+
+
+def _resolve(source: str) -> str:
+    """
+    캐시 키를 정합니다. URL은 그대로, 로컬 경로는 "/images/..."와 "./images/..."가 같은 키가 되도록 맞춥니다.
+    """
+
+    if source.startswith("http://") or source.startswith("https://"):
+        return source
+    return "." + source if source.startswith("/") else source
+
+
+class ImageStore:
+    """
+    손상 이미지를 한 번만 받아서 LLaVA 추론, Discord 첨부, 추가 질문이 함께 쓰도록 합니다.
+    - keep-alive 연결을 재사용하는 httpx.AsyncClient와 동시 다운로드 수 제한(semaphore)
+    - 원본 bytes와 디코딩된 PIL 이미지를 URL별로 보관하는 메모리 한도(byte) 기반 LRU
+    - 같은 이미지를 동시에 요청하면 다운로드는 한 번만 (single-flight)
+    """
+
+    def __init__(self, max_bytes: int, max_concurrency: int, timeout: float):
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self._client: httpx.AsyncClient | None = None
+
+        self._entries: OrderedDict[tuple[str, str], bytes | Image.Image] = OrderedDict()  # ("bytes"|"image", key) -> 값
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=settings.IMAGE_FETCH_CONCURRENCY, max_keepalive_connections=settings.IMAGE_FETCH_CONCURRENCY),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ----- 원본 bytes -----
+    async def get_bytes(self, source: str) -> bytes:
+        key = _resolve(source)
+        data = self._get("bytes", key)
+        if data is not None:
+            self.hits += 1
+            cache_lookups.inc(cache="image", result="hit")
+            return data
+
+        # 이미 같은 이미지를 받는 중이면 그 결과를 기다림
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.hits += 1
+            cache_lookups.inc(cache="image", result="hit")
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        cache_lookups.inc(cache="image", result="miss")
+        inflight = asyncio.ensure_future(self._fetch(key))
+        self._inflight[key] = inflight
+        return await asyncio.shield(inflight)
+
+    async def _fetch(self, key: str) -> bytes:
+        # 기다리던 요청이 취소되더라도 다운로드는 끝까지 진행해서 캐시에 넣음
+        try:
+            async with self._semaphore:
+                with stage_seconds.time(stage="image_fetch"):
+                    if key.startswith("http://") or key.startswith("https://"):
+                        resp = await self._get_client().get(key)
+                        resp.raise_for_status()
+                        data = resp.content
+                    else:
+                        data = await asyncio.to_thread(Path(key).read_bytes)
+        finally:
+            self._inflight.pop(key, None)
+
+        self._put("bytes", key, data)
+        return data
+
+    # ----- 디코딩된 이미지 -----
+    async def get_image(self, source: str) -> Image.Image:
+        key = _resolve(source)
+        image = self._get("image", key)
+        if image is not None:
+            return image
+
+        data = await self.get_bytes(source)
+        image = self._get("image", key) # 다운로드를 기다리는 동안 다른 요청이 디코딩했을 수 있음
+        if image is None:
+            image = await asyncio.to_thread(lambda: Image.open(BytesIO(data)).convert("RGB"))
+            self._put("image", key, image)
+        return image
+
+    # ----- LRU 관리 -----
+    def _get(self, kind: str, key: str):
+        value = self._entries.get((kind, key))
+        if value is not None:
+            self._entries.move_to_end((kind, key))
+        return value
+
+    def _put(self, kind: str, key: str, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        if (kind, key) in self._entries:
+            self.bytes_used -= self._size(self._entries.pop((kind, key)))
+
+        self._entries[(kind, key)] = value
+        self.bytes_used += size
+        while self.bytes_used > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes_used -= self._size(evicted)
+
+    @staticmethod
+    def _size(value) -> int:
+        if isinstance(value, Image.Image):
+            return value.width * value.height * 3
+        return len(value)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "bytes": sum(kind == "bytes" for kind, _ in self._entries),
+            "images": sum(kind == "image" for kind, _ in self._entries),
+            "mb": round(self.bytes_used / (1024 * 1024), 1),
+            "hit_ratio": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+image_store = ImageStore(
+    max_bytes=settings.IMAGE_CACHE_MB * 1024 * 1024,
+    max_concurrency=settings.IMAGE_FETCH_CONCURRENCY,
+    timeout=settings.IMAGE_FETCH_TIMEOUT,
+)
@@ -0,0 +1,428 @@
+import asyncio
+import functools
+import heapq
+import inspect
+import itertools
+import multiprocessing as mp
+import os
+import threading
+from collections import OrderedDict
+from multiprocessing.connection import wait
+from pathlib import Path
+
+import httpx
+
+import metrics
+from config import settings
+from image_store import _resolve, image_store
+from llava import Classification, LlavaBatchScheduler, feature_cache, load_llava_model, run_llava_batch, stream_llava
+
+
+# ----- 작업 우선순위 (값이 작을수록 먼저 처리) -----
+PRIORITY_INTERACTIVE = 0   # Discord 버튼 질문
+PRIORITY_BULK = 10         # /defect-info 분류
+
+
+# ----- 워커 프로세스 -----
+def _load_handlers(backend: str) -> dict:
+    """
+    워커 프로세스 안에서 작업 종류별 처리 함수를 준비합니다.
+    backend="stub"이면 모델 없이 고정된 답을 돌려주는 스텁을 사용합니다. (CPU 테스트용)
+    """
+
+    if backend == "stub":
+        return {
+            "classify": lambda image_paths, *_: [Classification("콘크리트 균열", "낮음") for _ in image_paths],
+            "stream_question": lambda image_path, question, *_: (chunk for chunk in ["[stub] ", f"{question}."]),
+        }
+
+    load_llava_model()
+    return {
+        "classify": run_llava_batch,
+        "stream_question": stream_llava,
+    }
+
+def _picklable(result):
+    # 배치 결과 안의 예외는 부모 프로세스로 안전하게 넘길 수 있도록 RuntimeError로 감쌉니다.
+    if isinstance(result, list):
+        return [RuntimeError(f"{type(r).__name__}: {r}") if isinstance(r, Exception) else r for r in result]
+    return result
+
+def _worker_main(worker_id: int, backend: str, device: str | None, job_queue, conn):
+    if device:
+        os.environ["CUDA_VISIBLE_DEVICES"] = device
+
+    feature_cache.worker = str(worker_id)
+    try:
+        handlers = _load_handlers(backend)
+    except Exception as e:
+        conn.send(("failed", worker_id, None, f"{type(e).__name__}: {e}"))
+        return
+
+    conn.send(("ready", worker_id, None, None))
+
+    while True:
+        job = job_queue.get()
+        if job is None:
+            break
+
+        job_id, kind, args = job
+        try:
+            result = handlers[kind](*args)
+            if inspect.isgenerator(result): # 스트리밍 작업은 조각마다 바로 전송
+                for chunk in result:
+                    conn.send(("chunk", worker_id, job_id, chunk))
+                result = None
+            conn.send(("done", worker_id, job_id, _picklable(result)))
+        except Exception as e:
+            conn.send(("error", worker_id, job_id, f"{type(e).__name__}: {e}"))
+
+        # 이 작업 동안 워커에서 모은 지표(단계별 시간, 토큰 수, 캐시 적중)와 시각 토큰 캐시 크기를 부모 프로세스로 보냄
+        exported = metrics.export()
+        if exported:
+            conn.send(("metrics", worker_id, None, exported))
+        conn.send(("feature_cache", worker_id, None, (feature_cache.bytes, feature_cache.spill_bytes)))
+
+
+# ----- 워커 풀 -----
+class InferencePool:
+    """
+    모델 복제본을 하나씩 가진 N개의 워커 프로세스에 추론 작업을 나눠줍니다.
+    FastAPI/Discord 쪽은 submit()으로 작업만 넣고, 대기 중인 작업은 우선순위 순서로 빈 워커에 배정됩니다.
+    시각 토큰 캐시는 워커마다 따로 있으므로, 같은 defect_id의 작업은 마지막으로 처리한 워커가 비어 있으면 그 워커로 보냅니다.
+    """
+
+    MAX_OWNERS = 10000 # 기억해 두는 defect_id -> 워커 수
+
+    def __init__(self, num_workers: int, backend: str = "llava", devices: list[str] | None = None):
+        self.num_workers = num_workers
+        self.backend = backend
+        self.devices = devices or []
+
+        self._ctx = mp.get_context("spawn")
+        self._workers: dict[int, mp.Process] = {}
+        self._job_queues: dict[int, mp.Queue] = {}
+        self._conns: dict[int, mp.connection.Connection] = {}  # 워커별 결과 파이프 (받는 쪽)
+        self._idle: list[int] = []
+        self._running: dict[int, int] = {}        # worker_id -> job_id
+        self._feature_bytes: dict[int, tuple[int, int]] = {}  # worker_id -> 시각 토큰 캐시 (메모리, 디스크) 바이트
+
+        self._pending: list = []                  # (priority, job_id, kind, args, keys) 힙
+        self._owners: OrderedDict[str, int] = OrderedDict()  # defect_id -> 시각 토큰을 가진 워커
+        self._futures: dict[int, asyncio.Future] = {}
+        self._streams: dict[int, asyncio.Queue] = {}  # 스트리밍 작업의 조각 전달용
+        self._ready: dict[int, asyncio.Future] = {}
+        self._seq = itertools.count()
+
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._reader: threading.Thread | None = None
+        self._closed = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+        await asyncio.gather(*self._ready.values())
+        print(f"✅ 추론 워커 {self.num_workers}개 준비 완료 (backend={self.backend})")
+
+    def _spawn(self, worker_id: int):
+        device = self.devices[worker_id % len(self.devices)] if self.devices else None
+        job_queue = self._ctx.Queue()
+        # 결과는 워커마다 따로 둔 파이프로 받음 (공유 큐는 쓰기 잠금을 쥔 채 죽은 워커가 다른 워커를 모두 막음)
+        conn, worker_conn = self._ctx.Pipe(duplex=False)
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.backend, device, job_queue, worker_conn),
+            daemon=True,
+        )
+        process.start()
+        worker_conn.close() # 워커가 죽으면 받는 쪽에서 EOF가 나도록 부모의 사본은 닫음
+
+        self._workers[worker_id] = process
+        self._job_queues[worker_id] = job_queue
+        self._conns[worker_id] = conn
+        self._ready[worker_id] = self._loop.create_future()
+
+    def _enqueue(self, kind: str, args: tuple, priority: int, keys: tuple) -> tuple[int, asyncio.Future]:
+        if self._closed:
+            raise RuntimeError("추론 워커 풀이 종료되었습니다.")
+
+        job_id = next(self._seq)
+        future = self._loop.create_future()
+        self._futures[job_id] = future
+        heapq.heappush(self._pending, (priority, job_id, kind, args, keys))
+        return job_id, future
+
+    async def submit(self, kind: str, args: tuple, priority: int = PRIORITY_BULK, keys: tuple = ()):
+        """
+        keys는 작업이 다루는 defect_id 목록입니다. (시각 토큰을 가진 워커로 보내는 데 사용)
+        """
+
+        _, future = self._enqueue(kind, args, priority, keys)
+        self._dispatch()
+        return await future
+
+    async def stream(self, kind: str, args: tuple, priority: int = PRIORITY_INTERACTIVE, keys: tuple = ()):
+        """
+        워커가 생성하는 조각을 도착하는 대로 yield 하는 비동기 제너레이터입니다.
+        """
+
+        job_id, future = self._enqueue(kind, args, priority, keys)
+        chunks = asyncio.Queue()
+        self._streams[job_id] = chunks
+        self._dispatch()
+
+        try:
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+            await future
+        finally:
+            self._streams.pop(job_id, None)
+
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def feature_cache_bytes(self) -> dict[int, tuple[int, int]]:
+        # 워커가 마지막 작업 뒤에 알려 온 값
+        return dict(self._feature_bytes)
+
+    def _dispatch(self):
+        while self._idle and self._pending:
+            _, job_id, kind, args, keys = heapq.heappop(self._pending)
+            if self._futures[job_id].cancelled():
+                self._futures.pop(job_id)
+                continue
+
+            worker_id = self._pick_worker(keys)
+            self._running[worker_id] = job_id
+            self._job_queues[worker_id].put((job_id, kind, args))
+
+    def _pick_worker(self, keys: tuple) -> int:
+        # 시각 토큰을 가진 워커가 비어 있으면 그 워커, 아니면 아무 빈 워커 (그 워커가 새 주인이 됨)
+        owner = next((self._owners[key] for key in keys if key in self._owners), None)
+        worker_id = owner if owner in self._idle else self._idle[-1]
+        self._idle.remove(worker_id)
+
+        for key in keys:
+            self._owners[key] = worker_id
+            self._owners.move_to_end(key)
+        while len(self._owners) > self.MAX_OWNERS:
+            self._owners.popitem(last=False)
+        return worker_id
+
+    # ----- 결과 수신 (별도 스레드 → 이벤트 루프) -----
+    def _read_results(self):
+        while not self._closed:
+            conns = {conn: worker_id for worker_id, conn in list(self._conns.items())}
+            ready = wait(list(conns), timeout=1)
+            if not ready:
+                self._loop.call_soon_threadsafe(self._check_workers)
+                continue
+
+            for conn in ready:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    # 워커가 종료되어 파이프가 닫힘 (비정상 종료라면 _check_workers가 새로 띄움)
+                    if self._conns.get(conns[conn]) is conn:
+                        del self._conns[conns[conn]]
+                    conn.close()
+                    self._loop.call_soon_threadsafe(self._check_workers)
+                    continue
+                self._loop.call_soon_threadsafe(self._on_message, *message)
+
+        for conn in list(self._conns.values()):
+            conn.close()
+
+    def _on_message(self, status: str, worker_id: int, job_id: int | None, payload):
+        if status == "ready":
+            self._idle.append(worker_id)
+            ready = self._ready.get(worker_id)
+            if ready and not ready.done():
+                ready.set_result(None)
+        elif status == "failed":
+            print(f"❌ 추론 워커 {worker_id} 모델 로드 실패: {payload}")
+            self._workers.pop(worker_id, None)
+            ready = self._ready.get(worker_id)
+            if ready and not ready.done():
+                ready.set_exception(RuntimeError(payload))
+            return
+        elif status == "metrics":
+            metrics.merge(payload)
+            return
+        elif status == "feature_cache":
+            self._feature_bytes[worker_id] = payload
+            return
+        elif status == "chunk":
+            chunks = self._streams.get(job_id)
+            if chunks is not None:
+                chunks.put_nowait(payload)
+            return
+        else:
+            self._running.pop(worker_id, None)
+            self._idle.append(worker_id)
+            self._end_stream(job_id)
+            future = self._futures.pop(job_id, None)
+            if future and not future.done():
+                if status == "done":
+                    future.set_result(payload)
+                else:
+                    future.set_exception(RuntimeError(payload))
+
+        self._dispatch()
+
+    def _end_stream(self, job_id: int | None):
+        chunks = self._streams.get(job_id)
+        if chunks is not None:
+            chunks.put_nowait(None)
+
+    def _check_workers(self):
+        # 작업 도중 죽은 워커는 해당 작업을 실패 처리하고 새로 띄웁니다.
+        for worker_id, process in list(self._workers.items()):
+            if self._closed or process.is_alive():
+                continue
+
+            print(f"❌ 추론 워커 {worker_id} 비정상 종료 (exitcode={process.exitcode}), 재시작합니다.")
+            job_id = self._running.pop(worker_id, None)
+            self._end_stream(job_id)
+            future = self._futures.pop(job_id, None) if job_id is not None else None
+            if future and not future.done():
+                future.set_exception(RuntimeError(f"추론 워커 {worker_id}가 비정상 종료되었습니다."))
+            if worker_id in self._idle:
+                self._idle.remove(worker_id)
+            for key in [key for key, owner in self._owners.items() if owner == worker_id]:
+                del self._owners[key] # 새로 띄운 워커의 캐시는 비어 있음
+            self._feature_bytes.pop(worker_id, None)
+            self._spawn(worker_id)
+
+    async def stop(self):
+        self._closed = True
+        for job_queue in self._job_queues.values():
+            job_queue.put(None)
+        for process in self._workers.values():
+            await asyncio.to_thread(process.join, 10)
+            if process.is_alive():
+                process.terminate()
+
+        for job_id, future in self._futures.items():
+            self._end_stream(job_id)
+            if not future.done():
+                future.set_exception(RuntimeError("추론 워커 풀이 종료되었습니다."))
+        self._futures.clear()
+        print("✅ 추론 워커 종료 완료")
+
+
+# ----- 앱에서 사용하는 제출 함수 -----
+pool: InferencePool | None = None
+
+async def start_inference_pool():
+    """
+    LLAVA_WORKERS > 0 이면 워커 프로세스 풀을 띄웁니다. 0이면 기존처럼 현재 프로세스에서 추론합니다.
+    """
+
+    global pool
+    if settings.LLAVA_WORKERS <= 0:
+        return
+
+    devices = [d.strip() for d in settings.LLAVA_WORKER_DEVICES.split(",") if d.strip()]
+    pool = InferencePool(settings.LLAVA_WORKERS, backend=settings.LLAVA_WORKER_BACKEND, devices=devices)
+    await pool.start()
+
+async def stop_inference_pool():
+    global pool
+    if pool is not None:
+        await pool.stop()
+        pool = None
+
+async def _fetch_image(image_path: str):
+    """
+    image_store에서 이미지를 받아 옵니다. 워커 프로세스로는 원본 bytes를, 현재 프로세스에서는 디코딩된 이미지를 넘깁니다.
+    """
+
+    if pool is not None:
+        return await image_store.get_bytes(image_path)
+    return await image_store.get_image(image_path)
+
+def _read_image_bytes(image_path: str) -> bytes:
+    # 워커 프로세스 안에서 이미지를 직접 받음 (image_store는 부모 프로세스의 이벤트 루프에 묶여 있음)
+    source = _resolve(image_path)
+    if source.startswith("http://") or source.startswith("https://"):
+        response = httpx.get(source, timeout=settings.IMAGE_FETCH_TIMEOUT, follow_redirects=True)
+        response.raise_for_status()
+        return response.content
+    return Path(source).read_bytes()
+
+def _get_image_from_store(image_path: str, loop: asyncio.AbstractEventLoop):
+    # 추론 스레드에서 호출: 이벤트 루프의 image_store로 받아 옴
+    return asyncio.run_coroutine_threadsafe(image_store.get_image(image_path), loop).result()
+
+def _image_loader(image_path: str):
+    """
+    질문 답변용 이미지를 바로 받지 않고, 시각 토큰이 캐시에 없을 때만 받아 오는 함수를 돌려줍니다.
+    워커 프로세스에는 pickle 가능한 함수(워커가 직접 받음)를, 현재 프로세스에서는 image_store를 쓰는 함수를 넘깁니다.
+    """
+
+    if pool is not None:
+        return functools.partial(_read_image_bytes, image_path)
+    return functools.partial(_get_image_from_store, image_path, asyncio.get_running_loop())
+
+async def classify_batch(image_paths: list[str], defect_ids: list[str | None]) -> list:
+    # 다운로드에 실패한 항목은 해당 위치에 예외를 담고 나머지만 추론
+    # 새 손상은 시각 토큰이 없으므로 미리 받아 두고(Discord 첨부와 다운로드 공유), 현재 프로세스의 캐시에 이미 있으면 받지 않음
+    async def fetch(image_path: str, defect_id: str | None):
+        if pool is None and defect_id and feature_cache.has(defect_id):
+            return _image_loader(image_path)
+        return await _fetch_image(image_path)
+
+    fetched = await asyncio.gather(*(fetch(p, i) for p, i in zip(image_paths, defect_ids)), return_exceptions=True)
+    indices = [i for i, image in enumerate(fetched) if not isinstance(image, Exception)]
+    images = [fetched[i] for i in indices]
+    ids = [defect_ids[i] for i in indices]
+
+    if images:
+        if pool is not None:
+            classifications = await pool.submit("classify", (images, ids), PRIORITY_BULK, keys=tuple(i for i in ids if i))
+        else:
+            classifications = await asyncio.to_thread(run_llava_batch, images, ids)
+        for i, classification in zip(indices, classifications):
+            fetched[i] = classification
+
+    return fetched
+
+async def stream_question(image_path: str, question: str, defect_id: str | None, defect_type: str | None, urgency: str | None):
+    """
+    질문 답변(영문)을 생성되는 대로 조각 단위로 yield 하는 비동기 제너레이터입니다.
+    """
+
+    args = (_image_loader(image_path), question, defect_id, defect_type, urgency)
+    if pool is not None:
+        async for chunk in pool.stream("stream_question", args, PRIORITY_INTERACTIVE, keys=(defect_id,) if defect_id else ()):
+            yield chunk
+        return
+
+    # 워커 풀이 없으면 스레드에서 제너레이터를 돌리고 조각을 이벤트 루프로 넘겨받습니다.
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def produce():
+        try:
+            for chunk in stream_llava(*args):
+                loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        finally:
+            loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+    producer = asyncio.ensure_future(asyncio.to_thread(produce))
+    while (chunk := await chunks.get()) is not None:
+        yield chunk
+    await producer
+
+
+classify_scheduler = LlavaBatchScheduler(
+    max_batch_size=settings.LLAVA_BATCH_SIZE,
+    max_wait_ms=settings.LLAVA_BATCH_WAIT_MS,
+    runner=classify_batch,
+)
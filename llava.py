@@ -1,10 +1,17 @@
-import torch, textwrap, re
+import torch, textwrap, re, asyncio, time, threading, hashlib
+import numpy as np
+from collections import OrderedDict
+from pathlib import Path
+from typing import NamedTuple
 from transformers import AutoProcessor, LlavaForConditionalGeneration, BitsAndBytesConfig
 from PIL import Image
 from deep_translator import GoogleTranslator
 from io import BytesIO
 import requests
 
+from config import settings
+from metrics import cache_lookups, feature_cache_lookups, generated_tokens, generation_tokens_per_second, stage_seconds
+
 
 _model = None
 _processor = None
@@ -13,7 +20,7 @@ _device = None
 
 defect_type_choice = {
     "Concrete Crack" : "콘크리트 균열",
-    "Paing Damage" : "도장 손상",
+    "Paint Damage" : "도장 손상",
     "Rebar Exposure" : "철근 노출"
 }
 
@@ -23,6 +30,24 @@ urgency_choice = {
     "Low" : "낮음"
 }
 
+# 로짓 점수 방식 분류에서 비교하는 (손상 유형, 위험도) 후보 답변
+classify_candidates = [
+    (defect_type, urgency) for defect_type in defect_type_choice for urgency in urgency_choice
+] + [("None", "None")]
+
+
+class Classification(NamedTuple):
+    defect_type: str | None
+    urgency: str | None
+    probabilities: dict | None = None    # {"defect_type": {...}, "urgency": {...}} (score 모드만)
+
+
+def model_revision() -> str:
+    """
+    캐시 키에 넣는 모델 구분값입니다. revision만 쓰면 LLAVA_MODEL_ID를 바꿨을 때 다른 모델의 결과를 재사용하게 됩니다.
+    """
+
+    return f"{settings.LLAVA_MODEL_ID}@{settings.LLAVA_MODEL_REVISION}"
 
 def load_llava_model():
     global _model, _processor, _device
@@ -30,8 +55,8 @@ def load_llava_model():
         return _model, _processor, _device
 
     # 모델과 프로세서 준비
-    model_id = "llava-hf/llava-1.5-7b-hf"
-    revision = "a272c74"
+    model_id = settings.LLAVA_MODEL_ID
+    revision = settings.LLAVA_MODEL_REVISION
     
     if torch.backends.mps.is_available(): # 맥북 gpu
         _device = "mps"
@@ -51,13 +76,26 @@ def load_llava_model():
     
     # 모델 로드
     print("----- LLaVA 모델 불러오는 중 -----")
-    _model = LlavaForConditionalGeneration.from_pretrained(
-        model_id,
-        revision=revision,
-        quantization_config=quantization_config,
-        torch_dtype=torch.float16,
-        device_map="auto"
-    )
+    if _device == "cpu":
+        _configure_cpu_threads()
+        _model = LlavaForConditionalGeneration.from_pretrained(
+            model_id,
+            revision=revision,
+            torch_dtype=torch.bfloat16 if settings.LLAVA_CPU_DTYPE == "bf16" else torch.float32,
+            low_cpu_mem_usage=True
+        )
+        _model = _prepare_cpu_model(_model)
+    else:
+        _model = LlavaForConditionalGeneration.from_pretrained(
+            model_id,
+            revision=revision,
+            quantization_config=quantization_config,
+            torch_dtype=torch.float16,
+            device_map="auto"
+        )
+
+    if settings.LLAVA_TORCH_COMPILE:
+        _model.language_model = _compile_module(_model.language_model)
 
     try:
         _processor = AutoProcessor.from_pretrained(model_id, revision=revision)
@@ -69,34 +107,140 @@ def load_llava_model():
     
     return _model, _processor, _device
 
+# ----- CPU 추론 설정 -----
+def _configure_cpu_threads():
+    # intra-op(연산 하나를 나눠 쓰는 스레드) / inter-op(독립 연산 병렬) 스레드 수 설정
+    if settings.LLAVA_CPU_THREADS > 0:
+        torch.set_num_threads(settings.LLAVA_CPU_THREADS)
+    if settings.LLAVA_CPU_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(settings.LLAVA_CPU_INTEROP_THREADS)
+        except RuntimeError as e: # 이미 병렬 작업이 시작된 뒤에는 바꿀 수 없음
+            print(f"❌ inter-op 스레드 수 설정 실패: {e}")
+
+    print(f"ℹ️ CPU 스레드: intra-op {torch.get_num_threads()} / inter-op {torch.get_num_interop_threads()}")
+
+def _prepare_cpu_model(model):
+    """
+    CPU에서 float16 연산은 매우 느리므로 fp32/bf16으로 올린 모델을 받아 필요하면 int8 동적 양자화를 적용합니다.
+    양자화는 연산량 대부분을 차지하는 언어 모델의 Linear 층에만 적용하고, 비전 타워는 원래 정밀도를 유지합니다.
+    """
+
+    cpu_dtype = settings.LLAVA_CPU_DTYPE
+    if cpu_dtype not in ("fp32", "bf16", "int8"):
+        raise ValueError(f"지원하지 않는 LLAVA_CPU_DTYPE입니다: {cpu_dtype}")
+
+    model = model.eval()
+    if cpu_dtype == "int8":
+        model.language_model = torch.ao.quantization.quantize_dynamic(
+            model.language_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+
+    print(f"ℹ️ CPU 모드: {cpu_dtype}")
+    return model
+
+def _compile_module(module):
+    try:
+        return torch.compile(module, dynamic=True)
+    except Exception as e: # 컴파일을 지원하지 않는 환경이면 그대로 사용
+        print(f"❌ torch.compile 실패, 컴파일 없이 진행: {e}")
+        return module
+
 def _as_str(m):
     return m.group(1).strip() if isinstance(m, re.Match) else (m.strip() if isinstance(m, str) else "")
 
-def load_image(image_path: str, question: str|None)-> Image.Image:
+@stage_seconds.timed(stage="preprocess")
+def load_image(image_path, question: str|None)-> Image.Image:
+    # 0) 필요할 때 이미지를 받아 오는 함수인 경우 (inference_worker가 넘김, 시각 토큰이 캐시에 없을 때만 호출됨)
+    if callable(image_path):
+        image_path = image_path()
+
+    # image_store에서 이미 받아 둔 원본 bytes 또는 디코딩된 이미지인 경우
+    if isinstance(image_path, Image.Image):
+        image = image_path
+    elif isinstance(image_path, bytes):
+        image = Image.open(BytesIO(image_path)).convert("RGB")
+
     # 1) S3 URL인 경우
-    if image_path.startswith("http://") or image_path.startswith("https://"):
+    elif image_path.startswith("http://") or image_path.startswith("https://"):
         resp = requests.get(image_path, timeout=10)
         resp.raise_for_status()
-        return Image.open(BytesIO(resp.content)).convert("RGB")
+        image = Image.open(BytesIO(resp.content)).convert("RGB")
 
     # 2) 로컬 경로인 경우
-    local_path = image_path if question else "." + image_path
-    return Image.open(local_path).convert("RGB")
+    else:
+        local_path = image_path if question else "." + image_path
+        image = Image.open(local_path).convert("RGB")
 
-def run_llava(image_path: str, question: str|None, defect_id: str|None, defect_type: str|None, urgency:str|None):
+    return crop_to_roi(image) if settings.ROI_ENABLED else image
+
+# ----- 빨간 박스(ROI) 검출 및 crop -----
+def find_red_box(image: Image.Image) -> tuple[int, int, int, int] | None:
     """
-    디스코드 챗봇에서 호출용:
-        image_path: 분석할 이미지 파일 경로
-        question: 버튼으로 받은 한국어 질문
+    엣지 디바이스가 그린 빨간 사각형 테두리를 찾아 (left, top, right, bottom)을 돌려줍니다. 없으면 None.
+    테두리는 긴 가로/세로 빨간 선이므로, 빨간 픽셀이 많이 몰린 행과 열을 찾습니다.
+    가로선을 찾을 때는 열을, 세로선을 찾을 때는 행을 stride 간격으로 건너뛰어 계산량을 줄입니다.
     """
-    
-    model, processor, device = load_llava_model()
 
-    # 이미지와 프롬프트 입력받기
-    image = load_image(image_path, question)
+    arr = np.asarray(image)
+    height, width = arr.shape[:2]
+    stride = max(1, max(width, height) // 1024)
+
+    def red_mask(pixels: np.ndarray) -> np.ndarray:
+        r, g, b = (pixels[..., c].astype(np.int16) for c in range(3))
+        return (r >= 150) & (g <= 80) & (b <= 80) & (r - np.maximum(g, b) >= 100)
+
+    row_counts = red_mask(arr[:, ::stride]).sum(axis=1)  # 행마다 빨간 픽셀 수 (가로선 후보)
+    col_counts = red_mask(arr[::stride, :]).sum(axis=0)  # 열마다 빨간 픽셀 수 (세로선 후보)
+
+    min_length = settings.ROI_MIN_LINE_RATIO
+    rows = np.flatnonzero(row_counts >= min_length * width / stride)
+    cols = np.flatnonzero(col_counts >= min_length * height / stride)
+    if len(rows) < 2 or len(cols) < 2:
+        return None
+
+    left, top, right, bottom = int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+    if right - left < min_length * width or bottom - top < min_length * height:
+        return None # 선 하나만 잡힌 경우
+    if len(rows) > (bottom - top) / 2 or len(cols) > (right - left) / 2: # rows, cols 모두 원본 해상도의 인덱스
+        return None # 테두리가 아니라 빨간 면(지붕, 간판 등)
+    return left, top, right, bottom
 
-    # llava 질문(+배경지식 제공)
-    prompt_start = textwrap.dedent(
+def crop_to_roi(image: Image.Image) -> Image.Image:
+    """
+    빨간 박스 주변을 ROI_MARGIN만큼 여유를 두고 잘라냅니다. 박스가 없으면 원본을 그대로 돌려줍니다.
+    CLIP 프로세서는 짧은 변 기준으로 줄인 뒤 가운데를 정사각형으로 자르므로, 박스가 잘리지 않도록 정사각형으로 잘라냅니다.
+    """
+
+    box = find_red_box(image)
+    if box is None:
+        return image
+
+    left, top, right, bottom = box
+    width, height = image.size
+    side = int(max(right - left, bottom - top) * (1 + 2 * settings.ROI_MARGIN))
+    side = min(side, width, height)
+
+    # 박스 중심 기준 정사각형을 이미지 안으로 밀어 넣음
+    x = min(max((left + right - side) // 2, 0), width - side)
+    y = min(max((top + bottom - side) // 2, 0), height - side)
+    return image.crop((x, y, x + side, y + side))
+
+# ----- 지각 해시(dHash) -----
+def dhash(image: Image.Image) -> int:
+    """
+    9x8 흑백으로 줄인 뒤 가로로 이웃한 픽셀의 밝기 비교 결과 64비트를 정수로 돌려줍니다.
+    재전송된 같은 프레임이나 거의 같은 프레임은 해밍 거리가 0~몇 비트 이내로 나옵니다.
+    """
+
+    arr = np.asarray(image.convert("L").resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return int.from_bytes(np.packbits(arr[:, 1:] > arr[:, :-1]).tobytes(), "big")
+
+
+# ----- 프롬프트 템플릿 -----
+# 고정된 지시문은 이미지 앞(프롬프트 앞부분)에 두어 KV 캐시로 재사용하고,
+# 손상마다 달라지는 분류 결과 힌트는 이미지 뒤에 붙입니다.
+CLASSIFY_PROMPT = textwrap.dedent(
     """
     You are an AI assistant analyzing a potential building defect from a drone image for a preliminary assessment.
     Analyze the image carefully and provide the following information in a structured format.
@@ -148,104 +292,688 @@ def run_llava(image_path: str, question: str|None, defect_id: str|None, defect_t
     1. Defect Type: <one of the four categories>
     2. Urgency for Inspection: <Low, Medium, or High>
 
-    Do not include any additional explanation.""")
-
-
-    llava_questions = {
-        "이미지에 나타난 손상에 대해 분석 요약해주세요": textwrap.dedent(f"""You are an AI assistant analyzing a potential building defect from a drone image for a preliminary assessment.
-                                                                Your analysis is NOT a substitute for a professional engineering inspection.
-
-                                                                Focus your attention on the area inside the red bounding box, as that region contains the suspected damage.
-
-                                                                For context, this damage has been previously classified as:
-                                                                - Defect type: {defect_type}
-                                                                - Preliminary urgency level: {urgency}
-                                                                You may use this information as a soft hint, but base your description primarily on what you can see in the image itself.
-
-                                                                Your answer MUST:
-                                                                - Please answer in 4–5 full sentences with a detailed explanation, in a natural conversational tone.
-                                                                - Give a very concrete visual description of the defect: its exact location inside the box (e.g., near the top edge, along a joint, at a corner), its shape (line, patch, spot, network of cracks, etc.), its approximate size relative to nearby elements (e.g., compared to bricks, tiles, or panel width), and its color/texture compared to the surrounding surface (e.g., darker, rougher, exposed rebar, peeled paint).
-                                                                - Describe how the damage relates to nearby structural features such as joints, edges, corners, beams, columns, window frames, or reinforcement bars if they are visible.
-                                                                - Then explain what kinds of problems this damage might lead to (e.g., water penetration, corrosion of reinforcement, spalling, loss of protective cover, safety risk, aesthetic issue).
-
-                                                                Follow this pattern as closely as possible:
-                                                                "The damage in the image appears as [detailed visual description of the damage: exact position inside the box, shape, approximate size, and visible texture/color differences compared to the surrounding area]. It is located [describe its position relative to edges, corners, joints, or structural members]. Based on this appearance, it could cause [specific potential issues or risks]. These issues are more or less likely because [brief reasoning using visible clues such as crack width, length, depth, exposed rebar, staining, or repeated patterns]."                                                      
-                                                            """),
-        "어떤 조치가 필요할지 조언해주세요": textwrap.dedent(f"""You should answer as if you were an experienced building inspection assistant who is used to explaining damage and suggesting general maintenance directions.
-                                                        Focus your attention on the area inside the red bounding box, as that region contains the suspected damage.
-                                                        For context, this damage has been previously classified as:
-                                                        - Defect type: {defect_type}
-                                                        - Preliminary urgency level: {urgency}
-
-                                                        Your primary goal is to:
-                                                        1) explain, in plain language, what kinds of problems this visible damage might cause if it worsens, and
-                                                        2) suggest one or two reasonable, high-level follow-up actions (for example: closer professional inspection, monitoring over time, simple protective repair, etc.), based on what you can see in the image.
-                                                        Do give detailed methods.
-                                                        Avoid generic answers that only say “a professional inspection is needed.”  
-                                                        First, provide concrete but cautious observations and general recommendations.  
-                                                        Only at the end of your answer, add one short sentence noting that a professional on-site inspection is required before any final repair decision.
-                                                        Please answer in 4–5 full sentences with a detailed explanation.
-                                                        """)
-    }
-
-    user_text = llava_questions.get(question, question) if question else (prompt_start).strip()
-    
-    if device=="mps": # 로컬용(맥북) 모델용 템플릿 문자열 생성
-        messages = [{
-            "role": "user",
-            "content": [
-                {"type": "image"},
-                {"type": "text", "text": user_text},
-            ],
-        }]
-
-        prompt_for_model = processor.apply_chat_template(
-            messages, add_generation_prompt=True, tokenize=False
-        )
-    elif device=="cuda": # 서버(aws)용
-        prompt_for_model = (
-            "USER: <image>\n"
-            f"{user_text}\n"
-            "ASSISTANT:"
-        )
+    Do not include any additional explanation.""").strip()
+
+QUESTION_PROMPTS = {
+    "이미지에 나타난 손상에 대해 분석 요약해주세요": textwrap.dedent("""
+    You are an AI assistant analyzing a potential building defect from a drone image for a preliminary assessment.
+    Your analysis is NOT a substitute for a professional engineering inspection.
+
+    Focus your attention on the area inside the red bounding box, as that region contains the suspected damage.
+
+    Your answer MUST:
+    - Please answer in 4–5 full sentences with a detailed explanation, in a natural conversational tone.
+    - Give a very concrete visual description of the defect: its exact location inside the box (e.g., near the top edge, along a joint, at a corner), its shape (line, patch, spot, network of cracks, etc.), its approximate size relative to nearby elements (e.g., compared to bricks, tiles, or panel width), and its color/texture compared to the surrounding surface (e.g., darker, rougher, exposed rebar, peeled paint).
+    - Describe how the damage relates to nearby structural features such as joints, edges, corners, beams, columns, window frames, or reinforcement bars if they are visible.
+    - Then explain what kinds of problems this damage might lead to (e.g., water penetration, corrosion of reinforcement, spalling, loss of protective cover, safety risk, aesthetic issue).
+
+    Follow this pattern as closely as possible:
+    "The damage in the image appears as [detailed visual description of the damage: exact position inside the box, shape, approximate size, and visible texture/color differences compared to the surrounding area]. It is located [describe its position relative to edges, corners, joints, or structural members]. Based on this appearance, it could cause [specific potential issues or risks]. These issues are more or less likely because [brief reasoning using visible clues such as crack width, length, depth, exposed rebar, staining, or repeated patterns]."
+    """).strip(),
+    "어떤 조치가 필요할지 조언해주세요": textwrap.dedent("""
+    You should answer as if you were an experienced building inspection assistant who is used to explaining damage and suggesting general maintenance directions.
+    Focus your attention on the area inside the red bounding box, as that region contains the suspected damage.
+
+    Your primary goal is to:
+    1) explain, in plain language, what kinds of problems this visible damage might cause if it worsens, and
+    2) suggest one or two reasonable, high-level follow-up actions (for example: closer professional inspection, monitoring over time, simple protective repair, etc.), based on what you can see in the image.
+    Do give detailed methods.
+    Avoid generic answers that only say “a professional inspection is needed.”
+    First, provide concrete but cautious observations and general recommendations.
+    Only at the end of your answer, add one short sentence noting that a professional on-site inspection is required before any final repair decision.
+    Please answer in 4–5 full sentences with a detailed explanation.
+    """).strip(),
+}
+
+QUESTION_CONTEXT = textwrap.dedent("""
+    For context, this damage has been previously classified as:
+    - Defect type: {defect_type}
+    - Preliminary urgency level: {urgency}
+    You may use this information as a soft hint, but base your description primarily on what you can see in the image itself.
+    """).strip()
+
+def _build_prompt_parts(question: str|None, defect_type: str|None, urgency: str|None) -> tuple[str, str]:
+    """
+    (이미지 앞 고정 프롬프트, 이미지 뒤 가변 프롬프트)를 만듭니다.
+    앞부분은 질문 종류별로 항상 같은 문자열이라 prefix_cache의 키로 쓰입니다.
+    """
+
+    if question is None:
+        static_text, dynamic_text = CLASSIFY_PROMPT, ""
+    elif question in QUESTION_PROMPTS:
+        static_text = QUESTION_PROMPTS[question]
+        dynamic_text = QUESTION_CONTEXT.format(defect_type=defect_type, urgency=urgency)
+    else: # 버튼 외의 자유 질문
+        static_text, dynamic_text = "", question
+
+    prefix_text = f"USER: {static_text}\n" if static_text else "USER: "
+    suffix_text = f"\n{dynamic_text}\nASSISTANT:" if dynamic_text else "\nASSISTANT:"
+    return prefix_text, suffix_text
 
-    # 모델 추론 실행
-    processor.patch_size = model.config.vision_config.patch_size
-    processor.vision_feature_select_strategy = model.config.vision_feature_select_strategy
 
-    inputs = processor(
-        text=prompt_for_model,
-        images=image,
-        return_tensors="pt",
+# ----- 프롬프트 앞부분 KV 캐시 -----
+class PrefixCache:
+    """
+    고정 프롬프트 앞부분의 토큰과 past_key_values를 보관합니다.
+    (모델 id, revision, 로드된 모델 객체)가 바뀌면 모든 항목을 버립니다.
+    """
+
+    def __init__(self):
+        self._model_key = None
+        self._entries: dict[str, tuple[torch.Tensor, tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model, tokenizer, prefix_text: str) -> tuple[torch.Tensor, tuple]:
+        model_key = (settings.LLAVA_MODEL_ID, settings.LLAVA_MODEL_REVISION, id(model))
+        if model_key != self._model_key:
+            self._entries.clear()
+            self._model_key = model_key
+
+        entry = self._entries.get(prefix_text)
+        cache_lookups.inc(cache="prefix_kv", result="miss" if entry is None else "hit")
+        if entry is None:
+            self.misses += 1
+            entry = _encode_prefix(model, tokenizer, prefix_text)
+            if settings.LLAVA_PREFIX_CACHE:
+                self._entries[prefix_text] = entry
+        else:
+            self.hits += 1
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+
+
+prefix_cache = PrefixCache()
+
+@torch.inference_mode()
+def _encode_prefix(model, tokenizer, prefix_text: str) -> tuple[torch.Tensor, tuple]:
+    prefix_ids = tokenizer(prefix_text, return_tensors="pt").input_ids.to(model.device)
+    outputs = model.language_model(input_ids=prefix_ids, use_cache=True)
+    return prefix_ids, outputs.past_key_values
+
+def _suffix_token_ids(tokenizer, prefix_text: str, suffix_text: str) -> list[int]:
+    # 전체 프롬프트를 한 번에 토큰화한 뒤 <image> 뒤쪽만 잘라 써서, 캐시 없이 토큰화했을 때와 같은 토큰을 얻습니다.
+    full_ids = tokenizer(prefix_text + "<image>" + suffix_text).input_ids
+    image_token_id = tokenizer.convert_tokens_to_ids("<image>")
+    return full_ids[full_ids.index(image_token_id) + 1:]
+
+@stage_seconds.timed(stage="vision_encode")
+def _encode_images(model, processor, images: list[Image.Image]) -> torch.Tensor:
+    """
+    이미지를 CLIP 비전 타워와 projector에 통과시켜 언어 모델 입력 공간의 시각 토큰으로 만듭니다.
+    """
+
+    pixel_values = processor.image_processor(images, return_tensors="pt")["pixel_values"]
+    pixel_values = pixel_values.to(model.device, dtype=model.vision_tower.dtype)
+
+    image_outputs = model.vision_tower(pixel_values, output_hidden_states=True)
+    selected_image_feature = image_outputs.hidden_states[model.config.vision_feature_layer]
+    if model.config.vision_feature_select_strategy == "default":
+        selected_image_feature = selected_image_feature[:, 1:]
+    return model.multi_modal_projector(selected_image_feature)
+
+# ----- 손상별 시각 토큰 캐시 -----
+class FeatureCache:
+    """
+    defect_id별로 projector를 통과한 시각 토큰을 보관하는 바이트 한도 LRU 캐시입니다.
+    분류 때 계산한 결과를 Discord 질문(Q1/Q2, 반복 클릭)에서 그대로 재사용합니다.
+    spill_dir이 있으면 메모리에서 밀려난 항목을 디스크에 저장해 두었다가 다시 불러옵니다.
+    디스크 파일은 불러오면 지우고, 전체 크기가 spill_max_bytes를 넘으면 오래된 파일부터 지웁니다.
+    """
+
+    def __init__(self, max_bytes: int, spill_dir: Path | None = None, spill_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes
+        self._entries: OrderedDict[str, torch.Tensor] = OrderedDict()
+        self._spilled: OrderedDict[str, int] = OrderedDict() # 디스크에 저장한 key -> 파일 크기 (오래된 순)
+        self._lock = threading.Lock()
+        self._model_key = None
+        self.worker = "main" # 지표 라벨 (추론 워커 프로세스에서는 워커 번호)
+        # 파일 이름에 넣는 모델 구분값 (LLAVA_MODEL_ID만 바꿔도 다른 모델의 시각 토큰을 불러오지 않도록)
+        self._model_tag = hashlib.sha1(model_revision().encode()).hexdigest()[:12]
+        self.bytes = 0
+        self.spill_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if spill_dir is not None:
+            self._scan_spill()
+
+    def _spill_path(self, key: str) -> Path:
+        return self.spill_dir / f"{key}_{self._model_tag}.pt"
+
+    def _scan_spill(self):
+        # 재시작 전에 저장해 둔 같은 모델의 파일을 오래된 순서로 등록 (디스크 한도 계산용)
+        suffix = f"_{self._model_tag}.pt"
+        files = []
+        for path in self.spill_dir.glob(f"*{suffix}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.name[:-len(suffix)], stat.st_size))
+        for _, key, size in sorted(files):
+            self._spilled[key] = size
+            self.spill_bytes += size
+
+    def _forget_spilled(self, key: str):
+        # 잠금 안에서 호출
+        size = self._spilled.pop(key, None)
+        if size is not None:
+            self.spill_bytes -= size
+
+    def _check_model(self, model):
+        model_key = (settings.LLAVA_MODEL_ID, settings.LLAVA_MODEL_REVISION, id(model))
+        if model_key != self._model_key:
+            self._entries.clear()
+            self.bytes = 0
+            self._model_key = model_key
+
+    def has(self, key: str) -> bool:
+        # 이미지를 받기 전에 확인하는 용도 (통계에 넣지 않음)
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self.spill_dir is not None and self._spill_path(key).exists()
+
+    def get(self, model, key: str) -> torch.Tensor | None:
+        with self._lock:
+            self._check_model(model)
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                cache_lookups.inc(cache="features", result="hit")
+                feature_cache_lookups.inc(worker=self.worker, result="hit")
+                return features
+
+        if self.spill_dir is not None and self._spill_path(key).exists():
+            try:
+                features = torch.load(self._spill_path(key), map_location=model.device)
+            except Exception as e:
+                print(f"❌ 시각 토큰 캐시 로드 실패 ({key}): {e}")
+            else:
+                # 메모리로 다시 올렸으므로 파일은 지움 (다시 밀려나면 새로 저장)
+                self._spill_path(key).unlink(missing_ok=True)
+                with self._lock:
+                    self._forget_spilled(key)
+                    self.disk_hits += 1
+                cache_lookups.inc(cache="features", result="hit")
+                feature_cache_lookups.inc(worker=self.worker, result="disk_hit")
+                self.put(model, key, features)
+                return features
+
+        with self._lock:
+            self.misses += 1
+        cache_lookups.inc(cache="features", result="miss")
+        feature_cache_lookups.inc(worker=self.worker, result="miss")
+        return None
+
+    def put(self, model, key: str, features: torch.Tensor):
+        size = features.numel() * features.element_size()
+        if size > self.max_bytes:
+            return
+
+        evicted = []
+        with self._lock:
+            self._check_model(model)
+            if key in self._entries:
+                old_features = self._entries.pop(key)
+                self.bytes -= old_features.numel() * old_features.element_size()
+            self._entries[key] = features
+            self.bytes += size
+
+            while self.bytes > self.max_bytes:
+                old_key, old_features = self._entries.popitem(last=False)
+                self.bytes -= old_features.numel() * old_features.element_size()
+                evicted.append((old_key, old_features))
+
+        if self.spill_dir is not None and evicted:
+            self._spill(evicted)
+
+    def _spill(self, evicted: list[tuple[str, torch.Tensor]]):
+        for old_key, old_features in evicted:
+            path = self._spill_path(old_key)
+            try:
+                torch.save(old_features.cpu(), path)
+                size = path.stat().st_size
+            except Exception as e:
+                print(f"❌ 시각 토큰 캐시 디스크 저장 실패 ({old_key}): {e}")
+                continue
+            with self._lock:
+                self._forget_spilled(old_key)
+                self._spilled[old_key] = size
+                self.spill_bytes += size
+
+        # 디스크 한도를 넘으면 가장 오래전에 저장한 파일부터 지움
+        removed = []
+        with self._lock:
+            while self.spill_bytes > self.spill_max_bytes and self._spilled:
+                old_key, size = self._spilled.popitem(last=False)
+                self.spill_bytes -= size
+                removed.append(old_key)
+        for old_key in removed:
+            self._spill_path(old_key).unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "spill_bytes": self.spill_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+if settings.LLAVA_FEATURE_SPILL_DIR:
+    Path(settings.LLAVA_FEATURE_SPILL_DIR).mkdir(parents=True, exist_ok=True)
+
+feature_cache = FeatureCache(
+    max_bytes=settings.LLAVA_FEATURE_CACHE_MB * 1024 * 1024,
+    spill_dir=Path(settings.LLAVA_FEATURE_SPILL_DIR) if settings.LLAVA_FEATURE_SPILL_DIR else None,
+    spill_max_bytes=settings.LLAVA_FEATURE_SPILL_MB * 1024 * 1024,
+)
+
+@torch.inference_mode()
+def _image_features(model, processor, images: list, image_keys: list[str | None] | None = None) -> torch.Tensor:
+    """
+    이미지들의 시각 토큰을 (배치, 토큰 수, hidden) 텐서로 돌려줍니다.
+    image_keys(defect_id)가 있는 항목은 feature_cache를 먼저 확인하고, 없을 때만 비전 타워를 돌립니다.
+    images의 원소는 PIL 이미지 또는 이미지를 돌려주는 함수이며, 함수는 캐시에 없을 때만 호출됩니다.
+    """
+
+    image_keys = image_keys or [None] * len(images)
+    features = [feature_cache.get(model, key) if key else None for key in image_keys]
+
+    missing = [i for i, f in enumerate(features) if f is None]
+    if missing:
+        loaded = [images[i] if isinstance(images[i], Image.Image) else images[i]() for i in missing]
+        encoded = _encode_images(model, processor, loaded)
+        for j, i in enumerate(missing):
+            features[i] = encoded[j:j + 1]
+            if image_keys[i]:
+                # 슬라이스는 배치 전체 저장소를 붙잡고 있으므로 복사본을 캐시에 넣습니다.
+                feature_cache.put(model, image_keys[i], features[i].clone())
+
+    return torch.cat(features, dim=0)
+
+@stage_seconds.timed(stage="prefill")
+@torch.inference_mode()
+def _prefill(model, processor, image_features: torch.Tensor, prefix_text: str, suffix_text: str, extra_ids: list[int] | None = None):
+    """
+    캐시된 프롬프트 앞부분에 이어서 [이미지 토큰 + 가변 프롬프트 (+ extra_ids)]만 forward 합니다.
+    모든 이미지가 같은 프롬프트를 쓰므로 배치 안에 패딩이 없습니다.
+
+    Returns: (마지막 위치 logits, past_key_values, 지금까지의 시퀀스 길이)
+    """
+
+    tokenizer = processor.tokenizer
+    prefix_ids, prefix_past = prefix_cache.get(model, tokenizer, prefix_text)
+    batch = image_features.shape[0]
+
+    suffix_ids = torch.tensor([_suffix_token_ids(tokenizer, prefix_text, suffix_text) + (extra_ids or [])], device=image_features.device)
+    suffix_embeds = model.get_input_embeddings()(suffix_ids).expand(batch, -1, -1)
+    inputs_embeds = torch.cat([image_features, suffix_embeds.to(image_features.dtype)], dim=1)
+
+    past_length = prefix_ids.shape[1]
+    length = past_length + inputs_embeds.shape[1]
+    past_key_values = tuple((k.expand(batch, -1, -1, -1), v.expand(batch, -1, -1, -1)) for k, v in prefix_past)
+
+    outputs = model.language_model(
+        inputs_embeds=inputs_embeds,
+        attention_mask=torch.ones(batch, length, dtype=torch.long, device=inputs_embeds.device),
+        position_ids=torch.arange(past_length, length, device=inputs_embeds.device).expand(batch, -1),
+        past_key_values=past_key_values,
+        use_cache=True,
     )
+    return outputs.logits[:, -1, :], outputs.past_key_values, length
 
-    generate_ids = model.generate(**inputs, max_new_tokens=2000) # max_new_tokens로 답변 길이 조절
-    english_result_full = processor.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)[0]
+@torch.inference_mode()
+def _decode_tokens(model, logits: torch.Tensor, past_key_values, length: int, max_new_tokens: int, eos_token_id: int):
+    """
+    _prefill 결과에서 이어서 greedy 디코딩하며, 스텝마다 배치 크기만큼의 다음 토큰을 yield 합니다.
+    이미 EOS가 나온 행은 EOS를 반복합니다.
+    """
 
-    # 결과 출력(프롬프트를 제외한 순수 답변 부분만 추출)
-    english_result = english_result_full.split("ASSISTANT:")[-1].strip()
+    batch = logits.shape[0]
+    finished = torch.zeros(batch, dtype=torch.bool, device=logits.device)
 
-    if question:
-        korean_result = GoogleTranslator(source='en', target='ko').translate(english_result)
-        formatted_korean = re.sub(r'(?<=[가-힣\w][다요함임]\.)+', '\n', korean_result).strip()
-        print("--- LLaVA 답변(eng) ---")
-        print(english_result)
-        print("--- LLaVA 답변(kor) ---")
-        print(formatted_korean)
-        return formatted_korean
-    else:
-        m_type = re.search(r"Defect Type:\s*(.+)", english_result)
-        m_urg = re.search(r"Urgency for Inspection:\s*(.+)", english_result)
+    for _ in range(max_new_tokens):
+        next_tokens = logits.argmax(-1).masked_fill(finished, eos_token_id)
+        yield next_tokens
+
+        finished |= next_tokens == eos_token_id
+        if finished.all():
+            break
+
+        outputs = model.language_model(
+            input_ids=next_tokens[:, None],
+            attention_mask=torch.ones(batch, length + 1, dtype=torch.long, device=logits.device),
+            position_ids=torch.full((batch, 1), length, device=logits.device),
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        logits, past_key_values = outputs.logits[:, -1, :], outputs.past_key_values
+        length += 1
+
+def _generate_texts(images: list, prefix_text: str, suffix_text: str, image_keys: list[str | None] | None = None, max_new_tokens: int = 2000) -> list[str]:
+    model, processor, _ = load_llava_model()
+    tokenizer = processor.tokenizer
+
+    image_features = _image_features(model, processor, images, image_keys)
+    logits, past_key_values, length = _prefill(model, processor, image_features, prefix_text, suffix_text)
+    started = time.perf_counter()
+    steps = list(_decode_tokens(model, logits, past_key_values, length, max_new_tokens, tokenizer.eos_token_id))
+    if not steps:
+        return [""] * len(images)
+
+    generate_ids = torch.stack(steps, dim=1)
+    _record_generation(int((generate_ids != tokenizer.eos_token_id).sum()), time.perf_counter() - started)
+    return [text.strip() for text in tokenizer.batch_decode(generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)]
+
+def _record_generation(tokens: int, elapsed: float):
+    stage_seconds.observe(elapsed, stage="generate")
+    generated_tokens.inc(tokens)
+    if tokens and elapsed > 0:
+        generation_tokens_per_second.observe(tokens / elapsed)
+
+@stage_seconds.timed(stage="parse")
+def _parse_classification(english_result: str) -> Classification:
+    """
+    분류용 답변에서 손상 유형과 위험도를 추출해 한국어로 변환합니다.
+    """
+
+    m_type = re.search(r"Defect Type:\s*(.+)", english_result)
+    m_urg = re.search(r"Urgency for Inspection:\s*(.+)", english_result)
+
+    defect_type = _as_str(m_type)
+    urgency = _as_str(m_urg)
+
+    defect_type_kr = defect_type_choice.get(defect_type, "분류 안됨")
+
+    urgency_kr = urgency_choice.get(urgency, "분류 안됨")
 
-        defect_type = _as_str(m_type)
-        urgency = _as_str(m_urg)
+    print("--- LLaVA 답변(eng) ---")
+    print(f"Defect type: {defect_type}, Urgency: {urgency}")
+    print("--- LLaVA 답변(kor) ---")
+    print(f"손상 유형: {defect_type_kr}, 위험도: {urgency_kr}")
+    return Classification(defect_type_kr, urgency_kr)
 
-        defect_type_kr = defect_type_choice.get(defect_type, "분류 안됨")
+def run_llava(image_path: str, defect_id: str | None = None) -> Classification:
+    """
+    이미지 1장의 손상 유형/위험도를 분류합니다. (질문 답변은 stream_llava)
+    """
+
+    return run_llava_batch_images([load_image(image_path, None)], [defect_id])[0]
+
+@stage_seconds.timed(stage="translate")
+def translate_to_korean(english_text: str) -> str:
+    korean_result = GoogleTranslator(source='en', target='ko').translate(english_text)
+    return re.sub(r'(?<=[가-힣\w][다요함임]\.)+', '\n', korean_result).strip()
+
+
+# ----- 답변 스트리밍 -----
+def stream_llava(image_path: str, question: str, defect_id: str|None, defect_type: str|None, urgency: str|None, max_new_tokens: int = 2000):
+    """
+    Discord 버튼 질문의 답변을 생성되는 대로 영문 텍스트 조각(str) 단위로 yield 합니다.
+    토큰을 누적 디코딩해 새로 늘어난 부분만 내보내므로, 여러 토큰에 걸친 글자도 깨지지 않습니다.
+    """
+
+    model, processor, _ = load_llava_model()
+    tokenizer = processor.tokenizer
+
+    prefix_text, suffix_text = _build_prompt_parts(question, defect_type, urgency)
+    image_features = _image_features(model, processor, [lambda: load_image(image_path, question)], [defect_id])
+    print(f"ℹ️ 시각 토큰 캐시: {feature_cache.stats()}")
+    logits, past_key_values, length = _prefill(model, processor, image_features, prefix_text, suffix_text)
+
+    token_ids, emitted = [], 0
+    started = time.perf_counter()
+    try:
+        for next_tokens in _decode_tokens(model, logits, past_key_values, length, max_new_tokens, tokenizer.eos_token_id):
+            token_id = next_tokens[0].item()
+            if token_id == tokenizer.eos_token_id:
+                break
+
+            token_ids.append(token_id)
+            text = tokenizer.decode(token_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False)
+            if text.endswith("\ufffd"): # 아직 완성되지 않은 멀티바이트 글자
+                continue
+            if len(text) > emitted:
+                yield text[emitted:]
+                emitted = len(text)
+    finally:
+        _record_generation(len(token_ids), time.perf_counter() - started)
+
+
+# ----- 분류 요청 배치 처리 -----
+def _candidate_token_ids(tokenizer) -> tuple[list[int], list[list[int]]]:
+    """
+    후보 답변들을 토큰화해 모든 후보가 공유하는 앞부분("1. Defect Type:")과 후보별 나머지 토큰으로 나눕니다.
+    """
+
+    candidate_ids = [
+        tokenizer(f"1. Defect Type: {t}\n2. Urgency for Inspection: {u}", add_special_tokens=False).input_ids
+        for t, u in classify_candidates
+    ]
+
+    shared = 0
+    while all(len(ids) > shared + 1 and ids[shared] == candidate_ids[0][shared] for ids in candidate_ids):
+        shared += 1
+
+    return candidate_ids[0][:shared], [ids[shared:] for ids in candidate_ids]
+
+@stage_seconds.timed(stage="parse")
+def _to_classification(probs: list[float]) -> Classification:
+    type_probs, urgency_probs = {}, {}
+    for (t, u), p in zip(classify_candidates, probs):
+        type_probs[t] = type_probs.get(t, 0.0) + p
+        urgency_probs[u] = urgency_probs.get(u, 0.0) + p
+
+    best_type, best_urgency = classify_candidates[max(range(len(probs)), key=probs.__getitem__)]
+    defect_type_kr = defect_type_choice.get(best_type, "분류 안됨") # "None" 후보 (손상 없음)
+    urgency_kr = urgency_choice.get(best_urgency, "분류 안됨")
+
+    print("--- LLaVA 분류 점수 ---")
+    print("Defect type: " + ", ".join(f"{t} {p:.2f}" for t, p in type_probs.items()))
+    print("Urgency: " + ", ".join(f"{u} {p:.2f}" for u, p in urgency_probs.items()))
+    print(f"손상 유형: {defect_type_kr}, 위험도: {urgency_kr}")
+
+    return Classification(defect_type_kr, urgency_kr, {"defect_type": type_probs, "urgency": urgency_probs})
+
+@torch.inference_mode()
+def score_llava_batch(images: list[Image.Image], image_keys: list[str | None] | None = None) -> list[Classification]:
+    """
+    자유 생성 대신 고정된 후보 답변(손상 유형 x 위험도)의 로그 확률을 비교해 분류합니다.
+    프롬프트는 한 번만 forward 하고, 그 KV 캐시를 후보 수만큼 복제해 후보 토큰만 추가로 계산합니다.
+    """
+
+    model, processor, _ = load_llava_model()
+    tokenizer = processor.tokenizer
+
+    shared_ids, rest_ids = _candidate_token_ids(tokenizer)
+    n_images, n_candidates = len(images), len(rest_ids)
+
+    # 1) (캐시된 프롬프트 앞부분 +) 이미지 + 공통 답변 앞부분 forward
+    prefix_text, suffix_text = _build_prompt_parts(None, None, None)
+    image_features = _image_features(model, processor, images, image_keys)
+    last_logits, past_key_values, past_length = _prefill(model, processor, image_features, prefix_text, suffix_text, shared_ids)
+    first_logprobs = last_logits.float().log_softmax(-1)                     # (이미지, vocab)
+
+    # 2) 후보별 나머지 토큰 forward (이미지 x 후보 배치, 오른쪽 패딩)
+    started = time.perf_counter()
+    device = last_logits.device
+    max_len = max(len(ids) for ids in rest_ids)
+    cand_ids = torch.full((n_candidates, max_len), tokenizer.pad_token_id or 0, dtype=torch.long, device=device)
+    cand_mask = torch.zeros((n_candidates, max_len), dtype=torch.long, device=device)
+    for k, ids in enumerate(rest_ids):
+        cand_ids[k, :len(ids)] = torch.tensor(ids, device=device)
+        cand_mask[k, :len(ids)] = 1
+
+    expanded_past = tuple(
+        (k.repeat_interleave(n_candidates, dim=0), v.repeat_interleave(n_candidates, dim=0))
+        for k, v in past_key_values
+    )
+    full_mask = torch.cat(
+        [torch.ones(n_images * n_candidates, past_length, dtype=torch.long, device=device), cand_mask.repeat(n_images, 1)],
+        dim=1,
+    )
+    position_ids = (past_length + torch.arange(max_len, device=device)).expand(n_images * n_candidates, -1)
+
+    cand_logprobs = model.language_model(
+        input_ids=cand_ids.repeat(n_images, 1),
+        attention_mask=full_mask,
+        position_ids=position_ids,
+        past_key_values=expanded_past,
+    ).logits.float().log_softmax(-1)                                            # (이미지*후보, 길이, vocab)
+
+    stage_seconds.observe(time.perf_counter() - started, stage="score")
+
+    # 3) 후보별 로그 확률 합산 -> softmax
+    results = []
+    for b in range(n_images):
+        scores = []
+        for k, ids in enumerate(rest_ids):
+            row = b * n_candidates + k
+            score = first_logprobs[b, ids[0]]
+            if len(ids) > 1:
+                targets = torch.tensor(ids[1:], device=device)
+                score = score + cand_logprobs[row, torch.arange(len(ids) - 1, device=device), targets].sum()
+            scores.append(score)
+
+        probs = torch.stack(scores).softmax(-1).tolist()
+        results.append(_to_classification(probs))
+
+    return results
+
+def _generate_llava_batch(images: list[Image.Image], image_keys: list[str | None] | None = None) -> list[Classification]:
+    prefix_text, suffix_text = _build_prompt_parts(None, None, None)
+    return [_parse_classification(text) for text in _generate_texts(images, prefix_text, suffix_text, image_keys)]
+
+def run_llava_batch(image_paths: list[str | bytes | Image.Image], defect_ids: list[str | None] | None = None) -> list[Classification | Exception]:
+    """
+    여러 이미지의 손상 유형/위험도를 한 번의 배치 추론으로 분류합니다.
+    image_paths의 원소는 이미지 경로/URL, image_store에서 받아 둔 bytes/PIL 이미지 또는 이미지를 받아 오는 함수입니다.
+    함수는 해당 defect_id의 시각 토큰이 캐시에 없을 때만 호출합니다.
+    LLAVA_CLASSIFY_MODE="score"이면 후보 답변 점수 비교, "generate"이면 자유 생성 후 파싱합니다.
+    이미지 로드에 실패한 항목은 해당 위치에 예외 객체를 담아 반환합니다.
+    """
+
+    defect_ids = defect_ids or [None] * len(image_paths)
+    results: list[Classification | Exception | None] = [None] * len(image_paths)
+    images, indices = [], []
+    for i, image_path in enumerate(image_paths):
+        if callable(image_path) and defect_ids[i] and feature_cache.has(defect_ids[i]):
+            images.append(lambda image_path=image_path: load_image(image_path, None))
+            indices.append(i)
+            continue
+        try:
+            images.append(load_image(image_path, None))
+            indices.append(i)
+        except Exception as e:
+            results[i] = e
+
+    if not images:
+        return results
+
+    classifications = run_llava_batch_images(images, [defect_ids[i] for i in indices])
+    print(f"ℹ️ 시각 토큰 캐시: {feature_cache.stats()}")
+    for i, classification in zip(indices, classifications):
+        results[i] = classification
+
+    return results
+
+def run_llava_batch_images(images: list[Image.Image], image_keys: list[str | None] | None = None) -> list[Classification]:
+    if settings.LLAVA_CLASSIFY_MODE == "score":
+        return score_llava_batch(images, image_keys)
+    return _generate_llava_batch(images, image_keys)
+
+
+class LlavaBatchScheduler:
+    """
+    /defect-info 분류 요청을 짧은 시간(max_wait_ms) 동안 모아 최대 max_batch_size장씩 배치 추론합니다.
+    각 요청은 자신의 Classification(손상 유형, 위험도) 결과를 future로 돌려받습니다.
+    runner는 (이미지 경로 목록, defect_id 목록)을 받아 배치 결과를 돌려주는 코루틴 함수입니다. (기본: 스레드에서 run_llava_batch)
+    """
 
-        urgency_kr = urgency_choice.get(urgency, "분류 안됨")
+    def __init__(self, max_batch_size: int, max_wait_ms: int, runner=None):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000
+        self._runner = runner or (lambda image_paths, defect_ids: asyncio.to_thread(run_llava_batch, image_paths, defect_ids))
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+        # 처리량 통계
+        self.batches = 0
+        self.images = 0
+        self.busy_seconds = 0.0
+
+    async def submit(self, image_path: str, defect_id: str | None = None) -> Classification:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_path, defect_id, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._run_batch(batch)
+
+    async def _run_batch(self, batch):
+        image_paths = [image_path for image_path, _, _ in batch]
+        defect_ids = [defect_id for _, defect_id, _ in batch]
+        started = time.perf_counter()
+
+        try:
+            results = await self._runner(image_paths, defect_ids)
+        except Exception as e:
+            print(f"❌ LLaVA 배치 분류 실패 ({len(batch)}장): {e}")
+            results = [e] * len(batch)
+
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage="classify_batch")
+        self.batches += 1
+        self.images += len(batch)
+        self.busy_seconds += elapsed
+        print(f"✅ LLaVA 배치 분류 완료: {len(batch)}장 / {elapsed:.2f}s ({len(batch) / elapsed:.2f} img/s)")
+
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "images": self.images,
+            "avg_batch_size": self.images / self.batches if self.batches else 0.0,
+            "images_per_sec": self.images / self.busy_seconds if self.busy_seconds else 0.0,
+        }
 
-        print("--- LLaVA 답변(eng) ---")
-        print(f"Defect type: {defect_type}, Urgency: {urgency}")
-        print("--- LLaVA 답변(kor) ---")
-        print(f"손상 유형: {defect_type_kr}, 위험도: {urgency_kr}")
-        return defect_type_kr, urgency_kr
\ No newline at end of file
@@ -1,18 +1,42 @@
 from PIL import Image
 import uvicorn
-from fastapi import FastAPI, HTTPException, Body, File, UploadFile, Form
+from fastapi import FastAPI, HTTPException, Body, File, UploadFile, Form, Header, Query, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from fastapi import Request as FastAPIRequest # record.py의 google Request와 이름이 겹치지 않도록
 from fastapi.staticfiles import StaticFiles
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 import uuid
+import json
+import time
+import base64
+import binascii
+from typing import List, Optional
 import aiosqlite
 from contextlib import asynccontextmanager
 import shutil
 
 from config import settings
-from models import DefectCreate, DefectOut, DefectPatch
-from database import init_db, create_defect_in_db, db_row_to_model
-from llava import load_llava_model, run_llava
+from pydantic import ValidationError
+from models import (
+    AnalysisJobOut, DefectBatchItemOut, DefectBatchOut, DefectCreate, DefectEventType, DefectOut, DefectPage,
+    DefectPatch, DefectType, NearbyDefectOut, Repair_status, Urgency,
+)
+from database import (
+    DEFECT_COLUMNS, init_db, attach_detections, create_defect_with_job, create_defects_with_jobs, db_row_to_model,
+    find_cluster_defects, find_similar_analysis, get_defect_by_id, get_defects_missing_address, get_idempotency_keys,
+    get_job_by_defect_id, get_nearby_defects, query_defects, save_image_hash,
+)
+from analysis_queue import analysis_queue
+import db_pool
+from derivatives import schedule_derivatives
+from events import event_hub
+from llava import dhash, feature_cache, load_llava_model
+from image_store import image_store
+import inference_worker
+import metrics
+from inference_worker import classify_scheduler, start_inference_pool, stop_inference_pool
+from metrics import cache_lookups, feature_cache_bytes, http_request_seconds, queue_depth, stage_seconds
 from airobot import *
 import asyncio
 from map import *
@@ -28,20 +52,40 @@ load_dotenv()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("----- 데이터베이스 초기화 중 -----")
+    await db_pool.open_pool()
     await init_db()
     await delete_old_defects(days=30)
     print(f"✅ 데이터베이스 준비 완료: {settings.DB_PATH.resolve()}")
 
-    # LLaVA 모델 로드
-    await asyncio.to_thread(load_llava_model)
+    # LLaVA 모델 로드 (워커 프로세스를 쓰면 각 워커가 모델을 따로 로드)
+    if settings.LLAVA_WORKERS > 0:
+        await start_inference_pool()
+    else:
+        await asyncio.to_thread(load_llava_model)
     
+    # 분석 작업 큐 시작 (재시작 전에 끝나지 않은 작업도 다시 처리)
+    await analysis_queue.start(run_analysis_and_notify)
+
+    # 재시작 전에 주소를 채우지 못한 손상은 다시 주소 변환
+    if settings.GEOCODE_DEFERRED:
+        missing = await get_defects_missing_address()
+        for defect_id, latitude, longitude in missing:
+            _schedule_address_backfill(defect_id, latitude, longitude)
+        if missing:
+            print(f"ℹ️ 주소가 비어 있는 손상 {len(missing)}건의 주소 변환을 다시 등록했습니다.")
+
     # Discord 봇 백그라운드 실행
     asyncio.create_task(client.start(discord_key))
 
     yield
 
     print("----- 애플리케이션 종료 -----")
+    await analysis_queue.stop()
     await client.close()
+    await stop_inference_pool()
+    await image_store.close()
+    await close_geocoder()
+    await db_pool.close_pool()
 
 
 # ----- FastAPI 앱 -----
@@ -61,6 +105,41 @@ app = FastAPI(
 )
 
 
+# ----- 지표 수집 -----
+@app.middleware("http")
+async def record_request_metrics(request: FastAPIRequest, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    http_request_seconds.observe(
+        time.perf_counter() - started,
+        method=request.method, route=getattr(route, "path", "unmatched"), status=response.status_code
+    )
+    return response
+
+def _queue_depths() -> dict:
+    depths = {("analysis",): analysis_queue.queue_depth(), ("classify_batch",): classify_scheduler.queue_depth()}
+    if inference_worker.pool is not None:
+        depths[("inference",)] = inference_worker.pool.queue_depth()
+    return depths
+
+queue_depth.set_function(_queue_depths)
+
+def _feature_cache_bytes() -> dict:
+    # 워커 풀이 있으면 워커별 캐시, 없으면 현재 프로세스의 캐시
+    if inference_worker.pool is not None:
+        sizes = inference_worker.pool.feature_cache_bytes()
+    else:
+        sizes = {feature_cache.worker: (feature_cache.bytes, feature_cache.spill_bytes)}
+    return {
+        (str(worker), tier): size
+        for worker, (memory, disk) in sizes.items()
+        for tier, size in (("memory", memory), ("disk", disk))
+    }
+
+feature_cache_bytes.set_function(_feature_cache_bytes)
+
+
 # ----- 정적 파일 마운트 (개발용) -----
 app.mount(
     settings.STATIC_MOUNT_PATH,
@@ -70,17 +149,83 @@ app.mount(
 
 
 # ----- API 엔드포인트 -----
+# Idempotency-Key별 처리 중인 /defect-info 요청 -> (상태 코드, 응답)을 받을 Future
+_inflight_requests: dict[str, asyncio.Future] = {}
+
 # [드론용] 새로운 손상 정보 생성 API
 @app.post(
     "/defect-info",
-    response_model=DefectOut,
-    status_code=201, # 201 Created
+    status_code=202, # 202 Accepted
+    responses={
+        200: {"model": AnalysisJobOut, "description": "이미 등록된 손상의 재탐지로 묶임 (다시 분석하지 않음)"},
+        201: {"model": DefectOut, "description": "DEFECT_INFO_ASYNC=false일 때 분석까지 끝난 손상 정보"},
+        202: {"model": AnalysisJobOut, "description": "분석 작업 등록 완료"},
+        429: {"description": "분석 대기열이 가득 참 (Retry-After초 뒤 다시 전송)"},
+    },
     summary="[드론용] 새로운 손상 정보 생성",
-    description="드론에서 촬영한 이미지와 시간 정보를 받아 새 손상 데이터를 생성합니다."
+    description=(
+        "드론에서 촬영한 이미지와 시간 정보를 받아 새 손상 데이터를 생성합니다.\n\n"
+        "손상 정보를 저장하고 LLaVA 분석 작업을 등록한 뒤 바로 202와 작업 ID를 반환합니다. "
+        "분석 진행 상황은 `GET /defect-info/{id}`로 확인할 수 있습니다.\n\n"
+        "근처(`CLUSTER_RADIUS_M`)에 최근 탐지된 미완료 손상이 있으면 새로 만들지 않고 그 손상에 탐지 기록만 추가한 뒤 "
+        "200과 기존 손상 정보(`attached: true`)를 반환합니다.\n\n"
+        "`Idempotency-Key` 헤더(또는 본문의 `detection_id`)를 붙이면 응답을 받지 못해 다시 보낸 요청을 한 번만 처리합니다. "
+        "`IDEMPOTENCY_TTL_HOURS` 안에 같은 키로 다시 오면 주소 변환/분석/알림 없이 처음 만든 손상과 작업을 돌려주고, "
+        "처음 요청이 아직 처리 중이면 그 결과를 기다렸다가 같은 응답을 돌려줍니다."
+    )
 )
 
-async def create_defect_info(defect: DefectCreate = Body(...)):
+async def create_defect_info(
+    request: FastAPIRequest,
+    response: Response,
+    defect: DefectCreate = Body(...),
+    x_drone_id: Optional[str] = Header(None, description="드론 ID (드론별 분석 대기열 할당량 기준, 없으면 클라이언트 IP)"),
+    idempotency_key: Optional[str] = Header(None, max_length=128, description="재전송 중복 방지 키 (없으면 본문의 detection_id 사용)"),
+):
+    key = idempotency_key or defect.detection_id
+    if not key:
+        return await _create_defect_info(request, response, defect, x_drone_id, None)
+
+    # 같은 키로 처리 중인 요청이 있으면 새로 처리하지 않고 그 결과를 같이 받음
+    inflight = _inflight_requests.get(key)
+    if inflight is not None:
+        print(f"ℹ️ 처리 중인 요청의 재전송입니다. 처음 요청의 결과를 기다립니다. (키: {key})")
+        try:
+            status_code, result = await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise
+            raise HTTPException(status_code=409, detail="같은 키로 처리 중이던 요청이 중단되었습니다. 다시 보내 주세요.")
+        response.status_code = status_code
+        return result
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_requests[key] = future
+    try:
+        # 이미 처리한 키면 처음 만든 손상/작업을 돌려줌
+        result = await _replay_idempotent(response, key)
+        if result is None:
+            result = await _create_defect_info(request, response, defect, x_drone_id, key)
+        future.set_result((response.status_code or 202, result))
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # 기다리는 재전송이 없어도 경고가 남지 않도록
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _inflight_requests.pop(key, None)
+
+async def _create_defect_info(
+    request: FastAPIRequest,
+    response: Response,
+    defect: DefectCreate,
+    x_drone_id: Optional[str],
+    idempotency_key: Optional[str],
+):
     new_id = str(uuid.uuid4())
+    job_id = str(uuid.uuid4())
     
     # 시간 설정
     if defect.detect_time:
@@ -89,8 +234,22 @@ async def create_defect_info(defect: DefectCreate = Body(...)):
         KST = timezone(timedelta(hours=9))
         detect_time = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
 
-    # 주소 설정
-    address = get_address_from_coords(defect.latitude, defect.longitude)
+    # 같은 손상을 다시 탐지한 경우: 탐지 기록만 남기고 분석/알림은 건너뜀
+    with stage_seconds.time(stage="cluster_lookup"):
+        [cluster_id] = await find_cluster_defects([(defect.latitude, defect.longitude, detect_time)])
+    if cluster_id is not None:
+        return await _attach_to_cluster(response, cluster_id, defect, detect_time, idempotency_key)
+
+    # 분석 대기열에 자리가 없으면 저장하지 않고 돌려보냄
+    source = _source_of(request, x_drone_id)
+    if not analysis_queue.admission.admit(source):
+        raise _too_many_requests()
+
+    # 주소 설정 (GEOCODE_DEFERRED면 메모리 캐시에 없을 때 기다리지 않고 저장 후 백그라운드에서 채움)
+    address = peek_address(defect.latitude, defect.longitude)
+    if address is None and not settings.GEOCODE_DEFERRED:
+        with stage_seconds.time(stage="geocode"):
+            address = await get_address_from_coords(defect.latitude, defect.longitude)
 
     new_defect_data = DefectOut(
         id=new_id,
@@ -101,48 +260,501 @@ async def create_defect_info(defect: DefectCreate = Body(...)):
         address=address
     )
 
-    saved_defect = await create_defect_in_db(new_defect_data)
+    with stage_seconds.time(stage="db_create"):
+        saved_defect = await create_defect_with_job(new_defect_data, job_id, idempotency_key)
     if not saved_defect:
+        analysis_queue.admission.cancel(source, 1)
+        # 다른 프로세스가 같은 키를 먼저 저장한 경우
+        if idempotency_key and (replayed := await _replay_idempotent(response, idempotency_key)) is not None:
+            return replayed
         raise HTTPException(status_code=500, detail="❌ DB 생성 실패")
-    
-    final_defect = await run_analysis_and_notify(saved_defect)
-    if final_defect is None:
-        raise HTTPException(status_code=500, detail="❌ DB 업데이트 실패")
-    
-    return final_defect
+    if address is None and settings.GEOCODE_DEFERRED:
+        _schedule_address_backfill(new_id, defect.latitude, defect.longitude)
+
+    # 동기 모드: 기존처럼 분석과 알림까지 끝난 결과를 반환
+    if not settings.DEFECT_INFO_ASYNC:
+        try:
+            final_defect = await analysis_queue.run(job_id, new_id, source)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"❌ 분석 실패: {e}")
+        response.status_code = 201
+        return final_defect
+
+    analysis_queue.enqueue(job_id, new_id, source)
+    return AnalysisJobOut(id=new_id, job_id=job_id, status="pending", defect=saved_defect)
+
+# 주소를 채우는 중인 손상 ID -> 작업 (알림 전에 기다림)
+_address_tasks: dict[str, asyncio.Task] = {}
+
+def _schedule_address_backfill(defect_id: str, latitude: float, longitude: float):
+    async def backfill():
+        try:
+            with stage_seconds.time(stage="geocode"):
+                address = await get_address_from_coords(latitude, longitude)
+            if address is not None and await patch_defect_in_db(defect_id, DefectPatch(address=address)) is None:
+                print(f"❌ 주소 저장 실패 (ID: {defect_id})")
+        except Exception as e:
+            print(f"❌ 주소 변환 실패 (ID: {defect_id}): {e}")
+        finally:
+            _address_tasks.pop(defect_id, None)
+
+    _address_tasks[defect_id] = asyncio.create_task(backfill())
+
+def _source_of(request: FastAPIRequest, drone_id: Optional[str]) -> str:
+    return drone_id or (request.client.host if request.client else "unknown")
+
+def _too_many_requests(count: int = 1) -> HTTPException:
+    retry_after = analysis_queue.admission.retry_after(count)
+    return HTTPException(
+        status_code=429,
+        detail=f"분석 대기열이 가득 찼습니다. {retry_after}초 뒤에 다시 보내 주세요.",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+async def _attach_to_cluster(
+    response: Response, defect_id: str, defect: DefectCreate, detect_time: str, idempotency_key: Optional[str]
+):
+    if not await attach_detections([(str(uuid.uuid4()), defect_id, defect, detect_time)], [idempotency_key]):
+        if idempotency_key and (replayed := await _replay_idempotent(response, idempotency_key)) is not None:
+            return replayed
+        raise HTTPException(status_code=500, detail="❌ DB 생성 실패")
+
+    print(f"ℹ️ 재탐지를 기존 손상에 묶었습니다. (ID: {defect_id})")
+    return await _defect_response(response, defect_id, attached=True)
+
+async def _replay_idempotent(response: Response, key: str):
+    known = (await get_idempotency_keys([key])).get(key)
+    if known is None:
+        return None
+
+    defect_id, attached = known
+    print(f"ℹ️ 이미 처리한 요청의 재전송입니다. 처음 만든 손상을 돌려줍니다. (키: {key}, ID: {defect_id})")
+    return await _defect_response(response, defect_id, attached)
+
+async def _defect_response(response: Response, defect_id: str, attached: bool):
+    """
+    이미 저장된 손상을 /defect-info 응답 형태로 돌려줍니다. (재탐지 묶기, 재전송)
+    분석 상태는 지금 상태를 담습니다.
+    """
+
+    existing = await get_defect_by_id(defect_id)
+    if not settings.DEFECT_INFO_ASYNC:
+        response.status_code = 200 if attached else 201
+        return existing
+
+    response.status_code = 200 if attached else 202
+    job = await get_job_by_defect_id(defect_id) or AnalysisJobOut(id=defect_id, job_id="", status="done")
+    job.attached = attached
+    job.defect = existing
+    return job
+
+# [드론용] 손상 정보 일괄 생성 API
+@app.post(
+    "/defect-info/batch",
+    response_model=DefectBatchOut,
+    status_code=202, # 202 Accepted
+    summary="[드론용] 손상 정보 일괄 생성",
+    description=(
+        "비행 1회분의 손상 정보를 한 번에 등록합니다. `DefectCreate`의 JSON 배열 또는 "
+        "한 줄에 하나씩 적은 NDJSON(`Content-Type: application/x-ndjson`)을 받습니다.\n\n"
+        "모든 항목을 한 트랜잭션으로 저장하고, 가까운 좌표끼리는 주소 변환을 한 번만 합니다. "
+        "항목별 ID와 상태(pending / attached / duplicate / throttled / invalid)를 반환하며 분석 진행 상황은 `GET /defect-info/{id}`로 확인합니다. "
+        "이미 등록된 손상이나 같은 요청 안의 앞선 항목 근처에서 다시 탐지된 항목은 `attached`로 그 손상에 묶입니다. "
+        "`detection_id`가 이미 처리한 항목과 같으면 다시 저장하지 않고 `duplicate`와 처음 만든 손상 ID를 돌려줍니다.\n\n"
+        "분석 대기열에 자리가 모자라면 앞에서부터 받을 수 있는 만큼만 저장하고 나머지는 `throttled`로 돌려주며 "
+        "`Retry-After` 헤더를 붙입니다. 하나도 받지 못하면 429를 반환합니다."
+    ),
+    openapi_extra={"requestBody": {"content": {
+        "application/json": {"schema": {"type": "array", "items": DefectCreate.model_json_schema()}},
+        "application/x-ndjson": {"schema": {"type": "string"}},
+    }}}
+)
+async def create_defect_info_batch(
+    request: FastAPIRequest,
+    response: Response,
+    x_drone_id: Optional[str] = Header(None, description="드론 ID (드론별 분석 대기열 할당량 기준, 없으면 클라이언트 IP)"),
+):
+    raw_items = await _read_batch_body(request)
+
+    items: list[DefectBatchItemOut] = []
+    valid: list[tuple[int, DefectCreate]] = []
+    for index, raw in enumerate(raw_items):
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            valid.append((index, DefectCreate.model_validate(raw)))
+        except (ValueError, ValidationError) as e:
+            items.append(DefectBatchItemOut(index=index, status="invalid", error=str(e)))
+
+    # 이미 처리한 detection_id(재전송)는 다시 저장하지 않고 처음 만든 손상 ID를 돌려줌
+    known = await get_idempotency_keys([d.detection_id for _, d in valid if d.detection_id])
+    fresh, repeats, seen = [], [], set()
+    for index, d in valid:
+        key = d.detection_id
+        if key in known:
+            items.append(DefectBatchItemOut(index=index, status="duplicate", id=known[key][0]))
+        elif key in seen or key in _inflight_requests:
+            repeats.append((index, key))
+        else:
+            if key:
+                seen.add(key)
+            fresh.append((index, d))
+    valid = fresh
+
+    KST = timezone(timedelta(hours=9))
+    now = datetime.now(KST).strftime("%Y-%m-%d %H:%M:%S")
+
+    # 재탐지 묶기: DB의 기존 손상을 먼저 찾고, 없으면 이 요청에서 새로 만들 손상과 비교
+    with stage_seconds.time(stage="cluster_lookup"):
+        clusters = await find_cluster_defects([(d.latitude, d.longitude, d.detect_time or now) for _, d in valid])
+    new_items: list[tuple[int, DefectCreate, str]] = []
+    attached: list[tuple[int, str, DefectCreate]] = []
+    for (index, d), cluster_id in zip(valid, clusters):
+        if cluster_id is None and settings.CLUSTER_RADIUS_M > 0:
+            cluster_id = next((
+                new_id for _, other, new_id in new_items
+                if distance_m(d.latitude, d.longitude, other.latitude, other.longitude) <= settings.CLUSTER_RADIUS_M
+            ), None)
+        if cluster_id is None:
+            new_items.append((index, d, str(uuid.uuid4())))
+        else:
+            attached.append((index, cluster_id, d))
+
+    # 분석 대기열에 자리가 있는 만큼만 저장 (나머지는 다시 보내도록 throttled로 돌려줌)
+    source = _source_of(request, x_drone_id)
+    admitted = analysis_queue.admission.admit(source, len(new_items)) if new_items else 0
+    throttled, new_items = new_items[admitted:], new_items[:admitted]
+    if throttled:
+        if not new_items and not attached and not known:
+            raise _too_many_requests(len(throttled))
+        response.headers["Retry-After"] = str(analysis_queue.admission.retry_after(len(throttled)))
+        for index, _, _ in throttled:
+            items.append(DefectBatchItemOut(index=index, status="throttled", error="분석 대기열이 가득 찼습니다."))
+
+    # 가까운 좌표(같은 격자 칸)는 주소 변환을 한 번만 호출 (GEOCODE_DEFERRED면 저장 후 백그라운드에서 채움)
+    cells = {
+        _geocode_cell(d.latitude, d.longitude): d for _, d, _ in new_items
+        if not d.address and peek_address(d.latitude, d.longitude) is None
+    }
+    addresses = {}
+    if cells and not settings.GEOCODE_DEFERRED:
+        with stage_seconds.time(stage="geocode"):
+            addresses = dict(zip(cells, await asyncio.gather(*(
+                get_address_from_coords(d.latitude, d.longitude) for d in cells.values()
+            ))))
+
+    defects, job_ids = [], []
+    for index, d, new_id in new_items:
+        defects.append(DefectOut(
+            id=new_id,
+            latitude=d.latitude,
+            longitude=d.longitude,
+            image=d.image,
+            detect_time=d.detect_time or now,
+            address=d.address or peek_address(d.latitude, d.longitude) or addresses.get(_geocode_cell(d.latitude, d.longitude))
+        ))
+        job_ids.append(str(uuid.uuid4()))
+        items.append(DefectBatchItemOut(index=index, status="pending", id=defects[-1].id, job_id=job_ids[-1]))
+
+    with stage_seconds.time(stage="db_create"):
+        created = not defects or await create_defects_with_jobs(
+            defects, job_ids, [d.detection_id for _, d, _ in new_items]
+        )
+    if not created:
+        analysis_queue.admission.cancel(source, len(defects))
+        raise HTTPException(status_code=500, detail="❌ DB 생성 실패")
+    if attached and not await attach_detections(
+        [(str(uuid.uuid4()), cluster_id, d, d.detect_time or now) for _, cluster_id, d in attached],
+        [d.detection_id for _, _, d in attached]
+    ):
+        raise HTTPException(status_code=500, detail="❌ DB 생성 실패")
+    for index, cluster_id, _ in attached:
+        items.append(DefectBatchItemOut(index=index, status="attached", id=cluster_id))
+
+    # 같은 요청 안에서 detection_id가 겹친 항목은 앞선 항목의 결과를 따름
+    saved_ids = {d.detection_id: new_id for _, d, new_id in new_items} | {d.detection_id: cluster_id for _, cluster_id, d in attached}
+    for index, key in repeats:
+        if key in saved_ids:
+            items.append(DefectBatchItemOut(index=index, status="duplicate", id=saved_ids[key]))
+        elif key in seen:
+            items.append(DefectBatchItemOut(index=index, status="throttled", error="분석 대기열이 가득 찼습니다."))
+        else:
+            items.append(DefectBatchItemOut(index=index, status="duplicate", error="같은 detection_id의 요청을 처리 중입니다."))
+
+    # 분석 작업 큐가 LLaVA 분류 배치 크기만큼씩 묶어서 추론
+    for defect, job_id in zip(defects, job_ids):
+        if defect.address is None and settings.GEOCODE_DEFERRED:
+            _schedule_address_backfill(defect.id, defect.latitude, defect.longitude)
+        analysis_queue.enqueue(job_id, defect.id, source)
+
+    items.sort(key=lambda item: item.index)
+    duplicates = sum(item.status == "duplicate" for item in items)
+    accepted = len(defects) + len(attached) + duplicates
+    print(
+        f"✅ 손상 정보 일괄 등록: {len(defects)}건, 재탐지 {len(attached)}건, 재전송 {duplicates}건 "
+        f"(주소 변환 {len(cells)}회, 거부 {len(items) - accepted}건, 대기열 초과 {len(throttled)}건)"
+    )
+    return DefectBatchOut(accepted=accepted, rejected=len(items) - accepted, items=items)
+
+async def _read_batch_body(request: FastAPIRequest) -> list:
+    """
+    JSON 배열이면 한 번에, NDJSON이면 받은 만큼 줄 단위로 읽습니다. 파싱에 실패한 줄은 예외 객체로 남깁니다.
+    """
+
+    if "ndjson" not in request.headers.get("content-type", ""):
+        try:
+            body = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"JSON 파싱 실패: {e}")
+        if not isinstance(body, list):
+            raise HTTPException(status_code=400, detail="DefectCreate의 JSON 배열이어야 합니다.")
+        return body
+
+    def parse_line(line: bytes):
+        try:
+            return json.loads(line)
+        except ValueError as e:
+            return ValueError(f"NDJSON 파싱 실패: {e}")
+
+    raw_items, buffer = [], b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        raw_items.extend(parse_line(line) for line in lines if line.strip())
+    if buffer.strip():
+        raw_items.append(parse_line(buffer))
+    return raw_items
+
+def _geocode_cell(latitude: float, longitude: float) -> tuple[float, float]:
+    return round(latitude, settings.BATCH_GEOCODE_DECIMALS), round(longitude, settings.BATCH_GEOCODE_DECIMALS)
+
+# [드론용] 손상 분석 상태 조회 API
+@app.get(
+    "/defect-info/{defect_id}",
+    response_model=AnalysisJobOut,
+    summary="[드론용] 손상 분석 상태 조회",
+    description="분석 작업 상태(pending, analyzing, done, failed)와 현재까지 저장된 손상 정보를 반환합니다."
+)
+async def get_defect_info_status(defect_id: str):
+    job = await get_job_by_defect_id(defect_id)
+    defect = await get_defect_by_id(defect_id)
+    if job is None or defect is None:
+        raise HTTPException(status_code=404, detail=f"Defect ID '{defect_id}'를 찾을 수 없습니다.")
+
+    job.defect = defect
+    return job
+
+# [조회용] 손상 기록 조건 조회 API
+@app.get(
+    "/defects",
+    response_model=DefectPage,
+    summary="[조회용] 손상 기록 조건 조회",
+    description=(
+        "위험도, 보수 상태, 손상 유형, 감지 시각 범위, 위경도 범위로 손상 기록을 최신순으로 조회합니다.\n\n"
+        "응답의 `next_cursor`를 `cursor`로 넘기면 다음 페이지를 조회합니다. "
+        "`fields`에 쉼표로 컬럼을 지정하면 해당 컬럼만 반환합니다. (예: `id,urgency,detect_time`)"
+    )
+)
+async def list_defects(
+    urgency: Optional[List[Urgency]] = Query(None, description="위험도 (여러 개 지정 가능)"),
+    repair_status: Optional[List[Repair_status]] = Query(None, description="보수 상태 (여러 개 지정 가능)"),
+    defect_type: Optional[List[DefectType]] = Query(None, description="손상 유형 (여러 개 지정 가능)"),
+    since: Optional[str] = Query(None, description="감지 시각 시작 (포함, 예: 2025-11-01 00:00:00)"),
+    until: Optional[str] = Query(None, description="감지 시각 끝 (미포함)"),
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lon: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lon: Optional[float] = Query(None, ge=-180, le=180),
+    fields: Optional[str] = Query(None, description="반환할 컬럼 (쉼표 구분, 비우면 전체)"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="이전 응답의 next_cursor"),
+):
+    bbox_values = (min_lat, min_lon, max_lat, max_lon)
+    if any(v is not None for v in bbox_values) and any(v is None for v in bbox_values):
+        raise HTTPException(status_code=400, detail="min_lat, min_lon, max_lat, max_lon은 함께 지정해야 합니다.")
+
+    columns = [c.strip() for c in fields.split(",") if c.strip()] if fields else None
+    unknown = set(columns or []) - set(DEFECT_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"알 수 없는 필드: {', '.join(sorted(unknown))}")
+
+    after = _decode_cursor(cursor) if cursor else None
+
+    items, next_after = await query_defects(
+        urgency=urgency, repair_status=repair_status, defect_type=defect_type,
+        since=since, until=until,
+        bbox=bbox_values if min_lat is not None else None,
+        fields=columns, limit=limit, after=after,
+    )
+    next_cursor = base64.urlsafe_b64encode(json.dumps(next_after).encode()).decode() if next_after else None
+    return DefectPage(items=items, next_cursor=next_cursor)
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    """
+    next_cursor(base64 JSON [detect_time, id])를 keyset 위치로 되돌립니다. 형식이 다르면 400을 돌려줍니다.
+    """
+
+    try:
+        after = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError, binascii.Error):
+        after = None
+    if not (isinstance(after, list) and len(after) == 2 and all(isinstance(v, str) for v in after)):
+        raise HTTPException(status_code=400, detail="cursor 값이 올바르지 않습니다.")
+    return after[0], after[1]
+
+# [조회용] 주변 손상 조회 API
+@app.get(
+    "/defects/nearby",
+    response_model=List[NearbyDefectOut],
+    summary="[조회용] 주변 손상 조회",
+    description=(
+        "좌표에서 `radius_m` 안에 있는 손상을 가까운 순으로 반환합니다. "
+        "각 손상에는 거리, 묶인 탐지 횟수, 가장 최근 탐지 시각이 함께 담깁니다."
+    )
+)
+async def list_nearby_defects(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_m: float = Query(50, gt=0, le=5000, description="조회 반경(m)"),
+    repair_status: Optional[List[Repair_status]] = Query(None, description="보수 상태 (여러 개 지정 가능)"),
+    limit: int = Query(20, ge=1, le=200),
+):
+    return await get_nearby_defects(latitude, longitude, radius_m, limit=limit, repair_status=repair_status)
+
+# [조회용] 손상 이벤트 스트림 API (SSE)
+@app.get(
+    "/defects/stream",
+    summary="[조회용] 손상 이벤트 스트림 (SSE)",
+    description=(
+        "손상 생성(`created`), 분석 완료(`analyzed`), 보수 상태 변경(`status_changed`)을 Server-Sent Events로 보냅니다. "
+        "`types`로 받을 이벤트를 고를 수 있고, 이벤트가 없을 때는 연결 유지용 주석(`: ping`)을 보냅니다.\n\n"
+        "연결이 끊겼다가 다시 붙을 때 `Last-Event-ID` 헤더(또는 `cursor`)로 마지막 이벤트 id를 넘기면 그 다음부터 이어 받습니다. "
+        "놓친 이벤트가 보관 범위(`EVENT_HISTORY_SIZE`)를 벗어났으면 `reset` 이벤트를 보내므로 `GET /defects`로 목록을 다시 읽습니다. "
+        "받는 쪽이 느려 구독자 버퍼가 넘치면 연결을 끊으며, 마지막 id로 다시 연결하면 됩니다."
+    ),
+    response_class=StreamingResponse,
+    responses={200: {"content": {"text/event-stream": {}}}, 503: {"description": "구독자 수 한도 초과"}},
+)
+async def stream_defect_events(
+    cursor: Optional[str] = Query(None, description="마지막으로 받은 이벤트 id"),
+    types: Optional[List[DefectEventType]] = Query(None, description="받을 이벤트 종류 (여러 개 지정 가능)"),
+    last_event_id: Optional[str] = Header(None, description="EventSource가 다시 연결할 때 자동으로 붙이는 마지막 이벤트 id"),
+):
+    try:
+        subscription, backlog = event_hub.subscribe(cursor or last_event_id, types)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    async def body():
+        try:
+            yield "retry: 3000\n\n"
+            for event in backlog:
+                yield event.sse
+            async for event in event_hub.listen(subscription):
+                yield event.sse if event is not None else ": ping\n\n"
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    return StreamingResponse(
+        body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# [조회용] 손상 이벤트 스트림 API (WebSocket)
+@app.websocket("/defects/ws")
+async def defect_events_websocket(
+    websocket: WebSocket,
+    cursor: Optional[str] = Query(None, description="마지막으로 받은 이벤트 id"),
+    types: Optional[List[DefectEventType]] = Query(None, description="받을 이벤트 종류 (여러 개 지정 가능)"),
+):
+    """
+    /defects/stream과 같은 이벤트를 JSON 메시지(`{"id", "type", "defect"}`)로 보냅니다.
+    이벤트가 없을 때는 `{"type": "ping"}`을 보내고, 버퍼가 넘치면 1013 코드로 연결을 닫습니다.
+    """
+
+    try:
+        subscription, backlog = event_hub.subscribe(cursor, types)
+    except RuntimeError as e:
+        await websocket.close(code=1013, reason=str(e))
+        return
+
+    await websocket.accept()
+    try:
+        for event in backlog:
+            await websocket.send_text(event.data)
+        async for event in event_hub.listen(subscription):
+            await websocket.send_text(event.data if event is not None else '{"type": "ping"}')
+        await websocket.close(code=1013, reason="구독자 버퍼가 넘쳤습니다. 마지막 id로 다시 연결해 주세요.")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        event_hub.unsubscribe(subscription)
+
+# [운영용] Prometheus 지표 API
+@app.get(
+    "/metrics",
+    summary="[운영용] Prometheus 지표",
+    description=(
+        "단계별 처리 시간 히스토그램, 작업 대기열 길이, 토큰 생성 속도, 캐시 적중률, DB 연결 대기 시간을 "
+        "Prometheus 텍스트 형식으로 반환합니다."
+    ),
+    response_class=Response,
+)
+async def get_metrics():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 #----- 백그라운드 작업 함수 -----
 async def run_analysis_and_notify(defect: DefectOut):
     """
-    POST 요청과는 별개로 실행되는 백그라운드 작업입니다.
+    analysis_queue가 POST 요청과는 별개로 실행하는 분석 작업입니다.
+    실패하면 예외를 그대로 던져 작업 상태가 failed로 기록되도록 합니다.
     """
 
-    try:
-        defect_type,  urgency = await asyncio.to_thread(run_llava, defect.image, None, None, None, None)
-        
-        patch_data = DefectPatch(defect_type=defect_type, urgency=urgency)
+    # 최근에 분석한 것과 같은(거의 같은) 프레임이면 LLaVA를 다시 돌리지 않고 결과를 재사용
+    image_hash, similar = None, None
+    if settings.PHASH_MAX_DISTANCE >= 0:
+        try:
+            with stage_seconds.time(stage="phash"):
+                image_hash = await asyncio.to_thread(dhash, await image_store.get_image(defect.image))
+                similar = await find_similar_analysis(image_hash)
+            cache_lookups.inc(cache="phash", result="miss" if similar is None else "hit")
+        except Exception as e:
+            print(f"❌ 이미지 해시 계산 실패 (ID: {defect.id}): {e}")
+
+    if similar is not None:
+        similar_id, defect_type, urgency, distance = similar
+        print(f"ℹ️ 같은 프레임의 분석 결과 재사용 (ID: {defect.id} ← {similar_id}, 해밍 거리 {distance})")
+    else:
+        classification = await classify_scheduler.submit(defect.image, defect.id)
+        defect_type, urgency = classification.defect_type, classification.urgency
+    
+    patch_data = DefectPatch(defect_type=defect_type, urgency=urgency)
+    with stage_seconds.time(stage="db_patch"):
         updated_defect = await patch_defect_in_db(defect.id, patch_data)
 
-        if  updated_defect is None:
-            raise HTTPException(status_code=404, detail=f"Defect ID '{defect.id}'를 찾을 수 없습니다.")
-        
-        print(f"✅ DB 업데이트 완료 (ID: {defect.id})")
-
-        # Discord 알림 전송
-        llava_summary = "🚨 손상 감지 🚨\n" \
-            "새로운 외벽 손상이 탐지되었습니다. 아래의 정보를 확인하세요.\n" \
-            f"📍 위치: {defect.address}\n" \
-            f"🕒 감지 시각: {defect.detect_time}\n" \
-            f"🏷️ 손상 유형: {defect_type}\n" \
-            f"⚠️ 위험도(점검 긴급성): {urgency}"
+    if  updated_defect is None:
+        raise LookupError(f"Defect ID '{defect.id}' DB 업데이트 실패")
+    
+    print(f"✅ DB 업데이트 완료 (ID: {defect.id})")
+    if image_hash is not None:
+        await save_image_hash(defect.id, image_hash, defect_type, urgency)
+
+    # 주소를 아직 채우는 중이면 알림에 넣을 수 있도록 조금 기다림
+    pending_address = _address_tasks.get(defect.id)
+    if pending_address is not None:
+        await asyncio.wait([pending_address], timeout=settings.GEOCODE_TIMEOUT * (settings.GEOCODE_RETRIES + 1) + 1)
+        updated_defect = await get_defect_by_id(defect.id) or updated_defect
+
+    # Discord 알림 전송
+    llava_summary = "🚨 손상 감지 🚨\n" \
+        "새로운 외벽 손상이 탐지되었습니다. 아래의 정보를 확인하세요.\n" \
+        f"📍 위치: {updated_defect.address}\n" \
+        f"🕒 감지 시각: {defect.detect_time}\n" \
+        f"🏷️ 손상 유형: {defect_type}\n" \
+        f"⚠️ 위험도(점검 긴급성): {urgency}"
+    with stage_seconds.time(stage="alert"):
         await send_defect_alert(updated_defect, llava_summary)
 
-        return updated_defect
-        
-    except Exception as e:
-        print(f"❌ 백그라운드 작업 실패 (ID: {defect.id}): {e} : {type(e)}")
-        import traceback
-        traceback.print_exc()
+    return updated_defect
 
 # [개발용] 로컬 이미지 업로드 API
 @app.post(
@@ -171,6 +783,7 @@ async def upload_image_dev(file: UploadFile = File(...)):
         file.file.close()
 
     image_url_path = f"{settings.STATIC_MOUNT_PATH}/{settings.UPLOADS_DIR_NAME}/{file_name}"
+    schedule_derivatives(image_url_path) # 썸네일/미리보기는 백그라운드에서 생성
     
     return {"url": image_url_path}
 
@@ -188,6 +801,7 @@ async def upload_image_s3(file: UploadFile = File(...)):
 
     try:
         s3_url = await upload_to_s3(file)
+        schedule_derivatives(s3_url) # 썸네일/미리보기는 백그라운드에서 생성
         return {"url": s3_url}
 
     except Exception as e:
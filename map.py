@@ -1,10 +1,29 @@
-import requests
+import asyncio
+import math
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import aiosqlite
+import httpx
+import db_pool
 from config import settings
+from metrics import cache_lookups, geocode_requests
 from models import *
 
-def get_address_from_coords(latitude, longitude):
+EARTH_RADIUS_M = 6371000
+
+_client: httpx.AsyncClient | None = None
+_inflight: dict[str, asyncio.Future] = {}   # 격자 칸 -> 진행 중인 주소 변환
+
+
+async def get_address_from_coords(latitude, longitude):
     """
     네이버 Reverse Geocoding API를 호출하여 좌표를 도로명 주소로 변환합니다.
+    좌표는 GEOCODE_GRID_M 격자 칸으로 묶어 캐시하므로, 같은 칸의 좌표는 API를 다시 호출하지 않습니다.
+    같은 칸을 동시에 조회하면 API 호출은 한 번만 하고 결과를 나눠 씁니다. (single-flight)
     
     Args:
         latitude (float): 위도
@@ -13,8 +32,74 @@ def get_address_from_coords(latitude, longitude):
     Returns:
         str: 변환된 도로명 주소. 실패 시 None.
     """
-    
-    api_url = "https://maps.apigw.ntruss.com/map-reversegeocode/v2/gc"
+
+    if settings.GEOCODE_GRID_M <= 0:
+        return (await _request_address(latitude, longitude))[0]
+
+    cell = geocode_cell(latitude, longitude)
+    key = _cell_key(cell)
+    found, address = geocode_cache.get_memory(key)
+    if found:
+        cache_lookups.inc(cache="geocode", result="hit")
+        return address
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        cache_lookups.inc(cache="geocode", result="hit")
+        return await asyncio.shield(inflight)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        found, address = await geocode_cache.load(key)
+        cache_lookups.inc(cache="geocode", result="hit" if found else "miss")
+        if not found:
+            # 같은 칸이면 어느 좌표가 먼저 와도 같은 주소가 되도록 칸 가운데 좌표로 조회
+            address, ok = await _request_address(*cell_center(cell))
+            await geocode_cache.put(key, address, ok)
+        future.set_result(address)
+        return address
+    except Exception as e:
+        future.set_exception(e)
+        future.exception() # 기다리는 요청이 없어도 경고가 남지 않도록
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _inflight.pop(key, None)
+
+def peek_address(latitude, longitude) -> Optional[str]:
+    """
+    API나 DB를 거치지 않고 메모리 캐시에 있는 주소만 돌려줍니다. (없으면 None)
+    """
+
+    if settings.GEOCODE_GRID_M <= 0:
+        return None
+    return geocode_cache.get_memory(_cell_key(geocode_cell(latitude, longitude)))[1]
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(settings.GEOCODE_TIMEOUT),
+            limits=httpx.Limits(max_connections=settings.GEOCODE_MAX_CONNECTIONS, max_keepalive_connections=settings.GEOCODE_MAX_CONNECTIONS),
+        )
+    return _client
+
+async def close_geocoder():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+async def _request_address(latitude, longitude) -> tuple[Optional[str], bool]:
+    """
+    네이버 API를 호출합니다. 연결 오류, 시간 초과, 429/5xx 응답은 GEOCODE_RETRIES번까지
+    지수 백오프 + jitter 간격으로 다시 시도합니다.
+
+    Returns:
+        (주소, 성공 여부). 실패한 결과는 캐시에 짧게(GEOCODE_NEGATIVE_TTL_SECONDS)만 남깁니다.
+    """
     
     params = {
         "coords": f"{longitude},{latitude}",
@@ -26,10 +111,31 @@ def get_address_from_coords(latitude, longitude):
         "x-ncp-apigw-api-key-id": settings.NAVER_CLIENT_ID,
         "x-ncp-apigw-api-key": settings.NAVER_CLIENT_SECRET,
     }
-    
+
+    attempts = settings.GEOCODE_RETRIES + 1
+    for attempt in range(attempts):
+        if attempt:
+            # 여러 요청이 같은 순간에 다시 몰리지 않도록 대기 시간을 0 ~ 백오프 사이에서 무작위로 고름
+            await asyncio.sleep(random.uniform(0, settings.GEOCODE_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+        try:
+            response = await _get_client().get(settings.NAVER_GEOCODE_URL, params=params, headers=headers)
+        except httpx.HTTPError as e:
+            print(f"❌ 요청 처리 실패 ({attempt + 1}/{attempts}): {type(e).__name__} {e}")
+            geocode_requests.inc(result="retry" if attempt + 1 < attempts else "error")
+            continue
+
+        if response.status_code == 429 or response.status_code >= 500:
+            print(f"❌ HTTP 오류 발생 ({attempt + 1}/{attempts}): {response.status_code}")
+            geocode_requests.inc(result="retry" if attempt + 1 < attempts else "error")
+            continue
+
+        return _parse_address(response)
+
+    return None, False
+
+def _parse_address(response: httpx.Response) -> tuple[Optional[str], bool]:
     try:
-        response = requests.get(api_url, params=params, headers=headers)
-        
         if response.status_code == 200:
             data = response.json()
             
@@ -51,17 +157,140 @@ def get_address_from_coords(latitude, longitude):
                 
                 full_address = f"{area1} {area2} {road_name} {building_num} {building_name}".strip()
                 
-                return full_address
+                geocode_requests.inc(result="ok")
+                return full_address, True
                 
             else:
                 print(f"❌ 네이버 API 오류: {data['status']['message']}")
-                return "인천 미추홀구 인하로 100, 인하대학교"
+                geocode_requests.inc(result="error")
+                return "인천 미추홀구 인하로 100, 인하대학교", False
                 
         else:
             print(f"❌ HTTP 오류 발생: {response.status_code}")
             print(f"❌ 응답 내용: {response.text}")
-            return None
+            geocode_requests.inc(result="error")
+            return None, False
             
     except Exception as e:
         print(f"❌ 요청 처리 실패: {e}")
-        return None    
\ No newline at end of file
+        geocode_requests.inc(result="error")
+        return None, False
+
+
+# ----- 주소 캐시 -----
+def geocode_cell(latitude, longitude) -> tuple[int, int]:
+    """
+    좌표를 한 변이 GEOCODE_GRID_M인 격자 칸 번호 (위도 칸, 경도 칸)으로 바꿉니다.
+    경도 방향 칸 크기는 위도 칸 가운데의 위도에 맞춰 m 단위로 거의 같게 합니다.
+    """
+
+    d_lat = math.degrees(settings.GEOCODE_GRID_M / EARTH_RADIUS_M)
+    row = math.floor(latitude / d_lat)
+    d_lon = d_lat / max(math.cos(math.radians((row + 0.5) * d_lat)), 1e-6)
+    return row, math.floor(longitude / d_lon)
+
+def cell_center(cell) -> tuple[float, float]:
+    row, col = cell
+    d_lat = math.degrees(settings.GEOCODE_GRID_M / EARTH_RADIUS_M)
+    d_lon = d_lat / max(math.cos(math.radians((row + 0.5) * d_lat)), 1e-6)
+    return (row + 0.5) * d_lat, (col + 0.5) * d_lon
+
+def _cell_key(cell) -> str:
+    return f"{settings.GEOCODE_GRID_M:g}:{cell[0]}:{cell[1]}"
+
+def _iso(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class GeocodeCache:
+    """
+    격자 칸 → 주소 캐시입니다.
+    - 메모리 LRU(GEOCODE_CACHE_SIZE칸) 뒤에 SQLite geocode_cache 테이블을 두어 재시작 후에도 재사용
+    - 성공한 주소는 GEOCODE_CACHE_TTL_DAYS, 실패한 결과는 GEOCODE_NEGATIVE_TTL_SECONDS 동안 보관
+    메모리 조회는 바로, SQLite 조회/저장(load, put)은 다른 DB 접근과 같이 연결 풀(db_pool)의 연결로 합니다.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[Optional[str], float]] = OrderedDict() # 칸 -> (주소, 만료 시각)
+        self._lock = threading.Lock()
+
+    def get_memory(self, key: str) -> tuple[bool, Optional[str]]:
+        """
+        Returns: (캐시에 있었는지, 주소). 실패가 캐시된 칸은 (True, 실패 당시 결과)입니다.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(key)
+                return True, entry[0]
+        return False, None
+
+    async def load(self, key: str) -> tuple[bool, Optional[str]]:
+        # SQLite에서 찾아 메모리에 올림 (get_memory와 같은 형식으로 돌려줌)
+        now = time.time()
+        try:
+            async with db_pool.connect(read_only=True) as db:
+                async with db.execute(
+                    "SELECT address, expires_at FROM geocode_cache WHERE cell = ? AND expires_at > ?", (key, _iso(now))
+                ) as cursor:
+                    row = await cursor.fetchone()
+        except aiosqlite.Error as e:
+            print(f"❌ 주소 캐시 조회 실패: {e}")
+            return False, None
+        if row is None:
+            return False, None
+
+        address, expires_at = row
+        self._remember(key, address, datetime.fromisoformat(expires_at.replace("Z", "+00:00")).timestamp())
+        return True, address
+
+    async def put(self, key: str, address: Optional[str], ok: bool):
+        now = time.time()
+        expires = now + (settings.GEOCODE_CACHE_TTL_DAYS * 86400 if ok else settings.GEOCODE_NEGATIVE_TTL_SECONDS)
+        self._remember(key, address, expires)
+
+        try:
+            async with db_pool.connect() as db:
+                await db.execute(
+                    "INSERT OR REPLACE INTO geocode_cache (cell, address, ok, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, address, int(ok), _iso(expires))
+                )
+                await db.execute("DELETE FROM geocode_cache WHERE expires_at < ?", (_iso(now),))
+                await db.commit()
+        except aiosqlite.Error as e:
+            print(f"❌ 주소 캐시 저장 실패: {e}")
+
+    def clear_memory(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: str, address: Optional[str], expires: float):
+        with self._lock:
+            self._entries[key] = (address, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+geocode_cache = GeocodeCache(max_entries=settings.GEOCODE_CACHE_SIZE)
+
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """
+    두 좌표 사이의 거리(m)를 haversine 공식으로 계산합니다.
+    """
+
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+def bbox_around(latitude, longitude, radius_m):
+    """
+    좌표를 중심으로 반경 radius_m를 덮는 (min_lat, min_lon, max_lat, max_lon)을 돌려줍니다.
+    """
+
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+    d_lon = d_lat / max(math.cos(math.radians(latitude)), 1e-6)
+    return latitude - d_lat, longitude - d_lon, latitude + d_lat, longitude + d_lon
@@ -0,0 +1,280 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+
+# ----- 기본 히스토그램 구간(초) -----
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry: dict[str, "_Metric"] = {}
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    프로세스 안에서 값을 모으는 지표의 공통 부분입니다. 라벨 값 튜플별로 값을 따로 보관합니다.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}", *self._render_samples()]
+
+    def _render_samples(self) -> list[str]:
+        raise NotImplementedError
+
+    # 워커 프로세스 → 부모 프로세스로 넘길 값 (넘긴 값은 비움)
+    def export(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+    def merge(self, values: dict):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0.0) + value
+
+
+class Gauge(_Metric):
+    """
+    현재 값을 나타내는 지표입니다. function을 주면 /metrics를 읽을 때마다 호출해서 값을 채웁니다.
+    function은 숫자 하나 또는 {라벨 값 튜플: 숫자}를 돌려줍니다.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), function=None):
+        super().__init__(name, help, labelnames)
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _render_samples(self) -> list[str]:
+        if self._function is not None:
+            try:
+                result = self._function()
+            except Exception as e:
+                print(f"❌ 지표 계산 실패 ({self.name}): {e}")
+                return []
+            items = sorted(result.items()) if isinstance(result, dict) else [((), result)]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in items]
+
+    def export(self) -> dict:
+        return {} # 현재 값은 프로세스마다 의미가 달라서 넘기지 않음
+
+    def merge(self, values: dict):
+        pass
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        with 블록이 걸린 시간(초)을 기록합니다. 예외가 나도 기록합니다.
+        """
+
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def timed(self, **labels):
+        """
+        함수 호출 시간을 기록하는 데코레이터입니다. (제너레이터 함수에는 쓰지 않음)
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _render_samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((key, ([*state[0]], state[1], state[2])) for key, state in self._values.items())
+
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                state = self._values.get(key)
+                if state is None:
+                    state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                state[0] = [a + b for a, b in zip(state[0], counts)]
+                state[1] += total
+                state[2] += count
+
+
+# ----- 수집 / 출력 -----
+def render() -> str:
+    """
+    모든 지표를 Prometheus 텍스트 형식으로 돌려줍니다.
+    """
+
+    return "\n".join(line for metric in _registry.values() for line in metric.render()) + "\n"
+
+def export() -> dict:
+    """
+    지금까지 모은 값을 꺼내고 비웁니다. 추론 워커 프로세스가 작업을 마칠 때마다 부모 프로세스로 보냅니다.
+    """
+
+    return {name: values for name, metric in _registry.items() if (values := metric.export())}
+
+def merge(exported: dict):
+    for name, values in exported.items():
+        metric = _registry.get(name)
+        if metric is not None:
+            metric.merge(values)
+
+
+# ----- 지표 -----
+http_request_seconds = Histogram(
+    "airovision_http_request_seconds", "HTTP 요청 처리 시간(초)", ("method", "route", "status"),
+)
+stage_seconds = Histogram(
+    "airovision_stage_seconds", "파이프라인 단계별 처리 시간(초)", ("stage",),
+)
+queue_depth = Gauge(
+    "airovision_queue_depth", "대기 중인 작업 수", ("queue",),
+)
+generated_tokens = Counter(
+    "airovision_generated_tokens_total", "LLaVA가 생성한 토큰 수",
+)
+generation_tokens_per_second = Histogram(
+    "airovision_generation_tokens_per_second", "생성 호출별 토큰 생성 속도(토큰/초)",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+cache_lookups = Counter(
+    "airovision_cache_lookups_total", "캐시 조회 수", ("cache", "result"),
+)
+feature_cache_lookups = Counter(
+    "airovision_feature_cache_lookups_total", "시각 토큰 캐시 조회 수 (워커별, result=hit/disk_hit/miss)", ("worker", "result"),
+)
+feature_cache_bytes = Gauge(
+    "airovision_feature_cache_bytes", "시각 토큰 캐시 크기(바이트, 워커별, tier=memory/disk)", ("worker", "tier"),
+)
+cache_hit_ratio = Gauge(
+    "airovision_cache_hit_ratio", "캐시 적중률 (서버 시작 후 누적)", ("cache",),
+)
+admission_rejected = Counter(
+    "airovision_admission_rejected_total", "분석 대기열이 가득 차 거절한 손상 정보 수", ("reason",),
+)
+admission_limit = Gauge(
+    "airovision_admission_limit", "현재 받을 수 있는 최대 분석 작업 수 (처리량에 따라 조정)",
+)
+analysis_throughput = Gauge(
+    "airovision_analysis_throughput", "측정된 분석 처리량(작업/초, 작업이 있는 동안 기준)",
+)
+geocode_requests = Counter(
+    "airovision_geocode_requests_total", "네이버 Reverse Geocoding API 호출 수", ("result",),
+)
+events_published = Counter(
+    "airovision_events_published_total", "발행한 손상 이벤트 수", ("type",),
+)
+event_overflows = Counter(
+    "airovision_event_overflows_total", "버퍼가 넘쳐 연결을 끊은 이벤트 구독자 수",
+)
+event_subscribers = Gauge(
+    "airovision_event_subscribers", "연결된 이벤트 구독자 수 (SSE + WebSocket)",
+)
+db_connect_seconds = Histogram(
+    "airovision_db_connect_seconds", "SQLite 연결을 얻기까지 기다린 시간(초)",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+def _cache_hit_ratio() -> dict:
+    with cache_lookups._lock:
+        values = dict(cache_lookups._values)
+
+    ratios = {}
+    for cache in {cache for cache, _ in values}:
+        hits = values.get((cache, "hit"), 0.0)
+        total = hits + values.get((cache, "miss"), 0.0)
+        if total:
+            ratios[(cache,)] = hits / total
+    return ratios
+
+cache_hit_ratio.set_function(_cache_hit_ratio)
@@ -2,9 +2,13 @@ from pydantic import BaseModel, Field
 from typing import Literal, Optional
 
 
-DefectType = Literal["콘크리트 균열","콘크리트 박리","도장 손상","철근 노출"]
-Urgency = Literal["높음","보통","낮음"]
+# "분류 안됨": LLaVA가 후보 중 하나로 분류하지 못한 경우 (손상 없음 포함)
+DefectType = Literal["콘크리트 균열","콘크리트 박리","도장 손상","철근 노출","분류 안됨"]
+Urgency = Literal["높음","보통","낮음","분류 안됨"]
 Repair_status = Literal["미처리", "진행중", "완료"]
+AnalysisStatus = Literal["pending", "analyzing", "done", "failed"]
+BatchItemStatus = Literal["pending", "attached", "duplicate", "throttled", "invalid"]
+DefectEventType = Literal["created", "analyzed", "status_changed"]
 
 
 # ----- 생성용(드론 → 서버) -----
@@ -15,6 +19,7 @@ class DefectCreate(BaseModel):
     
     detect_time: Optional[str] = None
     address: Optional[str] = None
+    detection_id: Optional[str] = Field(None, max_length=128, description="드론이 붙인 탐지 ID (재전송 시 같은 값이면 한 번만 처리)")
 
 
 # ----- 부분 갱신용(LLaVA → 서버) -----
@@ -22,6 +27,7 @@ class DefectPatch(BaseModel):
     defect_type: Optional[DefectType] = None
     urgency: Optional[Urgency] = None
     repair_status: Optional[Repair_status] = None
+    address: Optional[str] = None
 
 
 # ----- 조회/응답용 -----
@@ -35,4 +41,46 @@ class DefectOut(BaseModel):
     defect_type: Optional[DefectType] = None
     urgency: Optional[Urgency] = None
     address: Optional[str] = None
-    repair_status: Optional[Repair_status] = None
\ No newline at end of file
+    repair_status: Optional[Repair_status] = None
+
+
+# ----- 분석 작업 상태 조회용 -----
+class AnalysisJobOut(BaseModel):
+    id: str = Field(..., description="손상 정보 ID")
+    job_id: str
+    status: AnalysisStatus
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: Optional[str] = None
+    updated_at: Optional[str] = None
+    attached: bool = Field(False, description="이미 등록된 손상의 재탐지로 묶였으면 True (다시 분석/알림하지 않음)")
+
+    defect: Optional[DefectOut] = None
+
+
+# ----- 일괄 생성 응답용(드론 → 서버, 비행 1회분) -----
+class DefectBatchItemOut(BaseModel):
+    index: int = Field(..., description="요청 안에서의 순서 (0부터)")
+    status: BatchItemStatus
+    id: Optional[str] = None
+    job_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+class DefectBatchOut(BaseModel):
+    accepted: int
+    rejected: int
+    items: list[DefectBatchItemOut]
+
+
+# ----- 조건 조회 응답용 (GET /defects) -----
+class DefectPage(BaseModel):
+    items: list[dict] = Field(..., description="요청한 컬럼(fields)만 담은 손상 기록")
+    next_cursor: Optional[str] = Field(None, description="다음 페이지 조회 시 cursor로 넘길 값 (마지막 페이지면 null)")
+
+
+# ----- 주변 손상 조회 응답용 (GET /defects/nearby) -----
+class NearbyDefectOut(DefectOut):
+    distance_m: float = Field(..., description="조회 좌표로부터의 거리(m)")
+    detections: int = Field(1, description="이 손상으로 묶인 탐지 횟수 (처음 탐지 포함)")
+    last_detect_time: str = Field(..., description="가장 최근 탐지 시각")
@@ -12,14 +12,16 @@ from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
 
 from database import get_all_defects_from_db, get_defect_by_id, update_repair_status
+from derivatives import get_derivatives
 from models import DefectOut
 from typing import List
 
 
 # ----- DB 연동 손상 기록 조회 -----
-def build_defect_detail_embed(record: DefectOut) -> discord.Embed:
+def build_defect_detail_embed(record: DefectOut, image_url: str | None = None) -> discord.Embed:
     """
     DefectOut 객체를 기반으로 Embed 형태의 상세 정보를 생성합니다.
+    image_url을 주면 원본 대신 그 이미지(미리보기 파생본)를 보여줍니다.
     """
 
     risk = record.urgency or "분석 중"
@@ -44,7 +46,7 @@ def build_defect_detail_embed(record: DefectOut) -> discord.Embed:
         color=color
     )
 
-    image_url = record.image
+    image_url = image_url or record.image
     if image_url and image_url.startswith("/data"):
         image_url = f"http://34.218.88.107:8000{image_url}"
     if image_url and (image_url.startswith("http://") or image_url.startswith("https://")):
@@ -81,7 +83,8 @@ class DefectSelect(discord.ui.Select):
             await interaction.response.send_message("❌ 선택한 손상 기록을 찾을 수 없습니다.", ephemeral=True)
             return
 
-        detail_embed = build_defect_detail_embed(record)
+        derivatives = await get_derivatives([record.image])
+        detail_embed = build_defect_detail_embed(record, derivatives.get(record.image, {}).get("preview"))
         view = DefectDetailView(record)
 
         await interaction.response.send_message(
@@ -113,6 +116,9 @@ async def get_records(channel: discord.TextChannel):
 
     await channel.send("📈 **보수 공사가 시급한 순으로 모든 손상 기록을 조회했어요**")
 
+    # 목록에는 원본 대신 썸네일을 사용
+    derivatives = await get_derivatives([record.image for record in records])
+
     for record in records:
         risk = record.urgency or "분석 중"
         color = discord.Color.red() if risk == "높음" \
@@ -122,7 +128,7 @@ async def get_records(channel: discord.TextChannel):
 
         location = record.address or f"좌표: {record.latitude}, {record.longitude}"
         
-        image_url = record.image
+        image_url = derivatives.get(record.image, {}).get("thumb") or record.image
         if image_url and image_url.startswith("/data"):
             image_url = f"http://34.218.88.107:8000{image_url}"
 
@@ -1,15 +1,51 @@
+import asyncio
+import time
 import uuid
+from typing import NamedTuple
+from urllib.parse import urlparse
+
 import boto3
+from botocore.config import Config
 from fastapi import UploadFile
 from config import settings
+from metrics import stage_seconds
 from botocore.exceptions import ClientError
 
 # S3 클라이언트 (IAM Role 기반 자동 인증)
+# 연결 풀은 동시에 올리는 파트 수만큼 두고, AWS_S3_ENDPOINT_URL이 있으면 moto/minio 같은 로컬 S3로 보냅니다.
 s3_client = boto3.client(
     "s3",
-    region_name=settings.AWS_REGION
+    region_name=settings.AWS_REGION,
+    endpoint_url=settings.AWS_S3_ENDPOINT_URL or None,
+    config=Config(
+        max_pool_connections=settings.S3_MAX_CONCURRENT_UPLOADS * 2,
+        retries={"max_attempts": 3, "mode": "standard"},
+    )
 )
 
+# boto3 호출은 스레드에서 실행하고, 동시에 진행하는 업로드 수를 제한
+_upload_semaphore = asyncio.Semaphore(settings.S3_MAX_CONCURRENT_UPLOADS)
+
+
+class UploadStats(NamedTuple):
+    size: int            # 업로드한 바이트 수
+    elapsed: float       # 걸린 시간(초)
+    peak_buffered: int   # 메모리에 동시에 들고 있던 최대 바이트 수
+    parts: int           # 멀티파트 파트 수 (1이면 put_object)
+
+
+def _public_url(s3_key: str) -> str:
+    if settings.AWS_S3_ENDPOINT_URL:
+        return f"{settings.AWS_S3_ENDPOINT_URL.rstrip('/')}/{settings.AWS_S3_BUCKET}/{s3_key}"
+    return f"https://{settings.AWS_S3_BUCKET}.s3.{settings.AWS_REGION}.amazonaws.com/{s3_key}"
+
+def s3_key_from_url(url: str) -> str:
+    # _public_url의 역변환
+    key = urlparse(url).path.lstrip("/")
+    if settings.AWS_S3_ENDPOINT_URL and key.startswith(f"{settings.AWS_S3_BUCKET}/"):
+        key = key[len(settings.AWS_S3_BUCKET) + 1:]
+    return key
+
 async def upload_to_s3(file: UploadFile) -> str:
     """
     업로드된 파일을 S3 버킷에 저장하고 접근 가능한 URL을 반환합니다.
@@ -17,23 +53,90 @@ async def upload_to_s3(file: UploadFile) -> str:
     """
 
     try:
-        file_extension = file.filename.split(".")[-1]        
+        file_extension = file.filename.split(".")[-1]
         new_filename = f"{uuid.uuid4()}.{file_extension}"
         s3_key = f"upload/{new_filename}"
-        file_bytes = await file.read()
-        s3_client.put_object(
-            Bucket=settings.AWS_S3_BUCKET,
-            Key=s3_key,
-            Body=file_bytes,
-            ContentType=file.content_type
-        )
 
-        public_url = f"https://{settings.AWS_S3_BUCKET}.s3.{settings.AWS_REGION}.amazonaws.com/{s3_key}"
+        async with _upload_semaphore:
+            with stage_seconds.time(stage="s3_upload"):
+                stats = await stream_upload(file, s3_key, file.content_type)
 
-        return public_url
+        mb = 1024 * 1024
+        print(
+            f"✅ S3 업로드 완료: {s3_key} / {stats.size / mb:.1f}MB, {stats.parts}파트, {stats.elapsed:.2f}s "
+            f"({stats.size / mb / max(stats.elapsed, 1e-6):.1f}MB/s), 최대 버퍼 {stats.peak_buffered / mb:.1f}MB"
+        )
+        return _public_url(s3_key)
 
     except ClientError as e:
         raise RuntimeError(f"❌ S3 업로드 실패: {e}")
 
     finally:
-        await file.close()
\ No newline at end of file
+        await file.close()
+
+async def stream_upload(file: UploadFile, s3_key: str, content_type: str | None) -> UploadStats:
+    """
+    파일 전체를 메모리에 올리지 않고 S3_PART_SIZE_MB 단위로 읽어 멀티파트 업로드합니다.
+    파트 하나를 올리는 동안 다음 파트를 읽으므로 메모리에는 최대 2개 파트만 머뭅니다.
+    파일이 파트 하나보다 작으면 put_object 한 번으로 올립니다.
+    """
+
+    part_size = settings.S3_PART_SIZE_MB * 1024 * 1024  # S3 최소 파트 크기는 5MB (마지막 파트 제외)
+    extra = {"ContentType": content_type} if content_type else {}
+    started = time.perf_counter()
+
+    chunk = await file.read(part_size)
+    if len(chunk) < part_size:
+        await asyncio.to_thread(
+            s3_client.put_object, Bucket=settings.AWS_S3_BUCKET, Key=s3_key, Body=chunk, **extra
+        )
+        return UploadStats(len(chunk), time.perf_counter() - started, len(chunk), 1)
+
+    upload = await asyncio.to_thread(
+        s3_client.create_multipart_upload, Bucket=settings.AWS_S3_BUCKET, Key=s3_key, **extra
+    )
+    upload_id = upload["UploadId"]
+
+    def upload_part(part_number: int, body: bytes) -> dict:
+        resp = s3_client.upload_part(
+            Bucket=settings.AWS_S3_BUCKET, Key=s3_key, UploadId=upload_id, PartNumber=part_number, Body=body
+        )
+        return {"PartNumber": part_number, "ETag": resp["ETag"]}
+
+    parts, size, peak_buffered = [], 0, 0
+    sending = None
+    try:
+        while chunk:
+            sending = asyncio.ensure_future(asyncio.to_thread(upload_part, len(parts) + 1, chunk))
+            next_chunk = await file.read(part_size)
+            peak_buffered = max(peak_buffered, len(chunk) + len(next_chunk))
+
+            parts.append(await sending)
+            size += len(chunk)
+            chunk = next_chunk
+
+        await asyncio.to_thread(
+            s3_client.complete_multipart_upload,
+            Bucket=settings.AWS_S3_BUCKET, Key=s3_key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except BaseException:
+        # 올리던 파트가 끝나기를 기다린 뒤, 올라간 파트가 버킷에 남지 않도록 취소
+        if sending is not None and not sending.done():
+            await asyncio.wait([sending])
+        await asyncio.to_thread(
+            s3_client.abort_multipart_upload, Bucket=settings.AWS_S3_BUCKET, Key=s3_key, UploadId=upload_id
+        )
+        raise
+
+    return UploadStats(size, time.perf_counter() - started, peak_buffered, len(parts))
+
+async def upload_bytes_to_s3(s3_key: str, data: bytes, content_type: str) -> str:
+    """
+    썸네일처럼 이미 메모리에 있는 작은 파일을 그대로 올리고 URL을 반환합니다.
+    """
+
+    async with _upload_semaphore:
+        await asyncio.to_thread(
+            s3_client.put_object, Bucket=settings.AWS_S3_BUCKET, Key=s3_key, Body=data, ContentType=content_type
+        )
+    return _public_url(s3_key)
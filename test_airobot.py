@@ -0,0 +1,14 @@
+from airobot import split_sentences
+
+
+def test_split_sentences_keeps_abbreviations_and_short_fragments():
+    text = "Cracks, e.g. Hairline cracks, are visible here. Repair is advised soon. It is"
+    sentences, rest = split_sentences(text)
+    assert sentences == ["Cracks, e.g. Hairline cracks, are visible here.", "Repair is advised soon."]
+    assert rest == "It is"
+
+
+def test_split_sentences_waits_for_the_next_sentence():
+    # 마침표 뒤 대문자가 오기 전까지는 문장이 끝났는지 알 수 없음
+    assert split_sentences("The concrete is spalling near 3.5 m height. ") == ([], "The concrete is spalling near 3.5 m height. ")
+    assert split_sentences("OK. Fine. The rebar is exposed. Next") == (["OK. Fine. The rebar is exposed."], "Next")
@@ -0,0 +1,64 @@
+import pytest
+
+import analysis_queue
+from analysis_queue import AdmissionController
+from config import settings
+
+
+@pytest.fixture
+def admission(monkeypatch):
+    # 처리량 1건/초 x 10초 = 한도 10, 드론 하나는 절반(5)까지
+    monkeypatch.setattr(settings, "ADMISSION_INITIAL_THROUGHPUT", 1.0)
+    monkeypatch.setattr(settings, "ADMISSION_TARGET_WAIT", 10.0)
+    monkeypatch.setattr(settings, "ADMISSION_MIN_QUEUE", 4)
+    monkeypatch.setattr(settings, "ADMISSION_MAX_QUEUE", 500)
+    monkeypatch.setattr(settings, "ADMISSION_SOURCE_SHARE", 0.5)
+
+    clock = [1000.0]
+    monkeypatch.setattr(analysis_queue.time, "monotonic", lambda: clock[0])
+    return AdmissionController(), clock
+
+
+def test_one_source_gets_at_most_its_share(admission):
+    controller, _ = admission
+
+    assert controller.limit() == 10
+    assert controller.admit("drone-a", 8) == 5
+    assert controller.admit("drone-a", 1) == 0 # 자기 몫을 다 씀
+    assert controller.admit("drone-b", 8) == 5
+    assert controller.admit("drone-c", 1) == 0 # 큐가 가득 참
+    assert controller.outstanding == 10
+
+
+def test_release_frees_a_slot_for_the_same_source(admission):
+    controller, clock = admission
+    controller.admit("drone-a", 5)
+    controller.admit("drone-b", 5)
+
+    clock[0] += 1
+    controller.release("drone-a")
+
+    assert controller.admit("drone-b", 1) == 0 # drone-b는 여전히 자기 몫을 다 씀
+    assert controller.admit("drone-a", 2) == 1
+    assert controller.outstanding == 10
+
+
+def test_retry_after_follows_queue_excess_and_measured_throughput(admission):
+    controller, clock = admission
+    controller.admit("drone-a", 5)
+    controller.admit("drone-b", 5)
+
+    # 한도를 1건 넘기려면 1건이 끝나야 함 (처리량 1건/초)
+    assert controller.retry_after(1) == 1
+    assert controller.retry_after(6) == 6
+
+    # 5초 동안 10건을 끝냄 → 처리량 2건/초, 한도 20
+    for _ in range(10):
+        clock[0] += 0.5
+        controller.release("drone-a" if controller._by_source.get("drone-a") else "drone-b")
+    assert controller.throughput == pytest.approx(2.0)
+    assert controller.limit() == 20
+
+    controller.admit("drone-a", 10)
+    controller.admit("drone-b", 10)
+    assert controller.retry_after(7) == 4 # 넘치는 7건 / 2건/초
@@ -0,0 +1,15 @@
+import pytest
+from pydantic import ValidationError
+
+from config import Settings
+
+
+@pytest.mark.parametrize("distance", [-1, 0, 3])
+def test_phash_distance_within_index_guarantee(distance):
+    assert Settings(PHASH_MAX_DISTANCE=distance).PHASH_MAX_DISTANCE == distance
+
+
+@pytest.mark.parametrize("distance", [-2, 4, 10])
+def test_phash_distance_beyond_index_guarantee_is_rejected(distance):
+    with pytest.raises(ValidationError, match="PHASH_MAX_DISTANCE"):
+        Settings(PHASH_MAX_DISTANCE=distance)
@@ -0,0 +1,139 @@
+import asyncio
+import sqlite3
+
+from config import settings
+import database
+from llava import model_revision
+from models import DefectOut
+
+
+def _defect(defect_id: str, latitude: float, longitude: float = 126.6530, detect_time: str = "2025-01-01 00:00:00", **fields) -> DefectOut:
+    return DefectOut(id=defect_id, latitude=latitude, longitude=longitude, image="x.jpg", detect_time=detect_time, **fields)
+
+
+def test_nearby_defects_survive_rowid_renumbering(data_dir):
+    async def run():
+        await database.init_db()
+        for i in range(5):
+            await database.create_defect_in_db(_defect(f"d{i}", 37.45 + i * 0.001))
+
+        # VACUUM처럼 rowid가 다시 매겨져도 R*Tree는 geo_id로 연결됨
+        with sqlite3.connect(settings.DB_PATH) as db:
+            db.execute("DELETE FROM defects WHERE id = 'd0'")
+            db.execute("UPDATE defects SET rowid = rowid + 100")
+        await database.create_defect_in_db(_defect("new", 37.4502))
+
+        return (
+            [d.id for d in await database.get_nearby_defects(37.45, 126.6530, 150)],
+            [d.id for d in await database.get_nearby_defects(37.453, 126.6530, 10)],
+        )
+
+    assert asyncio.run(run()) == (["new", "d1"], ["d3"])
+
+
+def _fill_defects(count: int) -> list[dict]:
+    # 시각이 겹치는 손상을 여러 개 만들어 (detect_time, id) 순서로만 구분되게 함
+    rows = []
+    with sqlite3.connect(settings.DB_PATH) as db:
+        for i in range(count):
+            row = {
+                "id": f"defect-{i % 7}-{i:03d}",
+                "latitude": 37.0 + (i % 10) * 0.01,
+                "longitude": 127.0 + (i % 4) * 0.01,
+                "image": "x.jpg",
+                "detect_time": f"2025-01-0{1 + i % 3} 12:00:00",
+                "defect_type": ["콘크리트 균열", "도장 손상", "철근 노출"][i % 3],
+                "urgency": ["높음", "보통", "낮음", None][i % 4],
+                "repair_status": ["미처리", "보수중", "완료"][i % 5 % 3],
+            }
+            db.execute(f"INSERT INTO defects ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})", list(row.values()))
+            rows.append(row)
+    return rows
+
+def _read_all_pages(limit: int, **filters) -> list[str]:
+    async def run():
+        ids, after = [], None
+        while True:
+            items, after = await database.query_defects(fields=["id"], limit=limit, after=after, **filters)
+            ids += [item["id"] for item in items]
+            if after is None:
+                return ids
+    return asyncio.run(run())
+
+
+def test_pages_have_no_gaps_or_duplicates_across_equal_times(data_dir):
+    asyncio.run(database.init_db())
+    rows = _fill_defects(40)
+
+    ids = _read_all_pages(limit=3)
+
+    expected = sorted(rows, key=lambda row: (row["detect_time"], row["id"]), reverse=True)
+    assert ids == [row["id"] for row in expected]
+
+
+def test_filters_match_every_condition(data_dir):
+    asyncio.run(database.init_db())
+    rows = _fill_defects(60)
+
+    ids = _read_all_pages(
+        limit=4,
+        urgency=["높음", "낮음"], repair_status=["미처리", "완료"], defect_type=["콘크리트 균열", "철근 노출"],
+        since="2025-01-02 00:00:00", until="2025-01-04 00:00:00", bbox=(37.0, 127.0, 37.05, 127.02),
+    )
+
+    expected = [
+        row for row in rows
+        if row["urgency"] in ("높음", "낮음") and row["repair_status"] in ("미처리", "완료")
+        and row["defect_type"] in ("콘크리트 균열", "철근 노출")
+        and "2025-01-02 00:00:00" <= row["detect_time"] < "2025-01-04 00:00:00"
+        and 37.0 <= row["latitude"] <= 37.05 and 127.0 <= row["longitude"] <= 127.02
+    ]
+    assert expected
+    assert sorted(ids) == sorted(row["id"] for row in expected)
+
+
+def test_cached_answers_are_kept_per_model(data_dir, monkeypatch):
+    async def run():
+        await database.init_db()
+        await database.save_cached_answer("d1", "질문", model_revision(), "7B 답변")
+        cached = [await database.get_cached_answer("d1", "질문", model_revision())]
+
+        # revision 문자열이 같아도 모델이 다르면 다른 답변
+        monkeypatch.setattr(settings, "LLAVA_MODEL_ID", "llava-hf/llava-1.5-13b-hf")
+        cached.append(await database.get_cached_answer("d1", "질문", model_revision()))
+        return cached
+
+    assert asyncio.run(run()) == ["7B 답변", None]
+
+
+def test_migrate_db_upgrades_an_original_schema_database(data_dir, monkeypatch):
+    # 처음 배포된 스키마 (user_version 0, urgency_rank / geo_id 없음)
+    with sqlite3.connect(settings.DB_PATH) as db:
+        db.execute("""
+        CREATE TABLE defects (
+            id TEXT PRIMARY KEY, latitude REAL NOT NULL, longitude REAL NOT NULL, image TEXT NOT NULL,
+            detect_time TEXT NOT NULL, defect_type TEXT, urgency TEXT, address TEXT, repair_status TEXT DEFAULT '미처리'
+        )
+        """)
+        urgencies = ["높음", "보통", "낮음", None]
+        for i in range(10):
+            db.execute(
+                "INSERT INTO defects (id, latitude, longitude, image, detect_time, urgency) VALUES (?, ?, ?, ?, ?, ?)",
+                (f"d{i}", 37.45 + i * 0.01, 126.65, "x.jpg", "2025-01-01 00:00:00", urgencies[i % 4])
+            )
+    monkeypatch.setattr(settings, "DB_MIGRATION_BATCH", 3) # 여러 묶음으로 나눠 채우는지 확인
+
+    asyncio.run(database.init_db())
+    asyncio.run(database.init_db()) # 다시 시작해도 마이그레이션을 또 적용하지 않음
+
+    with sqlite3.connect(settings.DB_PATH) as db:
+        (version,) = db.execute("PRAGMA user_version").fetchone()
+        ranks = set(db.execute("SELECT urgency, urgency_rank FROM defects").fetchall())
+        missing_geo_ids = db.execute("SELECT COUNT(*) FROM defects WHERE geo_id IS NULL").fetchone()[0]
+        rtree_rows = db.execute("SELECT COUNT(*) FROM defects_rtree r JOIN defects d ON d.geo_id = r.id").fetchone()[0]
+        indexes = {name for (name,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    assert version == len(database.MIGRATIONS)
+    assert ranks == {("높음", 3), ("보통", 2), ("낮음", 1), (None, 0)}
+    assert missing_geo_ids == 0 and rtree_rows == 10
+    assert {"idx_defects_rank_time", "idx_defects_geo_id"} <= indexes
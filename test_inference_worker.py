@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from inference_worker import PRIORITY_BULK, PRIORITY_INTERACTIVE, InferencePool
+
+
+async def _start_pool(num_workers: int) -> InferencePool:
+    pool = InferencePool(num_workers, backend="stub")
+    await pool.start()
+    return pool
+
+def _record_dispatch(pool: InferencePool) -> list[tuple[int, str, tuple]]:
+    # 워커별 작업 큐에 들어간 (worker_id, 작업 종류, 인자)를 기록 (종료 신호 None은 제외)
+    dispatched = []
+
+    def recorder(worker_id, put):
+        def record(job):
+            if job is not None:
+                dispatched.append((worker_id, job[1], job[2]))
+            put(job)
+        return record
+
+    for worker_id, job_queue in pool._job_queues.items():
+        job_queue.put = recorder(worker_id, job_queue.put)
+    return dispatched
+
+
+def test_interactive_questions_run_before_bulk_classification():
+    async def run():
+        pool = await _start_pool(1)
+        try:
+            order = []
+
+            def submit(name: str, kind: str, args: tuple, priority: int):
+                task = asyncio.ensure_future(pool.submit(kind, args, priority))
+                task.add_done_callback(lambda _: order.append(name))
+                return task
+
+            # 첫 분류가 워커를 차지한 동안 분류 2개 뒤에 질문이 들어옴
+            tasks = [
+                submit("classify-1", "classify", (["a.jpg"], ["a"]), PRIORITY_BULK),
+                submit("classify-2", "classify", (["b.jpg"], ["b"]), PRIORITY_BULK),
+                submit("classify-3", "classify", (["c.jpg"], ["c"]), PRIORITY_BULK),
+                submit("question", "stream_question", ("a.jpg", "q"), PRIORITY_INTERACTIVE),
+            ]
+            await asyncio.gather(*tasks)
+            return order
+        finally:
+            await pool.stop()
+
+    assert asyncio.run(run()) == ["classify-1", "question", "classify-2", "classify-3"]
+
+
+def test_jobs_for_a_defect_go_to_the_worker_that_has_its_features():
+    async def run():
+        pool = await _start_pool(2)
+        try:
+            dispatched = _record_dispatch(pool)
+            await asyncio.gather(
+                pool.submit("classify", (["a.jpg"], ["a"]), PRIORITY_BULK, keys=("a",)),
+                pool.submit("classify", (["b.jpg"], ["b"]), PRIORITY_BULK, keys=("b",)),
+            )
+            owners = {args[1][0]: worker_id for worker_id, _, args in dispatched}
+
+            # 두 워커가 모두 비어 있으면 질문은 분류를 처리한 워커로 감
+            for defect_id in ("b", "a", "a", "b"):
+                await pool.submit("stream_question", ("x.jpg", "q", defect_id), PRIORITY_INTERACTIVE, keys=(defect_id,))
+            return owners, dispatched[2:]
+        finally:
+            await pool.stop()
+
+    owners, questions = asyncio.run(run())
+    assert owners["a"] != owners["b"]
+    assert [worker_id for worker_id, _, _ in questions] == [owners[args[2]] for _, _, args in questions]
+
+
+def test_crashed_worker_is_respawned():
+    async def run():
+        pool = await _start_pool(1)
+        try:
+            old = pool._workers[0]
+            old.kill()
+
+            # 결과 수신 스레드가 1초마다 워커 상태를 확인하고 새로 띄움
+            deadline = time.monotonic() + 120
+            while pool._workers[0] is old or 0 not in pool._idle:
+                assert time.monotonic() < deadline, "워커가 다시 뜨지 않았습니다."
+                await asyncio.sleep(0.2)
+
+            answer = "".join([chunk async for chunk in pool.stream("stream_question", ("x.jpg", "q"))])
+            return old.pid, pool._workers[0].pid, answer
+        finally:
+            await pool.stop()
+
+    old_pid, new_pid, answer = asyncio.run(run())
+    assert new_pid != old_pid
+    assert answer == "[stub] q."
+
+
+def test_workers_report_feature_cache_size():
+    async def run():
+        pool = await _start_pool(2)
+        try:
+            await pool.submit("classify", (["a.jpg"], ["a"]), PRIORITY_BULK)
+            await asyncio.sleep(0.5) # 크기 보고는 작업 결과 뒤에 도착
+            return pool.feature_cache_bytes()
+        finally:
+            await pool.stop()
+
+    sizes = asyncio.run(run())
+    assert len(sizes) == 1
+    assert list(sizes.values()) == [(0, 0)] # 스텁은 시각 토큰을 만들지 않음
@@ -0,0 +1,54 @@
+import asyncio
+import base64
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+from main import app
+from models import DefectOut
+
+
+@pytest.fixture
+def client(data_dir):
+    # lifespan(모델, 워커 풀)은 띄우지 않음. DB 연결 풀이 없으면 호출마다 연결을 엶
+    asyncio.run(database.init_db())
+    return TestClient(app)
+
+
+def test_cursor_walks_every_defect_once(client):
+    async def fill():
+        for i in range(7):
+            await database.create_defect_in_db(DefectOut(
+                id=f"d{i}", latitude=37.45, longitude=126.65, image="x.jpg", detect_time="2025-01-01 12:00:00"
+            ))
+    asyncio.run(fill())
+
+    ids, cursor = [], None
+    while True:
+        response = client.get("/defects", params={"limit": 3, "fields": "id", **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        ids += [item["id"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert ids == [f"d{i}" for i in reversed(range(7))]
+
+
+def _encode(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!", # base64가 아님
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(), # JSON이 아님
+    _encode({"detect_time": "2025-01-01"}), # 목록이 아님
+    _encode(["2025-01-01 12:00:00"]), # 값이 하나
+    _encode(["2025-01-01 12:00:00", 3]), # id가 문자열이 아님
+])
+def test_malformed_cursor_is_rejected(client, cursor):
+    response = client.get("/defects", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "cursor 값이 올바르지 않습니다."
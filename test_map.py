@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import map
+from config import settings
+from database import init_db
+
+LAT, LON = 37.4500, 126.6530
+
+
+def _address_response(name: str = "인하로") -> dict:
+    return {
+        "status": {"code": 0, "message": "done"},
+        "results": [{
+            "region": {"area1": {"name": "인천광역시"}, "area2": {"name": "미추홀구"}},
+            "land": {"name": name, "number1": "100", "addition0": {"type": "building", "value": "인하대학교"}},
+        }],
+    }
+
+
+@pytest.fixture
+def naver(data_dir, monkeypatch):
+    """
+    네이버 API 대신 응답을 돌려주는 MockTransport를 끼우고, 받은 요청 수를 셉니다.
+    responses에 (상태 코드, JSON)을 넣어 두면 순서대로 돌려주고, 비면 정상 주소를 돌려줍니다.
+    """
+
+    monkeypatch.setattr(settings, "GEOCODE_RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(map, "geocode_cache", map.GeocodeCache(max_entries=100))
+    calls, responses = [], []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.params["coords"])
+        await asyncio.sleep(0.05) # 동시 조회가 겹치도록
+        status, body = responses.pop(0) if responses else (200, _address_response())
+        return httpx.Response(status, json=body)
+
+    async def run(coroutine):
+        map._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            await init_db()
+            return await coroutine()
+        finally:
+            await map.close_geocoder()
+
+    return calls, responses, lambda coroutine: asyncio.run(run(coroutine))
+
+
+def test_concurrent_lookups_in_one_cell_call_the_api_once(naver):
+    calls, _, run = naver
+
+    async def lookup():
+        # 1m 안쪽 좌표 5개 (같은 5m 칸)
+        return await asyncio.gather(*[map.get_address_from_coords(LAT + i * 1e-6, LON) for i in range(5)])
+
+    addresses = run(lookup)
+
+    assert len(calls) == 1
+    assert set(addresses) == {"인천광역시 미추홀구 인하로 100 인하대학교"}
+
+
+def test_503_is_retried(naver):
+    calls, responses, run = naver
+    responses.append((503, {}))
+
+    address = run(lambda: map.get_address_from_coords(LAT, LON))
+
+    assert len(calls) == 2
+    assert address == "인천광역시 미추홀구 인하로 100 인하대학교"
+
+
+def test_failures_are_cached_for_the_negative_ttl(naver, monkeypatch):
+    calls, responses, run = naver
+    responses.extend([(500, {})] * (settings.GEOCODE_RETRIES + 1))
+
+    assert run(lambda: map.get_address_from_coords(LAT, LON)) is None
+    assert len(calls) == settings.GEOCODE_RETRIES + 1
+
+    # 실패 TTL 동안은 API를 다시 부르지 않음
+    assert run(lambda: map.get_address_from_coords(LAT, LON)) is None
+    assert len(calls) == settings.GEOCODE_RETRIES + 1
+
+    now = time.time()
+    monkeypatch.setattr(map.time, "time", lambda: now + settings.GEOCODE_NEGATIVE_TTL_SECONDS + 1)
+    assert run(lambda: map.get_address_from_coords(LAT, LON)) == "인천광역시 미추홀구 인하로 100 인하대학교"
+    assert len(calls) == settings.GEOCODE_RETRIES + 2
+
+
+def test_sqlite_tier_survives_restart_until_ttl(naver, monkeypatch):
+    calls, responses, run = naver
+    run(lambda: map.get_address_from_coords(LAT, LON))
+
+    # 재시작: 메모리 캐시가 비어도 SQLite에서 찾음
+    map.geocode_cache.clear_memory()
+    assert run(lambda: map.get_address_from_coords(LAT, LON)) == "인천광역시 미추홀구 인하로 100 인하대학교"
+    assert len(calls) == 1
+
+    # 보관 기간이 지나면 다시 호출
+    map.geocode_cache.clear_memory()
+    responses.append((200, _address_response("새주소로")))
+    now = time.time()
+    monkeypatch.setattr(map.time, "time", lambda: now + settings.GEOCODE_CACHE_TTL_DAYS * 86400 + 1)
+    assert run(lambda: map.get_address_from_coords(LAT, LON)) == "인천광역시 미추홀구 새주소로 100 인하대학교"
+    assert len(calls) == 2
@@ -0,0 +1,26 @@
+from PIL import Image, ImageDraw
+
+from llava import find_red_box
+
+
+def _boxed_image(width: int, height: int, box: tuple[int, int, int, int], border: int) -> Image.Image:
+    image = Image.new("RGB", (width, height), (120, 130, 125))
+    ImageDraw.Draw(image).rectangle(box, outline=(230, 20, 20), width=border)
+    return image
+
+
+def test_red_box_on_wide_image():
+    # 2048px보다 넓으면 stride >= 2: 세로선의 열 수에 stride를 곱하면 정상 테두리도 빨간 면으로 걸러짐
+    box = (2700, 1200, 3300, 1800)
+    found = find_red_box(_boxed_image(6000, 3000, box, border=36))
+
+    assert found is not None
+    left, top, right, bottom = found
+    assert abs(left - box[0]) <= 2 and abs(top - box[1]) <= 2
+    assert abs(right - box[2]) <= 2 and abs(bottom - box[3]) <= 2
+
+
+def test_filled_red_area_is_not_a_box():
+    image = Image.new("RGB", (6000, 3000), (120, 130, 125))
+    ImageDraw.Draw(image).rectangle((2700, 1200, 3300, 1800), fill=(230, 20, 20))
+    assert find_red_box(image) is None
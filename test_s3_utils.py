@@ -0,0 +1,77 @@
+import asyncio
+import io
+
+import boto3
+import pytest
+from fastapi import UploadFile
+from moto import mock_aws
+
+import s3_utils
+from config import settings
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    for key in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"):
+        monkeypatch.setenv(key, "testing")
+    monkeypatch.setattr(settings, "S3_PART_SIZE_MB", 5) # S3 최소 파트 크기
+    monkeypatch.setattr(settings, "AWS_S3_BUCKET", "airovision-test")
+
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=settings.AWS_S3_BUCKET)
+        monkeypatch.setattr(s3_utils, "s3_client", client)
+        yield client
+
+
+class FailingFile(io.BytesIO):
+    # 첫 파트를 읽은 뒤 연결이 끊긴 업로드
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        if self.reads > 1:
+            raise ConnectionError("client disconnected")
+        return super().read(size)
+
+
+def _upload(data, s3_key: str):
+    file = UploadFile(file=data if isinstance(data, io.IOBase) else io.BytesIO(data), filename="a.jpg")
+    return asyncio.run(s3_utils.stream_upload(file, s3_key, "image/jpeg"))
+
+def _object(client, s3_key: str) -> bytes:
+    return client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=s3_key)["Body"].read()
+
+
+def test_large_file_is_uploaded_in_parts(bucket):
+    data = bytes(range(256)) * (11 * MB // 256 + 7) # 5MB + 5MB + 나머지
+
+    stats = _upload(data, "upload/large.jpg")
+
+    assert stats.parts == 3
+    assert stats.size == len(data)
+    assert stats.peak_buffered <= 2 * 5 * MB
+    assert _object(bucket, "upload/large.jpg") == data
+    assert bucket.head_object(Bucket=settings.AWS_S3_BUCKET, Key="upload/large.jpg")["ContentType"] == "image/jpeg"
+
+
+def test_small_file_is_uploaded_with_one_put(bucket):
+    data = b"\xff\xd8 small image"
+
+    stats = _upload(data, "upload/small.jpg")
+
+    assert stats.parts == 1
+    assert _object(bucket, "upload/small.jpg") == data
+    assert "Uploads" not in bucket.list_multipart_uploads(Bucket=settings.AWS_S3_BUCKET)
+
+
+def test_failed_upload_is_aborted(bucket):
+    with pytest.raises(ConnectionError):
+        _upload(FailingFile(b"x" * (6 * MB)), "upload/broken.jpg")
+
+    assert "Uploads" not in bucket.list_multipart_uploads(Bucket=settings.AWS_S3_BUCKET)
+    assert "Contents" not in bucket.list_objects_v2(Bucket=settings.AWS_S3_BUCKET)